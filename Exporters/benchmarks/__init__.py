@@ -0,0 +1 @@
+"""Benchmark harness for the exporters; see benchmarks/run.py."""
@@ -0,0 +1,238 @@
+"""
+Synthetic node fixtures for the benchmarks.
+
+``build_node`` lays out, under one directory:
+
+* ``proc/``: ``stat``, ``cgroup`` and ``io`` files for N processes spread over
+  M Slurm jobs, plus a share of processes outside any job;
+* ``cgroup/``: a cgroup v2 (or v1) Slurm hierarchy for the same jobs, with
+  ``cgroup.procs``, I/O, CPU, memory and PSI files;
+* ``bin/``: stub ``nvidia-smi``, ``scontrol`` and ``sreport`` executables. Each
+  one sleeps for a configurable latency, appends its name to ``$BENCH_CALL_LOG``
+  and prints canned output that matches the fake jobs.
+
+``seed_database`` fills a utilization database with months of GPU samples at
+the production sampling interval, plus CPU reports and storage samples.
+
+Everything is derived from a seed, so two runs with the same parameters
+produce the same trees.
+"""
+import os
+import random
+import shlex
+import socket
+import sqlite3
+import stat
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from poc_exporters.store import UtilizationStore
+
+
+@dataclass
+class NodeFixture:
+    root: str
+    proc_root: str
+    cgroup_root: str
+    bin_dir: str
+    jobs: dict  # job_id -> list of PIDs
+    gpus: int
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _stat_line(pid, start_time):
+    # Field 22 (start time) is the 20th field after the command name.
+    return f"{pid} (python3) S 1 " + ' '.join(['0'] * 17) + f" {start_time} 0 0\n"
+
+
+def _job_cgroup(job_id, uid, version):
+    if version == 2:
+        return f'system.slice/slurmstepd.scope/job_{job_id}'
+    return f'{{controller}}/slurm/uid_{uid}/job_{job_id}'
+
+
+def write_stub(bin_dir, name, body, latency=0.0):
+    """
+    Writes a stub executable.
+
+    :param bin_dir: Directory to put it in (first on PATH in the benchmark).
+    :param name: Executable name.
+    :param body: Shell code producing the output; ``$@`` holds the arguments.
+    :param latency: Seconds the stub sleeps before answering.
+    :return: Path of the stub.
+    """
+    path = os.path.join(bin_dir, name)
+    script = ['#!/bin/sh',
+              f'[ -n "$BENCH_CALL_LOG" ] && echo {shlex.quote(name)} >> "$BENCH_CALL_LOG"']
+    if latency:
+        script.append(f'sleep {latency}')
+    script.append(body)
+    _write(path, '\n'.join(script) + '\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def build_node(root, jobs=8, processes=256, gpus=8, latency=0.05, cgroup_version=2,
+               hostname=None, seed=0):
+    """
+    Builds the fake /proc, cgroup tree and tool stubs of one node.
+
+    :param root: Directory to build in (created if missing).
+    :param jobs: Number of Slurm jobs on the node.
+    :param processes: Number of processes; a quarter of them belong to no job.
+    :param gpus: Number of GPUs reported by the nvidia-smi stub.
+    :param latency: Seconds every stub tool sleeps before answering.
+    :param cgroup_version: 2 for the unified hierarchy, 1 for per-controller hierarchies.
+    :param hostname: Node name scontrol reports the GRES detail for (defaults to this host).
+    :param seed: Random seed.
+    :return: NodeFixture.
+    """
+    rng = random.Random(seed)
+    hostname = hostname or socket.gethostname().split('.', 1)[0]
+    proc_root = os.path.join(root, 'proc')
+    cgroup_root = os.path.join(root, 'cgroup')
+    bin_dir = os.path.join(root, 'bin')
+    data_dir = os.path.join(root, 'data')
+
+    job_ids = [100000 + index for index in range(jobs)]
+    job_pids = {job_id: [] for job_id in job_ids}
+    outside = processes // 4 if jobs else processes
+    for index in range(processes):
+        pid = 1000 + index
+        job_id = job_ids[index % jobs] if jobs and index >= outside else None
+        if job_id is None:
+            cgroup = '0::/user.slice/user-0.slice/session-1.scope\n'
+        else:
+            job_pids[job_id].append(pid)
+            cgroup = f'0::/{_job_cgroup(job_id, 1000, 2)}/step_0/user/task_0\n'
+            if cgroup_version == 1:
+                cgroup = ''.join(f'{n}:{c}:/slurm/uid_1000/job_{job_id}/step_0/task_0\n'
+                                 for n, c in enumerate(('memory', 'cpu,cpuacct', 'blkio'), 2))
+        base = os.path.join(proc_root, str(pid))
+        _write(os.path.join(base, 'stat'), _stat_line(pid, 5000 + index))
+        _write(os.path.join(base, 'cgroup'), cgroup)
+        _write(os.path.join(base, 'io'), f'rchar: 0\nwchar: 0\nread_bytes: {rng.randrange(1 << 30)}\n'
+                                         f'write_bytes: {rng.randrange(1 << 30)}\n')
+
+    for job_id, pids in job_pids.items():
+        procs = ''.join(f'{pid}\n' for pid in pids)
+        usage = rng.randrange(10 ** 6, 10 ** 10)
+        if cgroup_version == 2:
+            job = os.path.join(cgroup_root, _job_cgroup(job_id, 1000, 2))
+            _write(os.path.join(job, 'step_0', 'cgroup.procs'), procs)
+            _write(os.path.join(job, 'io.stat'), f'8:0 rbytes={rng.randrange(1 << 34)} wbytes={rng.randrange(1 << 34)} '
+                                                 f'rios=1 wios=1 dbytes=0 dios=0\n')
+            _write(os.path.join(job, 'cpu.stat'), f'usage_usec {usage}\nuser_usec {usage}\nsystem_usec 0\n'
+                                                  f'nr_periods 100\nnr_throttled 3\nthrottled_usec 1500\n')
+            _write(os.path.join(job, 'memory.current'), f'{rng.randrange(1 << 34)}\n')
+            _write(os.path.join(job, 'memory.peak'), f'{1 << 35}\n')
+            for resource in ('cpu', 'memory', 'io'):
+                _write(os.path.join(job, f'{resource}.pressure'),
+                       'some avg10=0.00 avg60=0.00 avg300=0.00 total=1234\n'
+                       'full avg10=0.00 avg60=0.00 avg300=0.00 total=567\n')
+        else:
+            template = _job_cgroup(job_id, 1000, 1)
+            for controller in ('memory', 'cpu,cpuacct', 'blkio'):
+                job = os.path.join(cgroup_root, template.format(controller=controller))
+                _write(os.path.join(job, 'step_0', 'cgroup.procs'), procs)
+            cpu = os.path.join(cgroup_root, template.format(controller='cpu,cpuacct'))
+            _write(os.path.join(cpu, 'cpuacct.usage'), f'{usage * 1000}\n')
+            _write(os.path.join(cpu, 'cpu.stat'), 'nr_periods 100\nnr_throttled 3\nthrottled_time 1500000\n')
+            memory = os.path.join(cgroup_root, template.format(controller='memory'))
+            _write(os.path.join(memory, 'memory.usage_in_bytes'), f'{rng.randrange(1 << 34)}\n')
+            _write(os.path.join(memory, 'memory.max_usage_in_bytes'), f'{1 << 35}\n')
+            blkio = os.path.join(cgroup_root, template.format(controller='blkio'))
+            _write(os.path.join(blkio, 'blkio.throttle.io_service_bytes_recursive'),
+                   f'8:0 Read {rng.randrange(1 << 34)}\n8:0 Write {rng.randrange(1 << 34)}\nTotal 0\n')
+
+    # Two processes of every job run on the job's GPU.
+    gpu_rows = [f'GPU-{index:08x}-0000-0000-0000-000000000000, {index}, NVIDIA A100-SXM4-80GB, '
+                f'{rng.randrange(101)}, {rng.randrange(81920)}, 81920\n' for index in range(gpus)]
+    app_rows = []
+    for position, (job_id, pids) in enumerate(job_pids.items()):
+        if not gpus:
+            break
+        uuid = f'GPU-{position % gpus:08x}-0000-0000-0000-000000000000'
+        app_rows.extend(f'{pid}, {rng.randrange(1, 40960)}, {uuid}\n' for pid in pids[:2])
+    _write(os.path.join(data_dir, 'gpus.csv'), ''.join(gpu_rows))
+    _write(os.path.join(data_dir, 'apps.csv'), ''.join(app_rows))
+
+    data = shlex.quote(data_dir)
+    write_stub(bin_dir, 'nvidia-smi', f"""case "$1" in
+--query-gpu=*) cat {data}/gpus.csv ;;
+--query-compute-apps=*) cat {data}/apps.csv ;;
+*) echo "stub nvidia-smi: unsupported arguments $*" >&2; exit 2 ;;
+esac""", latency)
+    # scontrol -d -o show job <id>
+    write_stub(bin_dir, 'scontrol', f"""job="$5"
+echo "JobId=$job JobName=bench UserId=user$((job % 7))(1000) GroupId=users(100) Account=acct$((job % 5)) \
+Partition=gpu JobState=RUNNING NodeList={hostname} TresPerNode=gres/gpu:a100:1 \
+Nodes={hostname} CPU_IDs=0-7 Mem=65536 GRES=gpu:a100:1(IDX:$((job % {max(gpus, 1)})))"
+""", latency)
+    write_stub(bin_dir, 'sreport', """case "$*" in
+*AccountUtilizationByUser*)
+  echo "Account|CPU_Hours|GPU_Hours"
+  for account in acct0 acct1 acct2 acct3 acct4; do echo "$account|1234.5|56.7"; done ;;
+*)
+  echo "Cluster Utilization"
+  echo "--------------------------------------------------------------------------------"
+  echo "Cluster|Allocated|Down|PLND Down|Idle|Reported"
+  echo "bench|1234567|0|0|7654|1242221" ;;
+esac""", latency)
+    return NodeFixture(root, proc_root, cgroup_root, bin_dir, job_pids, gpus)
+
+
+def seed_database(path, days=30, gpus=8, interval=30, accounts=5, now=None, seed=0):
+    """
+    Creates a utilization database holding ``days`` days of history, as monitoring.py
+    would have written it.
+
+    :param path: Database file to create.
+    :param days: Days of history.
+    :param gpus: GPUs sampled on each round (the ``gpu<N>`` accounts of monitoring.py).
+    :param interval: Seconds between two GPU samples.
+    :param accounts: Slurm accounts in the CPU reports.
+    :param now: End of the history (defaults to now).
+    :param seed: Random seed.
+    :return: Number of raw GPU rows written.
+    """
+    rng = random.Random(seed)
+    now = (now or datetime.now()).replace(microsecond=0)
+    UtilizationStore(path).close()  # creates the schema
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    start = now - timedelta(days=days)
+    rounds = int(days * 86400 // interval)
+
+    def gpu_rows():
+        for step in range(rounds):
+            timestamp = (start + timedelta(seconds=step * interval)).strftime('%Y-%m-%d %H:%M:%S')
+            for index in range(gpus):
+                yield timestamp, f'gpu{index}', rng.random() * 100
+
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO gpu_utilization_raw (timestamp, account, utilization_percent) VALUES (?, ?, ?)",
+                     gpu_rows())
+    for day in range(days):
+        for period in ('7days', '30days'):
+            conn.executemany("INSERT INTO cpu_utilization (period, account, cpu_hours, gpu_hours) VALUES (?, ?, ?, ?)",
+                             [(period, f'acct{a}', rng.random() * 1e5, rng.random() * 1e3) for a in range(accounts)])
+    storage = []
+    for step in range(days * 96):  # every 15 minutes
+        moment = start + timedelta(minutes=15 * step)
+        used = (400 + step * 0.01) * 1024 ** 4
+        storage.append((moment.strftime('%Y-%m-%d %H:%M:%S'), moment.strftime('%Y-%m-%d'), '/rs01',
+                        used / 1024 ** 3, 100 * used / 1024 ** 5, 1024 ** 5, int(used), int(1024 ** 5 - used),
+                        10 ** 9, 10 ** 8))
+    conn.executemany("""INSERT INTO storage_usage (timestamp, date, mount, usage_gb, usage_percent, total_bytes,
+                                                   used_bytes, avail_bytes, total_inodes, used_inodes)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", storage)
+    conn.execute("COMMIT")
+    conn.close()
+    return rounds * gpus
@@ -0,0 +1,434 @@
+"""
+Benchmarks of the exporters' hot paths against synthetic nodes.
+
+For every scale, a fake node (``fixtures.build_node``) and a seeded utilization
+database (``fixtures.seed_database``) are built in a scratch directory. Each
+scenario then runs in a fresh interpreter with PATH, PROC_ROOT, CGROUP_ROOT and
+the output paths pointed at the fixtures. Per scenario the results hold:
+
+* wall time of every repetition (and min/median/mean/max);
+* external tool executions per repetition, by tool, counted by the stubs;
+* peak RSS of the interpreter, and its RSS before the exporter was imported.
+
+Results are written as JSON. With ``--baseline`` a previous result file is
+compared, and the exit status is 1 if any median got slower than the threshold.
+
+    cd Exporters && python3 -m benchmarks.run --scale small,medium --output results.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import runpy
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from benchmarks.fixtures import build_node, seed_database
+
+EXPORTERS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GPU_METRICS_SCRIPT = os.path.join(os.path.dirname(EXPORTERS_DIR), 'Metrics Exporter', 'gpu_metrics.py')
+
+# name -> (jobs, processes, gpus, days of database history)
+SCALES = {
+    'small': (4, 64, 4, 7),
+    'medium': (16, 512, 8, 30),
+    'large': (64, 4096, 8, 90),
+}
+
+SCENARIOS = (
+    'nvidia_gpu_exporter.main',
+    'exporter.sample_once',
+    'exporter.startup_cpu_only',
+    'gpu_metrics.py',
+    'cpu_usage.main',
+    'monitoring.aggregates',
+    'ring.hour_of_samples',
+)
+
+
+# ----- child side: runs one scenario in this interpreter -----
+
+def _timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def _bench_nvidia_main(repeat, workdir):
+    module = importlib.import_module('nvidia_gpu_exporter')
+    module.OUTPUT_FILE = os.path.join(workdir, 'metrics.prom')
+    module.STATUS_FILE = os.path.join(workdir, 'nvidia_gpu_exporter_status.prom')
+    sys.argv = ['nvidia_gpu_exporter.py']
+    return {'run': [_timed(module.main) for _ in range(repeat)]}, repeat
+
+
+def _bench_exporter_sample_once(repeat, workdir):
+    from poc_exporters.collectors import DEFAULT_COLLECTORS, Options
+    from poc_exporters.exporter import NodeExporter
+    from poc_exporters.textfile import MetricFamily
+
+    exporter = NodeExporter(DEFAULT_COLLECTORS, Options(gpu_window=True), namespace='bench')
+    timings = {'first_round': [_timed(exporter.sample_once)], 'round': [], 'build': []}
+    for _ in range(repeat):
+        timings['round'].append(_timed(exporter.sample_once))
+        timings['build'].append(_timed(lambda: exporter.build(MetricFamily)))
+    exporter.close()
+    return timings, repeat + 1
+
+
+def _bench_exporter_startup(repeat, workdir):
+    # A CPU-only node: the GPU sampler and the command runner must not be imported.
+    command = [sys.executable, '-m', 'poc_exporters', '--collectors', 'cpu,io', '--once',
+               '--textfile', os.path.join(workdir, 'poc_exporters.prom')]
+
+    def run():
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return {'run': [_timed(run) for _ in range(repeat)]}, repeat
+
+
+def _bench_gpu_metrics(repeat, workdir):
+    sys.path.insert(0, EXPORTERS_DIR)
+
+    def run():
+        try:
+            runpy.run_path(GPU_METRICS_SCRIPT, run_name='__main__')
+        except SystemExit as e:
+            if e.code:
+                raise RuntimeError(f"gpu_metrics.py exited with status {e.code}")
+    return {'run': [_timed(run) for _ in range(repeat)]}, repeat
+
+
+def _bench_cpu_usage(repeat, workdir):
+    module = importlib.import_module('cpu_usage')
+    module.PROMETHEUS_FILE = os.path.join(workdir, 'cpu_usage_report.prom')
+    module.STATUS_FILE = os.path.join(workdir, 'cpu_usage_report_status.prom')
+
+    def cold():
+        # Every repetition is the node that actually queries slurmdbd.
+        shutil.rmtree(module.sreport.cache_dir, ignore_errors=True)
+        os.makedirs(module.sreport.cache_dir)
+        module.sreport._memory.clear()
+        module.main()
+    timings = {'cold': [_timed(cold) for _ in range(repeat)]}
+    timings['cached'] = [_timed(module.main) for _ in range(repeat)]
+    return timings, 2 * repeat
+
+
+def _bench_monitoring(repeat, workdir):
+    module = importlib.import_module('monitoring')
+    from poc_exporters.aggregates import StreamingAggregator
+    from poc_exporters.textfile import MetricFamily
+
+    timings = {}
+
+    def measure(name, func):
+        timings.setdefault(name, []).append(_timed(func))
+
+    def seed_windows():
+        windows = StreamingAggregator({"week": 7 * 86400, "month": 30 * 86400})
+        windows.seed_from_store(module.store, raw_since=module.retention.watermark("minute"))
+
+    # The first retention run rolls up the whole seeded history; later ones are incremental.
+    measure('retention_backfill', module.retention.run)
+    for _ in range(repeat):
+        measure('retention_run', module.retention.run)
+        measure('aggregate_daily_gpu', module.aggregate_daily_gpu)
+        measure('aggregate_weekly_gpu', module.aggregate_weekly_gpu)
+        measure('aggregate_monthly_gpu', module.aggregate_monthly_gpu)
+        measure('aggregate_monthly_storage', module.aggregate_monthly_storage)
+        measure('build_accounting_families', lambda: module.build_accounting_families(MetricFamily))
+        measure('seed_windows', seed_windows)
+    module.store.close()
+    return timings, repeat + 1
+
+
+def _bench_ring(repeat, workdir):
+    # An hour of 1 s samples of 8 GPUs: a database row per GPU and sample, or the ring plus its minute means.
+    from poc_exporters.ring import SampleRing, downsample
+    from poc_exporters.store import UtilizationStore
+
+    gpus, samples, start = 8, 3600, time.time() - 3600
+    utilization, memory, jobs = [50.0] * gpus, [2.0 ** 30] * gpus, [4242] * gpus
+    timings = {}
+
+    def store_rows():
+        store = UtilizationStore(os.path.join(workdir, 'rows.db'))
+        for index in range(samples):
+            stamp = datetime.fromtimestamp(start + index)
+            store.put_many('gpu_utilization_raw', [(stamp, 'acct', value, 1) for value in utilization])
+        store.close()
+
+    ring = SampleRing(os.path.join(workdir, 'gpu.ring'), gpus=gpus, slots=86400, create=True)
+    reader = SampleRing(os.path.join(workdir, 'gpu.ring'))
+
+    def append():
+        for index in range(samples):
+            ring.append(start + index, utilization, memory, jobs)
+
+    def read_and_downsample():
+        downsample(reader.read(ring.committed() - samples), 60)
+
+    for _ in range(repeat):
+        timings.setdefault('store_rows', []).append(_timed(store_rows))
+        timings.setdefault('ring_append', []).append(_timed(append))
+        timings.setdefault('ring_read_downsample', []).append(_timed(read_and_downsample))
+    reader.close()
+    ring.close()
+    return timings, repeat
+
+
+CHILD_SCENARIOS = {
+    'nvidia_gpu_exporter.main': _bench_nvidia_main,
+    'exporter.sample_once': _bench_exporter_sample_once,
+    'exporter.startup_cpu_only': _bench_exporter_startup,
+    'gpu_metrics.py': _bench_gpu_metrics,
+    'cpu_usage.main': _bench_cpu_usage,
+    'monitoring.aggregates': _bench_monitoring,
+    'ring.hour_of_samples': _bench_ring,
+}
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB on Linux
+
+
+def run_child(scenario, repeat, workdir, result_path):
+    """
+    Runs one scenario and writes its raw measurements to ``result_path``.
+
+    :param scenario: Key of CHILD_SCENARIOS.
+    :param repeat: Number of measured repetitions.
+    :param workdir: Directory for the scenario's output files.
+    :param result_path: JSON file the measurements are written to.
+    """
+    result = {'rss_baseline_kb': _peak_rss_kb()}
+    try:
+        result['timings'], result['iterations'] = CHILD_SCENARIOS[scenario](repeat, workdir)
+    except ImportError as e:
+        result['skipped'] = f"missing dependency: {e}"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['peak_rss_kb'] = _peak_rss_kb()
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+# ----- parent side: fixtures, one child per scenario, report -----
+
+def summarize(values):
+    """
+    :param values: Durations in seconds.
+    :return: A dictionary with the raw runs and their min/median/mean/max.
+    """
+    return {'runs': values, 'min': min(values), 'median': statistics.median(values),
+            'mean': statistics.fmean(values), 'max': max(values)}
+
+
+def run_scenario(scenario, fixture, db_path, repeat, workdir, timeout):
+    """
+    Runs one scenario in a child interpreter against a fixture.
+
+    :return: The scenario's result dictionary.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    call_log = os.path.join(workdir, 'calls.log')
+    result_path = os.path.join(workdir, 'result.json')
+    env = dict(os.environ)
+    env.update({
+        'PATH': fixture.bin_dir + os.pathsep + env.get('PATH', ''),
+        'PYTHONPATH': EXPORTERS_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+        'PROC_ROOT': fixture.proc_root,
+        'CGROUP_ROOT': fixture.cgroup_root,
+        'GPU_BACKEND': 'nvidia-smi',
+        'BENCH_CALL_LOG': call_log,
+        'SREPORT_CACHE_DIR': os.path.join(workdir, 'sreport-cache'),
+        'TEXTFILE_COLLECTOR_DIR': workdir,
+        'UTILIZATION_DB': os.path.join(workdir, 'utilization.db'),
+        'STORAGE_MOUNTS': workdir,
+        'PROFILE_DIR': workdir,
+    })
+    if scenario == 'monitoring.aggregates':
+        shutil.copy(db_path, env['UTILIZATION_DB'])
+    command = [sys.executable, '-m', 'benchmarks.run', '--child', scenario, '--repeat', str(repeat),
+               '--workdir', workdir, '--result', result_path]
+    started = time.perf_counter()
+    try:
+        process = subprocess.run(command, cwd=EXPORTERS_DIR, env=env, stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'scenario': scenario, 'error': f"timed out after {timeout}s"}
+    elapsed = time.perf_counter() - started
+    try:
+        with open(result_path, 'r') as f:
+            raw = json.load(f)
+    except (OSError, ValueError):
+        stderr = process.stderr.decode('utf-8', 'replace').strip().splitlines()
+        return {'scenario': scenario, 'error': f"child exited with status {process.returncode}: "
+                                               f"{stderr[-1] if stderr else 'no output'}"}
+
+    result = {'scenario': scenario, 'wall_seconds': elapsed,
+              'rss_baseline_kb': raw['rss_baseline_kb'], 'peak_rss_kb': raw['peak_rss_kb']}
+    for key in ('skipped', 'error'):
+        if key in raw:
+            result[key] = raw[key]
+    timings = raw.get('timings') or {}
+    result['timings'] = {name: summarize(values) for name, values in timings.items() if values}
+    try:
+        with open(call_log, 'r') as f:
+            calls = Counter(line.strip() for line in f if line.strip())
+    except OSError:
+        calls = Counter()
+    iterations = raw.get('iterations') or 1
+    result['iterations'] = iterations
+    result['tool_calls'] = dict(sorted(calls.items()))
+    result['tool_calls_per_run'] = {tool: count / iterations for tool, count in sorted(calls.items())}
+    return result
+
+
+def run_scale(name, jobs, processes, gpus, days, args, scratch):
+    """
+    Builds the fixtures of one scale and runs every selected scenario against them.
+
+    :return: A list of scenario result dictionaries.
+    """
+    root = os.path.join(scratch, name)
+    started = time.perf_counter()
+    fixture = build_node(os.path.join(root, 'node'), jobs=jobs, processes=processes, gpus=gpus,
+                         latency=args.latency, cgroup_version=args.cgroup_version, seed=args.seed)
+    db_path = None
+    raw_rows = 0
+    if 'monitoring.aggregates' in args.scenarios:
+        db_path = os.path.join(root, 'utilization.db')
+        raw_rows = seed_database(db_path, days=days, gpus=gpus, seed=args.seed,
+                                 now=datetime.now() - timedelta(minutes=5))
+    setup_seconds = time.perf_counter() - started
+    params = {'jobs': jobs, 'processes': processes, 'gpus': gpus, 'days': days, 'raw_rows': raw_rows,
+              'latency': args.latency, 'cgroup_version': args.cgroup_version, 'repeat': args.repeat,
+              'setup_seconds': setup_seconds}
+    results = []
+    for scenario in args.scenarios:
+        print(f"[INFO] {name}: {scenario}", file=sys.stderr)
+        result = run_scenario(scenario, fixture, db_path, args.repeat,
+                              os.path.join(root, 'work', scenario), args.timeout)
+        result['scale'] = name
+        result['params'] = params
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :param results: Result dictionaries of this run.
+    :param baseline: Result dictionaries of an earlier run.
+    :param threshold: Allowed relative slowdown of a median, e.g. 0.2 for 20%.
+    :return: A list of regression dictionaries.
+    """
+    previous = {}
+    for result in baseline:
+        for name, stats in result.get('timings', {}).items():
+            previous[(result.get('scale'), result.get('scenario'), name)] = stats['median']
+    regressions = []
+    for result in results:
+        for name, stats in result.get('timings', {}).items():
+            before = previous.get((result['scale'], result['scenario'], name))
+            if before and stats['median'] > before * (1 + threshold):
+                regressions.append({'scale': result['scale'], 'scenario': result['scenario'], 'timing': name,
+                                    'baseline_median': before, 'median': stats['median'],
+                                    'ratio': stats['median'] / before})
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=EXPORTERS_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the exporters against synthetic nodes.")
+    parser.add_argument("--scale", default="small",
+                        help=f"comma-separated presets ({', '.join(SCALES)}) or 'custom' with the options below")
+    parser.add_argument("--jobs", type=int, default=8, help="jobs on the node ('custom' scale)")
+    parser.add_argument("--processes", type=int, default=256, help="processes on the node ('custom' scale)")
+    parser.add_argument("--gpus", type=int, default=8, help="GPUs on the node ('custom' scale)")
+    parser.add_argument("--days", type=int, default=30, help="days of database history ('custom' scale)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds every stub tool takes to answer")
+    parser.add_argument("--cgroup-version", type=int, choices=(1, 2), default=2)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma-separated scenarios to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="measured repetitions per scenario")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds before a scenario is abandoned")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown of a median reported as a regression")
+    parser.add_argument("--keep", action="store_true", help="keep the fixtures and outputs")
+    # Internal: run a single scenario in this process.
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.repeat, args.workdir, args.result)
+        return 0
+
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = [s for s in args.scenarios if s not in CHILD_SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    scales = []
+    for name in [s for s in args.scale.split(",") if s]:
+        if name == 'custom':
+            scales.append((name, args.jobs, args.processes, args.gpus, args.days))
+        elif name in SCALES:
+            scales.append((name,) + SCALES[name])
+        else:
+            parser.error(f"unknown scale: {name}")
+
+    scratch = tempfile.mkdtemp(prefix='poc-exporters-bench-')
+    results = []
+    try:
+        for scale in scales:
+            results.extend(run_scale(*scale, args, scratch))
+    finally:
+        if args.keep:
+            print(f"[INFO] Fixtures kept in {scratch}", file=sys.stderr)
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'revision': _git_revision(),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'cpus': os.cpu_count(), 'results': results}
+    status = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report['regressions'] = compare(results, json.load(f).get('results', []), args.threshold)
+        for regression in report['regressions']:
+            print(f"[WARN] Regression: {regression['scale']} {regression['scenario']} {regression['timing']} "
+                  f"{regression['baseline_median']:.4f}s -> {regression['median']:.4f}s", file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,63 +1,62 @@
 #!/usr/bin/python3
-import subprocess
 import os
-import time
 import datetime
 
-PROMETHEUS_FILE = "/var/lib/node_exporter/textfile_collector/cpu_usage_report.prom"
+from poc_exporters.instrumentation import Instrumentation
+from poc_exporters.sreport import SreportClient, SreportError
+from poc_exporters.textfile import MetricFamily, TextfileWriter
 
-def run_command(cmd):
-    """Runs a shell command and returns the output."""
-    try:
-        result = subprocess.check_output(cmd, shell=True).decode("utf-8").strip()
-        return result
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {cmd}\n{e}")
-        return ""
+PROMETHEUS_FILE = "/var/lib/node_exporter/textfile_collector/cpu_usage_report.prom"
+STATUS_FILE = "/var/lib/node_exporter/textfile_collector/cpu_usage_report_status.prom"
+SLURM_CLUSTER = os.environ.get("SLURM_CLUSTER")  # defaults to the first cluster sreport lists
+
+# One node per cluster runs sreport; the others read its cached result from SREPORT_CACHE_DIR.
+sreport = SreportClient(ttl=int(os.environ.get("SREPORT_CACHE_TTL", "3600")))
+instrumentation = Instrumentation("cpu_usage_report")
+
+def get_cluster_allocated(start, end):
+    """Returns the allocated CPU minutes of the cluster between two dates, via the shared sreport cache."""
+    with instrumentation.track("sreport"):
+        try:
+            rows = sreport.query(("cluster", "Utilization"), start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        except SreportError as e:
+            instrumentation.error("sreport", "sreport")
+            print(f"Error executing sreport: {e}")
+            return 0
+        for row in rows:
+            if SLURM_CLUSTER is None or row.get("Cluster") == SLURM_CLUSTER:
+                try:
+                    return float(row.get("Allocated", ""))  # Convert CPU minutes to float
+                except ValueError:
+                    instrumentation.error("sreport", "parse")
+                    return 0
+        instrumentation.error("sreport", "no_cluster")
+        return 0
 
 def get_weekly_cpu_utilization():
     """Fetches CPU utilization for the past 7 days using `sreport`."""
     today = datetime.date.today()
     seven_days_ago = today - datetime.timedelta(days=7)
-
-    cmd = f"""sreport cluster Utilization start={seven_days_ago.strftime('%Y-%m-%d')} end={today.strftime('%Y-%m-%d')} | awk '/slurm/ {{print $2}}'"""
-    output = run_command(cmd)
-
-    try:
-        return float(output)  # Convert CPU minutes to float
-    except ValueError:
-        return 0
+    return get_cluster_allocated(seven_days_ago, today)
 
 def get_monthly_cpu_utilization():
     """Fetches CPU utilization for the last full month using `sreport`."""
     today = datetime.date.today()
     first_day_of_month = today.replace(day=1)
     last_day_of_month = (first_day_of_month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
-
-    cmd = f"""sreport cluster Utilization start={first_day_of_month.strftime('%Y-%m-%d')} end={last_day_of_month.strftime('%Y-%m-%d')} | awk '/slurm/ {{print $2}}'"""
-    output = run_command(cmd)
-
-    try:
-        return float(output)  # Convert CPU minutes to float
-    except ValueError:
-        return 0
+    return get_cluster_allocated(first_day_of_month, last_day_of_month)
 
 def write_to_prometheus(cpu_weekly, cpu_monthly):
     """Writes CPU utilization data to a Prometheus file."""
-    timestamp = int(time.time())
+    weekly = MetricFamily("slurm_cpus_avg_weekly", "Average CPU usage (minutes) over the past week")
+    weekly.add_metric([], cpu_weekly)
+    monthly = MetricFamily("slurm_cpus_avg_monthly", "Average CPU usage (minutes) over the past month")
+    monthly.add_metric([], cpu_monthly)
 
-    metrics = f"""# HELP slurm_cpus_avg_weekly Average CPU usage (minutes) over the past week
-# TYPE slurm_cpus_avg_weekly gauge
-slurm_cpus_avg_weekly {cpu_weekly} {timestamp}
-
-# HELP slurm_cpus_avg_monthly Average CPU usage (minutes) over the past month
-# TYPE slurm_cpus_avg_monthly gauge
-slurm_cpus_avg_monthly {cpu_monthly} {timestamp}
-"""
-
-    with open(PROMETHEUS_FILE, "w") as f:
-        f.write(metrics)
-    print(f"Metrics written to {PROMETHEUS_FILE}")
+    if TextfileWriter(PROMETHEUS_FILE).write([weekly, monthly]):
+        print(f"Metrics written to {PROMETHEUS_FILE}")
+    else:
+        print(f"Metrics unchanged, {PROMETHEUS_FILE} left as is")
 
 def main():
     """Main function to calculate and save CPU utilization metrics."""
@@ -72,6 +71,7 @@ def main():
     cpu_weekly = get_weekly_cpu_utilization()
 
     write_to_prometheus(cpu_weekly, cpu_monthly)
+    TextfileWriter(STATUS_FILE).write(instrumentation.textfile_families())
 
 if __name__ == "__main__":
     main()
@@ -35,14 +35,122 @@ var (
 		Name: "io_write_bytes",
 		Help: "IO write bytes.",
 	}, []string{"pid", "job_id"})
+
+	seriesMetric = prometheus.NewGaugeVec(prometheus.GaugeOpts{
+		Name: "gpu_io_exporter_series",
+		Help: "Label sets of a metric family set within the expiry window.",
+	}, []string{"family"})
+
+	seriesDroppedMetric = prometheus.NewCounterVec(prometheus.CounterOpts{
+		Name: "gpu_io_exporter_series_dropped_total",
+		Help: "Samples folded into the overflow series or dropped because their family reached the series limit.",
+	}, []string{"family"})
+
+	seriesExpiredMetric = prometheus.NewCounterVec(prometheus.CounterOpts{
+		Name: "gpu_io_exporter_series_expired_total",
+		Help: "Label sets deleted after not being set for the expiry number of rounds.",
+	}, []string{"family"})
+
+	maxSeries    = envInt("MAX_SERIES_PER_FAMILY", 1000)
+	seriesExpiry = envInt("SERIES_EXPIRY_ROUNDS", 5)
+
+	gpuUtilizationSeries = newSeriesTracker("gpu_utilization", gpuUtilizationMetric, 2, true)
+	gpuMemoryUsageSeries = newSeriesTracker("gpu_memory_usage_bytes", gpuMemoryUsageMetric, 2, true)
+	// Cumulative byte counts: a sum over whichever processes are folded would go down as slots expire.
+	ioReadBytesSeries  = newSeriesTracker("io_read_bytes", ioReadBytesMetric, 2, false)
+	ioWriteBytesSeries = newSeriesTracker("io_write_bytes", ioWriteBytesMetric, 2, false)
+	allSeries          = []*seriesTracker{gpuUtilizationSeries, gpuMemoryUsageSeries, ioReadBytesSeries, ioWriteBytesSeries}
 )
 
+const overflowLabel = "__overflow__"
+
+// seriesTracker deletes the label sets of a GaugeVec that were not set for seriesExpiry rounds,
+// so finished jobs and processes do not stay exported forever. Once maxSeries label sets are
+// tracked, values of new label sets are summed into one series whose labels are all "__overflow__",
+// or dropped if the values are cumulative (fold is false). Only the collection goroutine uses a tracker.
+type seriesTracker struct {
+	name     string
+	vec      *prometheus.GaugeVec
+	labels   int
+	fold     bool
+	round    int
+	seen     map[string][]string // joined label values -> label values
+	lastSeen map[string]int      // joined label values -> round in which they were last set
+	overflow float64
+	folded   bool
+}
+
+func newSeriesTracker(name string, vec *prometheus.GaugeVec, labels int, fold bool) *seriesTracker {
+	return &seriesTracker{
+		name:     name,
+		vec:      vec,
+		labels:   labels,
+		fold:     fold,
+		seen:     make(map[string][]string),
+		lastSeen: make(map[string]int),
+	}
+}
+
+// set sets the gauge of one label set, or adds the value to the overflow series (or drops it)
+// if the limit is reached.
+func (t *seriesTracker) set(value float64, labels ...string) {
+	key := strings.Join(labels, "\xff")
+	if _, exists := t.seen[key]; !exists {
+		if maxSeries > 0 && len(t.seen) >= maxSeries {
+			if t.fold {
+				t.overflow += value
+				t.folded = true
+			}
+			seriesDroppedMetric.WithLabelValues(t.name).Inc()
+			return
+		}
+		t.seen[key] = labels
+	}
+	t.lastSeen[key] = t.round
+	t.vec.WithLabelValues(labels...).Set(value)
+}
+
+// endRound publishes the overflow series and deletes the label sets that expired.
+func (t *seriesTracker) endRound() {
+	overflow := make([]string, t.labels)
+	for i := range overflow {
+		overflow[i] = overflowLabel
+	}
+	if t.folded {
+		t.vec.WithLabelValues(overflow...).Set(t.overflow)
+	} else {
+		t.vec.DeleteLabelValues(overflow...)
+	}
+	t.overflow, t.folded = 0, false
+
+	for key, last := range t.lastSeen {
+		if t.round-last >= seriesExpiry {
+			t.vec.DeleteLabelValues(t.seen[key]...)
+			delete(t.seen, key)
+			delete(t.lastSeen, key)
+			seriesExpiredMetric.WithLabelValues(t.name).Inc()
+		}
+	}
+	seriesMetric.WithLabelValues(t.name).Set(float64(len(t.seen)))
+	t.round++
+}
+
+func envInt(name string, fallback int) int {
+	if value, err := strconv.Atoi(os.Getenv(name)); err == nil {
+		return value
+	}
+	return fallback
+}
+
 func init() {
 	// Register the custom metrics with Prometheus's default registry
 	prometheus.MustRegister(gpuUtilizationMetric)
 	prometheus.MustRegister(gpuMemoryUsageMetric)
 	prometheus.MustRegister(ioReadBytesMetric)
 	prometheus.MustRegister(ioWriteBytesMetric)
+	prometheus.MustRegister(seriesMetric)
+	prometheus.MustRegister(seriesDroppedMetric)
+	prometheus.MustRegister(seriesExpiredMetric)
 }
 
 // getJobIDFromPID finds the job ID for a given PID from the Slurm cgroup directory
@@ -131,8 +239,8 @@ func collectGPUMetrics(jobIDs map[string]struct{}) {
 
 	// Initialize GPU metrics for all job IDs with "N/A"
 	for jobID := range jobIDs {
-		gpuUtilizationMetric.With(prometheus.Labels{"gpu_id": "N/A", "job_id": jobID}).Set(0)
-		gpuMemoryUsageMetric.With(prometheus.Labels{"gpu_id": "N/A", "job_id": jobID}).Set(0)
+		gpuUtilizationSeries.set(0, "N/A", jobID)
+		gpuMemoryUsageSeries.set(0, "N/A", jobID)
 	}
 
 	computeAppsLines := strings.Split(strings.TrimSpace(string(computeAppsOutput)), "\n")
@@ -155,17 +263,15 @@ func collectGPUMetrics(jobIDs map[string]struct{}) {
 				}
 
 				if _, exists := jobIDs[jobID]; exists {
-					gpuMemoryUsageMetric.With(prometheus.Labels{"gpu_id": index, "job_id": jobID}).Set(usedMemory * 1024 * 1024)
-					gpuUtilizationMetric.With(prometheus.Labels{"gpu_id": index, "job_id": jobID}).Set(0) // Replace 0 with actual utilization value if available
+					gpuMemoryUsageSeries.set(usedMemory*1024*1024, index, jobID)
+					gpuUtilizationSeries.set(0, index, jobID) // Replace 0 with actual utilization value if available
 				}
 			}
 		}
 	}
 }
 
-func collectIOMetrics() map[string]struct{}
-
- {
+func collectIOMetrics() map[string]struct{} {
 	jobIDs := make(map[string]struct{})
 
 	basePath := "/path/to/cgroup/cpu/slurm"
@@ -229,8 +335,8 @@ func collectIOMetrics() map[string]struct{}
 						content, err := os.ReadFile(ioFilePath)
 						if err != nil {
 							fmt.Printf("Error reading IO file for PID %s: %v\n", pid, err)
-							ioReadBytesMetric.With(prometheus.Labels{"pid": pid, "job_id": jobID}).Set(0)
-							ioWriteBytesMetric.With(prometheus.Labels{"pid": pid, "job_id": jobID}).Set(0)
+							ioReadBytesSeries.set(0, pid, jobID)
+							ioWriteBytesSeries.set(0, pid, jobID)
 							continue
 						}
 
@@ -247,20 +353,20 @@ func collectIOMetrics() map[string]struct{}
 								}
 
 								if key == "read_bytes" {
-									ioReadBytesMetric.With(prometheus.Labels{"pid": pid, "job_id": jobID}).Set(value)
+									ioReadBytesSeries.set(value, pid, jobID)
 									ioReadSet = true
 								} else if key == "write_bytes" {
-									ioWriteBytesMetric.With(prometheus.Labels{"pid": pid, "job_id": jobID}).Set(value)
+									ioWriteBytesSeries.set(value, pid, jobID)
 									ioWriteSet = true
 								}
 							}
 						}
 
 						if !ioReadSet {
-							ioReadBytesMetric.With(prometheus.Labels{"pid": pid, "job_id": jobID}).Set(0)
+							ioReadBytesSeries.set(0, pid, jobID)
 						}
 						if !ioWriteSet {
-							ioWriteBytesMetric.With(prometheus.Labels{"pid": pid, "job_id": jobID}).Set(0)
+							ioWriteBytesSeries.set(0, pid, jobID)
 						}
 					}
 				}
@@ -280,10 +386,13 @@ func main() {
 			if jobIDs != nil {
 				collectGPUMetrics(jobIDs)
 			}
+			for _, series := range allSeries {
+				series.endRound()
+			}
 		}
 	}()
 
 	http.Handle("/metrics", promhttp.Handler())
 	fmt.Println("Serving metrics at /metrics")
 	http.ListenAndServe(":9060", nil)
-}
\ No newline at end of file
+}
@@ -1,242 +1,439 @@
 import os
-import time
-import sqlite3
-import subprocess
+import threading
 from datetime import datetime, timedelta
-from threading import Thread
-from prometheus_client import start_http_server, Gauge, REGISTRY
+from prometheus_client import start_http_server, REGISTRY
+
+from poc_exporters.accounting import GpuAccounting
+from poc_exporters.aggregates import StreamingAggregator
+from poc_exporters.columnar import ColumnarExporter
+from poc_exporters.commands import default_runner
+from poc_exporters.gpu import GpuSamplerError, open_sampler
+from poc_exporters.instrumentation import Instrumentation, install_profiler_signal
+from poc_exporters.job_metadata import JobMetadataIndex
+from poc_exporters.retention import RetentionManager
+from poc_exporters.ring import SampleRing, downsample
+from poc_exporters.scheduler import Daily, Every, Monthly, Scheduler, Weekly
+from poc_exporters.scrape import SnapshotCollector, prometheus_family
+from poc_exporters.series import SeriesLimiter
+from poc_exporters.slurm_jobs import JobResolver
+from poc_exporters.sreport import SreportClient
+from poc_exporters.storage import FilesystemProbe, open_quota_source
+from poc_exporters.store import UtilizationStore
 
 # ========== DATABASE SETUP ==========
-conn = sqlite3.connect('utilization.db', check_same_thread=False)
-cursor = conn.cursor()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS gpu_utilization_raw (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    account TEXT,
-    utilization_percent REAL
-)""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS gpu_utilization_aggregate (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    date DATE,
-    period TEXT,
-    account TEXT,
-    average_utilization REAL
-)""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS storage_usage (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    date DATE DEFAULT CURRENT_DATE,
-    usage_gb REAL
-    usage_percent REAL
-)""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS cpu_utilization (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    period TEXT,
-    account TEXT,
-    cpu_hours REAL,
-    gpu_hours REAL
-)""")
-
-conn.commit()
+DB_PATH = os.environ.get("UTILIZATION_DB", "utilization.db")
+DB_BATCH_SIZE = int(os.environ.get("UTILIZATION_DB_BATCH_SIZE", "500"))
+DB_FLUSH_INTERVAL = float(os.environ.get("UTILIZATION_DB_FLUSH_INTERVAL", "5"))
+
+# Collectors queue rows on the store; a single writer thread batches them into WAL-mode SQLite.
+store = UtilizationStore(DB_PATH, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL)
 
 # ========== PROMETHEUS METRICS ==========
-gpu_weekly_metric = Gauge("weekly_gpu_utilization", "Weekly average GPU utilization", ["account"])
-gpu_monthly_metric = Gauge("monthly_gpu_utilization", "Monthly average GPU utilization", ["account"])
-cpu_weekly_metric = Gauge("weekly_cpu_usage_hours", "Weekly CPU usage", ["account"])
-cpu_monthly_metric = Gauge("monthly_cpu_usage_hours", "Monthly CPU usage", ["account"])
-storage_monthly_metric = Gauge("monthly_storage_usage_gb", "Monthly average DDN storage used")
-storage_used_percent_metric = Gauge("monthly_storage_usage_percent", "Monthly average DDN storage percent used")
+# Duration, errors and last success of every scheduled job and scrape build
+instrumentation = Instrumentation("monitoring")
+
+# Rolling 7/30-day GPU utilization per account, updated as samples arrive
+gpu_windows = StreamingAggregator({"week": 7 * 86400, "month": 30 * 86400})
 
 # ========== GPU UTILIZATION ==========
-gpu_enabled = True  # Global flag to disable if nvidia-smi is not present
-def check_nvidia_smi_available():
-    global gpu_enabled
+GPU_SAMPLE_INTERVAL = float(os.environ.get("GPU_SAMPLE_INTERVAL", "30"))
+gpu_enabled = True  # Global flag to disable if no GPU backend is present
+gpu_sampler = None  # Long-lived NVML / nvidia-smi sampler, opened once at startup
+def check_gpu_available():
+    global gpu_enabled, gpu_sampler
     try:
-        subprocess.check_output("nvidia-smi -L", shell=True, stderr=subprocess.DEVNULL)
-    except subprocess.CalledProcessError:
-        print("[WARN] `nvidia-smi` not available on this node. Skipping GPU collection.")
-        gpu_enabled = False
-    except FileNotFoundError:
-        print("[WARN] `nvidia-smi` command not found. Skipping GPU collection.")
+        gpu_sampler = open_sampler()
+    except GpuSamplerError as e:
+        print(f"[WARN] No GPU backend available on this node ({e}). Skipping GPU collection.")
         gpu_enabled = False
 
+# GPU samples are charged to the job owning each GPU (Slurm allocation, else its processes),
+# and stored under the job's account instead of the device.
+UNALLOCATED_ACCOUNT = "unallocated"
+job_resolver = JobResolver()
+job_index = JobMetadataIndex()
+gpu_accounting = GpuAccounting(keep_ended=float(os.environ.get("GPU_ACCOUNTING_KEEP_ENDED", "3600")),
+                               max_gap=4 * GPU_SAMPLE_INTERVAL)
+
+# ========== GPU SAMPLE RING ==========
+# With GPU_RING_PATH set (e.g. /dev/shm/poc_exporters_gpu.ring), samples go to a shared-memory ring
+# instead of one database row per GPU per sample. Every GPU_ROLLUP_INTERVAL the closed buckets are
+# written to gpu_utilization_raw as one mean per GPU, with the number of samples it stands for so
+# the rollups and aggregates weight it accordingly. Other processes can read the ring at full
+# resolution (python3 -m poc_exporters.ring). Samples survive a restart until they are persisted.
+GPU_RING_PATH = os.environ.get("GPU_RING_PATH", "")
+GPU_RING_SLOTS = int(os.environ.get("GPU_RING_SLOTS", "86400"))
+GPU_ROLLUP_INTERVAL = float(os.environ.get("GPU_ROLLUP_INTERVAL", "60"))
+gpu_ring = None  # opened by the first sample, once the number of GPUs is known
+ring_position = None  # index of the first ring sample not persisted yet
+job_accounts = {}  # job_id -> (account, ring index of its latest sample) until that sample is persisted
+# Held by the sampler thread while appending and by the scheduler thread while persisting, so the
+# ring is never closed or replaced under a read, and the position and accounts move together.
+ring_lock = threading.RLock()
+
+def append_to_ring(gpus, accounts, jobs, timestamp):
+    global gpu_ring, ring_position
+    with ring_lock:
+        if gpu_ring is not None and gpu_ring.gpus != len(gpus):
+            print(f"[WARN] GPU count changed from {gpu_ring.gpus} to {len(gpus)}; starting a new sample ring.")
+            persist_gpu_samples(close_all=True)
+            gpu_ring.close()
+            gpu_ring = ring_position = None
+        if gpu_ring is None:
+            gpu_ring = SampleRing(GPU_RING_PATH, gpus=len(gpus), slots=GPU_RING_SLOTS, create=True)
+        index = gpu_ring.committed()
+        for job, account in zip(jobs, accounts):
+            if job:
+                job_accounts[job] = (account, index)
+        gpu_ring.append(timestamp, [gpu.utilization for gpu in gpus], [gpu.memory_used_bytes for gpu in gpus], jobs)
+
+def persist_gpu_samples(close_all=False):
+    """Writes the closed buckets of the sample ring to gpu_utilization_raw, one mean and sample count per GPU and job."""
+    global ring_position
+    with ring_lock:
+        if gpu_ring is None:
+            return
+        try:
+            if ring_position is None:
+                # Resumes where the previous run stopped if the ring outlived it
+                created, _, position = (store.get_state("gpu_ring_position") or "").partition(":")
+                ring_position = int(position) if created == repr(gpu_ring.created) \
+                    else max(0, gpu_ring.committed() - gpu_ring.slots)
+            window = gpu_ring.read(ring_position)
+            buckets, position = downsample(window, GPU_ROLLUP_INTERVAL,
+                                           until=None if close_all else datetime.now().timestamp())
+            rows = []
+            for bucket, _, job, samples, utilization, _, _ in buckets:
+                account = job_accounts.get(job, ("unknown",))[0] if job else UNALLOCATED_ACCOUNT
+                rows.append((datetime.fromtimestamp(bucket), account, utilization, samples))
+            store.put_many("gpu_utilization_raw", rows)
+            store.set_state("gpu_ring_position", f"{gpu_ring.created!r}:{position}")
+            ring_position = position
+            if window.lost:
+                instrumentation.error("persist_gpu_samples", "overwritten")
+                print(f"[WARN] {window.lost} GPU samples were overwritten in the ring before they were persisted.")
+            for job in [job for job, (_, last) in job_accounts.items() if last < position]:
+                del job_accounts[job]
+        except Exception as e:
+            instrumentation.error("persist_gpu_samples", type(e).__name__)
+            print(f"[ERROR] Persisting GPU samples failed: {e}")
+
 def collect_gpu_utilization():
     if not gpu_enabled:
         return
 
-    while True:
-        try:
-            result = subprocess.check_output(
-                "nvidia-smi --query-gpu=utilization.gpu --format=csv,noheader,nounits",
-                shell=True
-            ).decode().strip().splitlines()
-
-            timestamp = datetime.now()
-            for idx, util in enumerate(result):
-                account = f"gpu{idx}"
-                cursor.execute(
-                    "INSERT INTO gpu_utilization_raw (timestamp, account, utilization_percent) VALUES (?, ?, ?)",
-                    (timestamp, account, float(util))
-                )
-            conn.commit()
-        except subprocess.CalledProcessError:
-            print("[WARN] Error executing nvidia-smi — skipping this cycle.")
-        except Exception as e:
-            print(f"[ERROR] GPU collection failed: {e}")
-        time.sleep(30)
+    try:
+        snapshot = gpu_sampler.snapshot()
+        pid_to_job = job_resolver.resolve_all()
+        if job_resolver.job_cgroups is not None:
+            job_ids = set(job_resolver.job_cgroups)
+        else:
+            job_ids = set(pid_to_job.values())
+        metadata = job_index.get(job_ids)
+        owners = gpu_accounting.update(snapshot, pid_to_job, job_ids, metadata)
+
+        timestamp = datetime.now()
+        gpus = sorted(snapshot.gpus.values(), key=lambda gpu: gpu.index)
+        rows = []
+        for gpu in gpus:
+            owner = owners.get(gpu.index)
+            meta = metadata.get(owner)
+            if owner is None:
+                account = UNALLOCATED_ACCOUNT
+            else:
+                account = meta.account if meta is not None and meta.account else "unknown"
+            rows.append((timestamp, account, gpu.utilization, 1))
+        if GPU_RING_PATH:
+            append_to_ring(gpus, [account for _, account, _, _ in rows],
+                           [owners.get(gpu.index) or 0 for gpu in gpus], timestamp.timestamp())
+        else:
+            store.put_many("gpu_utilization_raw", rows)
+        for _, account, utilization, _ in rows:
+            gpu_windows.add(account, utilization, timestamp)
+    except GpuSamplerError as e:
+        instrumentation.error("collect_gpu_utilization", "sampler")
+        print(f"[WARN] Error sampling GPUs ({e}) — skipping this cycle.")
+    except Exception as e:
+        instrumentation.error("collect_gpu_utilization", type(e).__name__)
+        print(f"[ERROR] GPU collection failed: {e}")
 
 
 def aggregate_daily_gpu():
-    yesterday = (datetime.now() - timedelta(days=1)).date()
-    cursor.execute("""
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    yesterday = today - timedelta(days=1)
+    # Range predicate instead of DATE(timestamp) = ? so the (timestamp, account) index is used;
+    # rows persisted from the sample ring are weighted by the samples they stand for
+    store.execute("""
         INSERT INTO gpu_utilization_aggregate (date, period, account, average_utilization)
-        SELECT DATE(timestamp), 'day', account, AVG(utilization_percent)
+        SELECT DATE(?), 'day', account, SUM(utilization_percent * samples) / SUM(samples)
         FROM gpu_utilization_raw
-        WHERE DATE(timestamp) = ?
+        WHERE timestamp >= ? AND timestamp < ?
         GROUP BY account
-    """, (yesterday,))
-    conn.commit()
+    """, (yesterday, yesterday, today))
 
 def aggregate_weekly_gpu():
-    cursor.execute("""
+    # Weighted by sample count from the daily rollups, not an average of daily averages
+    store.execute("""
         INSERT INTO gpu_utilization_aggregate (date, period, account, average_utilization)
-        SELECT DATE('now'), 'week', account, AVG(average_utilization)
-        FROM gpu_utilization_aggregate
-        WHERE period = 'day' AND date >= DATE('now', '-7 day')
+        SELECT DATE('now'), 'week', account, SUM(sum_utilization) / SUM(samples)
+        FROM gpu_utilization_rollup
+        WHERE tier = 'day' AND bucket >= DATE('now', '-7 day')
         GROUP BY account
     """)
-    conn.commit()
 
 def aggregate_monthly_gpu():
-    cursor.execute("""
+    store.execute("""
         INSERT INTO gpu_utilization_aggregate (date, period, account, average_utilization)
-        SELECT DATE('now'), 'month', account, AVG(average_utilization)
-        FROM gpu_utilization_aggregate
-        WHERE period = 'week' AND date >= DATE('now', '-30 day')
+        SELECT DATE('now'), 'month', account, SUM(sum_utilization) / SUM(samples)
+        FROM gpu_utilization_rollup
+        WHERE tier = 'day' AND bucket >= DATE('now', '-30 day')
         GROUP BY account
     """)
-    conn.commit()
+
+# ========== RETENTION ==========
+RAW_RETENTION_DAYS = float(os.environ.get("GPU_RAW_RETENTION_DAYS", "7"))
+# Ring means land a rollup interval after their bucket starts; the minute rollup waits for them
+retention = RetentionManager(store, ttls={"raw": timedelta(days=RAW_RETENTION_DAYS)},
+                             settle=timedelta(seconds=60 + (2 * GPU_ROLLUP_INTERVAL if GPU_RING_PATH else 0)))
+
+def run_retention():
+    try:
+        retention.run()
+    except Exception as e:
+        instrumentation.error("run_retention", type(e).__name__)
+        print(f"[ERROR] Retention run failed: {e}")
+
+# ========== CHARGEBACK EXPORT ==========
+# Incremental Parquet/Arrow export of raw samples, rollups and sreport figures (needs pyarrow)
+CHARGEBACK_EXPORT_DIR = os.environ.get("CHARGEBACK_EXPORT_DIR", "")
+columnar_exporter = ColumnarExporter(store, CHARGEBACK_EXPORT_DIR,
+                                     format=os.environ.get("CHARGEBACK_EXPORT_FORMAT", "parquet")) \
+    if CHARGEBACK_EXPORT_DIR else None
+
+def export_chargeback():
+    try:
+        exported = columnar_exporter.export()
+        print(f"[INFO] Chargeback export to {CHARGEBACK_EXPORT_DIR}: {exported}")
+    except ImportError as e:
+        instrumentation.error("export_chargeback", "pyarrow")
+        print(f"[WARN] {e} — skipping the chargeback export.")
+    except Exception as e:
+        instrumentation.error("export_chargeback", type(e).__name__)
+        print(f"[ERROR] Chargeback export failed: {e}")
 
 # ========== CPU UTILIZATION ==========
+# sreport results are shared through SREPORT_CACHE_DIR, so one node per cluster queries slurmdbd
+# when it points at shared storage.
+sreport = SreportClient(ttl=int(os.environ.get("SREPORT_CACHE_TTL", "3600")))
+
 def collect_cpu_utilization(period):
     try:
-        cmd = f"sreport cluster AccountUtilizationByUser start=-{period} format=Account,CPU_Hours,GPU_Hours"
-        output = subprocess.check_output(cmd, shell=True).decode().strip().splitlines()
+        report = sreport.query(("cluster", "AccountUtilizationByUser"), start=f"-{period}",
+                               extra=("format=Account,CPU_Hours,GPU_Hours",))
 
-        for line in output[1:]:
-            parts = line.split()
+        rows = []
+        for row in report:
+            parts = list(row.values())
             if len(parts) < 3:
                 continue
-            account, cpu_hours, gpu_hours = parts[0], float(parts[1]), float(parts[2])
-            cursor.execute("""
-                INSERT INTO cpu_utilization (period, account, cpu_hours, gpu_hours)
-                VALUES (?, ?, ?, ?)
-            """, (period, account, cpu_hours, gpu_hours))
-        conn.commit()
+            try:
+                account, cpu_hours, gpu_hours = parts[0], float(parts[1]), float(parts[2])
+            except ValueError:
+                continue
+            rows.append((period, account, cpu_hours, gpu_hours))
+        store.put_many("cpu_utilization", rows)
     except Exception as e:
+        instrumentation.error(f"collect_cpu_utilization_{period}", type(e).__name__)
         print(f"[ERROR] CPU collection failed ({period}): {e}")
 
 # ========== STORAGE UTILIZATION ==========
+STORAGE_MOUNTS = [m for m in os.environ.get("STORAGE_MOUNTS", "/rs01").split(",") if m]
+STORAGE_SAMPLE_INTERVAL = float(os.environ.get("STORAGE_SAMPLE_INTERVAL", "900"))
+STORAGE_TIMEOUT = float(os.environ.get("STORAGE_TIMEOUT", "10"))
+# Optional per-user/project quotas: "lfs", "repquota", "repquota:group" or "file:<csv path>"
+STORAGE_QUOTA_SOURCE = os.environ.get("STORAGE_QUOTA_SOURCE", "")
+
+storage_probe = FilesystemProbe(timeout=STORAGE_TIMEOUT)
+quota_source = open_quota_source(
+    STORAGE_QUOTA_SOURCE, STORAGE_MOUNTS[0] if STORAGE_MOUNTS else "",
+    users=[u for u in os.environ.get("STORAGE_QUOTA_USERS", "").split(",") if u],
+    groups=[g for g in os.environ.get("STORAGE_QUOTA_GROUPS", "").split(",") if g],
+    projects=[p for p in os.environ.get("STORAGE_QUOTA_PROJECTS", "").split(",") if p])
+
 def collect_storage_usage():
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    for mount, usage in storage_probe.usage_many(STORAGE_MOUNTS).items():
+        if isinstance(usage, Exception):
+            instrumentation.error("collect_storage_usage", type(usage).__name__)
+            print(f"[ERROR] Storage collection failed for {mount}: {usage}")
+            continue
+        rows.append((now, now, mount, usage.used_bytes / 1024 ** 3, usage.used_percent, usage.total_bytes,
+                     usage.used_bytes, usage.avail_bytes, usage.total_inodes, usage.used_inodes))
+    store.put_many("storage_usage", rows)
+
+def collect_storage_quota():
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
-        output = subprocess.check_output("df -h /rs01", shell=True).decode().strip().splitlines()
-        if len(output) < 2:
-            return
-        parts = output[1].split()
-        used = parts[2]        # Column: Used Size (e.g., 179T)
-        used_percent = parts[4]  # Column: Used % (e.g., 17%)
-
-        # Convert storage units
-        if used.endswith("G"):
-            usage_gb = float(used[:-1])
-        elif used.endswith("T"):
-            usage_gb = float(used[:-1]) * 1024
-        elif used.endswith("P"):
-            usage_gb = float(used[:-1]) * 1024 * 1024
-        else:
-            usage_gb = 0
-
-        # Convert percentage string to float
-        used_percent_value = float(used_percent.strip('%'))
-
-        cursor.execute("INSERT INTO storage_usage (usage_gb, used_percent) VALUES (?, ?)", (usage_gb, used_percent_value))
-        conn.commit()
-
+        quotas = quota_source.collect()
     except Exception as e:
-        print(f"[ERROR] Storage collection failed: {e}")
-
+        instrumentation.error("collect_storage_quota", type(e).__name__)
+        print(f"[ERROR] Quota collection failed: {e}")
+        return
+    store.put_many("storage_quota", [(now, q.mount, q.kind, q.name, q.used_bytes, q.limit_bytes,
+                                      q.used_inodes, q.limit_inodes) for q in quotas])
 
 def aggregate_monthly_storage():
-    cursor.execute("""
-        SELECT AVG(usage_gb), AVG(used_percent) FROM storage_usage
-        WHERE date >= DATE('now', '-30 day')
+    """Per-mount 30-day averages of every storage sample (several per hour), as {mount: (gb, percent)}."""
+    rows = store.query("""
+        SELECT mount, AVG(usage_gb), AVG(usage_percent) FROM storage_usage
+        WHERE date >= DATE('now', '-30 day') AND mount IS NOT NULL
+        GROUP BY mount
     """)
-    avg_gb, avg_percent = cursor.fetchone()
-    storage_monthly_metric.set(avg_gb)
-    storage_used_percent_metric.set(avg_percent or 0)
-
-# ========== PROMETHEUS UPDATE ==========
-def update_prometheus_metrics():
-    # GPU weekly
-    cursor.execute("SELECT account, average_utilization FROM gpu_utilization_aggregate WHERE period = 'week'")
-    for account, avg in cursor.fetchall():
-        gpu_weekly_metric.labels(account=account).set(avg)
-
-    # GPU monthly
-    cursor.execute("SELECT account, average_utilization FROM gpu_utilization_aggregate WHERE period = 'month'")
-    for account, avg in cursor.fetchall():
-        gpu_monthly_metric.labels(account=account).set(avg)
-
-    # CPU weekly
-    cursor.execute("SELECT account, cpu_hours FROM cpu_utilization WHERE period = '7days'")
-    for account, hours in cursor.fetchall():
-        cpu_weekly_metric.labels(account=account).set(hours)
-
-    # CPU monthly
-    cursor.execute("SELECT account, cpu_hours FROM cpu_utilization WHERE period = '30days'")
-    for account, hours in cursor.fetchall():
-        cpu_monthly_metric.labels(account=account).set(hours)
-
-    aggregate_monthly_storage()
+    return {mount: (avg_gb or 0, avg_percent or 0) for mount, avg_gb, avg_percent in rows}
+
+# ========== PROMETHEUS COLLECTORS ==========
+def build_gpu_families(family):
+    """GPU weekly / monthly families from the rolling windows; rebuilt on scrape after new samples."""
+    gpu_weekly = family("weekly_gpu_utilization", "Weekly average GPU utilization", ["account"], "gauge")
+    gpu_monthly = family("monthly_gpu_utilization", "Monthly average GPU utilization", ["account"], "gauge")
+    gpu_p95 = family("gpu_utilization_p95", "95th percentile GPU utilization over a rolling window", ["account", "window"], "gauge")
+    gpu_max = family("gpu_utilization_max", "Maximum GPU utilization over a rolling window", ["account", "window"], "gauge")
+    for window, average in (("week", gpu_weekly), ("month", gpu_monthly)):
+        for account, stats in gpu_windows.snapshot(window).items():
+            average.add_metric([account], stats.mean)
+            gpu_p95.add_metric([account, window], stats.p95)
+            gpu_max.add_metric([account, window], stats.maximum)
+    return [gpu_weekly, gpu_monthly, gpu_p95, gpu_max]
+
+def accounting_version():
+    # cpu_utilization, storage_usage and storage_quota are all insert-only,
+    # so their highest rowids change exactly when they do
+    return store.query("""
+        SELECT (SELECT MAX(rowid) FROM cpu_utilization), (SELECT MAX(rowid) FROM storage_usage),
+               (SELECT MAX(rowid) FROM storage_quota)
+    """)[0]
+
+def build_accounting_families(family):
+    """CPU and storage families from the database; rebuilt on scrape only after new rows."""
+    cpu_weekly = family("weekly_cpu_usage_hours", "Weekly CPU usage", ["account"], "gauge")
+    cpu_monthly = family("monthly_cpu_usage_hours", "Monthly CPU usage", ["account"], "gauge")
+
+    # Latest report per account only
+    for period, usage in (("7days", cpu_weekly), ("30days", cpu_monthly)):
+        for account, hours in store.query("""
+            SELECT account, cpu_hours FROM cpu_utilization
+            WHERE id IN (SELECT MAX(id) FROM cpu_utilization WHERE period = ? GROUP BY account)
+        """, (period,)):
+            usage.add_metric([account], hours)
+
+    families = [cpu_weekly, cpu_monthly]
+    try:
+        storage_gb = family("monthly_storage_usage_gb", "Monthly average DDN storage used", ["mount"], "gauge")
+        storage_percent = family("monthly_storage_usage_percent", "Monthly average DDN storage percent used", ["mount"], "gauge")
+        for mount, (avg_gb, avg_percent) in sorted(aggregate_monthly_storage().items()):
+            storage_gb.add_metric([mount], avg_gb)
+            storage_percent.add_metric([mount], avg_percent)
+        families.extend([storage_gb, storage_percent])
+
+        used_bytes = family("storage_used_bytes", "Bytes used on a filesystem at the latest sample", ["mount"], "gauge")
+        size_bytes = family("storage_size_bytes", "Size of a filesystem in bytes", ["mount"], "gauge")
+        used_inodes = family("storage_used_inodes", "Inodes used on a filesystem at the latest sample", ["mount"], "gauge")
+        for mount, used, total, inodes in store.query("""
+            SELECT mount, used_bytes, total_bytes, used_inodes FROM storage_usage
+            WHERE id IN (SELECT MAX(id) FROM storage_usage WHERE mount IS NOT NULL GROUP BY mount)
+        """):
+            used_bytes.add_metric([mount], used)
+            size_bytes.add_metric([mount], total)
+            used_inodes.add_metric([mount], inodes)
+        families.extend([used_bytes, size_bytes, used_inodes])
+
+        quota_labels = ["mount", "kind", "name"]
+        quota_used = family("storage_quota_used_bytes", "Bytes charged to a user, group or project", quota_labels, "gauge")
+        quota_limit = family("storage_quota_limit_bytes", "Hard block limit of a user, group or project (0 = none)", quota_labels, "gauge")
+        quota_inodes = family("storage_quota_used_inodes", "Inodes charged to a user, group or project", quota_labels, "gauge")
+        for mount, kind, name, used, limit, inodes in store.query("""
+            SELECT mount, kind, name, used_bytes, limit_bytes, used_inodes FROM storage_quota
+            WHERE timestamp = (SELECT MAX(timestamp) FROM storage_quota)
+        """):
+            quota_used.add_metric([mount, kind, name], used)
+            quota_limit.add_metric([mount, kind, name], limit)
+            quota_inodes.add_metric([mount, kind, name], inodes)
+        families.extend([quota_used, quota_limit, quota_inodes])
+    except Exception as e:
+        instrumentation.error("build_accounting_families", type(e).__name__)
+        print(f"[ERROR] Storage aggregation failed: {e}")
+    return families
+
+# Every build goes through a series limiter: accounts and jobs no longer seen are forgotten after
+# a few builds, and a gauge family over the limit folds new label sets into an __overflow__ series
+# (a counter family drops them).
+MAX_SERIES = int(os.environ.get("MAX_SERIES_PER_FAMILY", "1000"))
+SERIES_EXPIRY = int(os.environ.get("SERIES_EXPIRY_SCRAPES", "5"))
+
+def limited(namespace, build):
+    """Runs a build function taking a family factory through its own SeriesLimiter."""
+    series = SeriesLimiter(namespace, max_series=MAX_SERIES, expire_after=SERIES_EXPIRY)
+    return lambda: series.build(build, prometheus_family) + series.families(prometheus_family)
+
+# max_age lets the rolling windows slide forward even when no new samples arrive
+gpu_collector = SnapshotCollector(instrumentation.wrap("build_gpu_families", limited("monitoring_gpu", build_gpu_families)),
+                                  version=lambda: gpu_windows.version, namespace="monitoring_gpu", max_age=300)
+# Allocated vs used GPU hours per job and account, rebuilt after each GPU sample
+gpu_accounting_collector = SnapshotCollector(
+    instrumentation.wrap("build_gpu_accounting_families", limited("monitoring_gpu_accounting", gpu_accounting.families)),
+    version=lambda: gpu_accounting.version, namespace="monitoring_gpu_accounting")
+accounting_collector = SnapshotCollector(
+    instrumentation.wrap("build_accounting_families", limited("monitoring_accounting", build_accounting_families)),
+    version=accounting_version, namespace="monitoring_accounting", max_age=3600)
 
 # ========== SCHEDULING ==========
-def schedule_task(interval_seconds, func):
-    def loop():
-        while True:
-            func()
-            time.sleep(interval_seconds)
-    Thread(target=loop, daemon=True).start()
+# Spread sreport/aggregation runs over a few minutes so a whole cluster of nodes
+# does not hit slurmdbd in the same second.
+SCHEDULE_JITTER = float(os.environ.get("SCHEDULE_JITTER_SECONDS", "300"))
+
+# One timer heap for every job; last runs are persisted in the database.
+scheduler = Scheduler(state=store, jitter=SCHEDULE_JITTER, instrumentation=instrumentation)
 
 # ========== MAIN ==========
 if __name__ == "__main__":
-    # Start Prometheus endpoint
+    # Start Prometheus endpoint; metrics are computed on scrape by the collector
+    REGISTRY.register(gpu_collector)
+    REGISTRY.register(accounting_collector)
+    REGISTRY.register(gpu_accounting_collector)
+    REGISTRY.register(instrumentation.collector(runner=default_runner, store=store))
+    # kill -USR2 <pid> starts profiling; a second USR2 writes the dump to $PROFILE_DIR
+    install_profiler_signal()
     start_http_server(9060)
 
     # Check if GPU metrics can be collected
-    check_nvidia_smi_available()
-
-    # GPU data collection (only if enabled)
-    if gpu_enabled:
-        Thread(target=collect_gpu_utilization, daemon=True).start()
+    check_gpu_available()
 
-    # Daily tasks
-    schedule_task(86400, aggregate_daily_gpu)
-    schedule_task(86400, collect_storage_usage)
-    schedule_task(86400, lambda: collect_cpu_utilization("7days"))
-    schedule_task(2592000, lambda: collect_cpu_utilization("30days"))  # monthly
-    schedule_task(604800, aggregate_weekly_gpu)  # weekly
-    schedule_task(2592000, aggregate_monthly_gpu)  # monthly
+    # Rebuild the rolling windows from what is already on disk
+    gpu_windows.seed_from_store(store, raw_since=retention.watermark("minute"))
 
-    # Update metrics every 5 minutes
-    schedule_task(300, update_prometheus_metrics)
+    # GPU data collection (only if enabled); sampling is neither jittered nor persisted
+    if gpu_enabled:
+        scheduler.add("collect_gpu_utilization", Every(GPU_SAMPLE_INTERVAL), collect_gpu_utilization,
+                      jitter=0, persist=False)
+        if GPU_RING_PATH:
+            scheduler.add("persist_gpu_samples", Every(GPU_ROLLUP_INTERVAL), persist_gpu_samples,
+                          jitter=0, persist=False)
+
+    # Storage capacity (and quotas, if configured) several times an hour
+    scheduler.add("collect_storage_usage", Every(STORAGE_SAMPLE_INTERVAL), collect_storage_usage, jitter=60)
+    if quota_source is not None:
+        scheduler.add("collect_storage_quota", Every(STORAGE_SAMPLE_INTERVAL), collect_storage_quota, jitter=60)
+
+    # Calendar tasks; on a database with no record of them yet, each runs once at startup
+    scheduler.add("aggregate_daily_gpu", Daily(0, 5), aggregate_daily_gpu)
+    scheduler.add("collect_cpu_utilization_7days", Daily(0, 15), lambda: collect_cpu_utilization("7days"))
+    scheduler.add("aggregate_weekly_gpu", Weekly(0, 0, 30), aggregate_weekly_gpu)  # Mondays
+    scheduler.add("collect_cpu_utilization_30days", Monthly(1, 0, 45), lambda: collect_cpu_utilization("30days"))
+    scheduler.add("aggregate_monthly_gpu", Monthly(1, 1, 0), aggregate_monthly_gpu)
+    scheduler.add("run_retention", Every(3600), run_retention)  # hourly rollup and raw-data TTL
+    if columnar_exporter is not None:
+        scheduler.add("export_chargeback", Daily(1, 30), export_chargeback)  # well within the raw-data TTL
 
     print(" Monitoring service started on port 9060...")
-    while True:
-        time.sleep(3600)
+    scheduler.run()
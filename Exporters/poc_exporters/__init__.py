@@ -0,0 +1,3 @@
+"""
+Shared building blocks for the Slurm/GPU Prometheus exporters in this repository.
+"""
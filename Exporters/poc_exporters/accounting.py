@@ -0,0 +1,174 @@
+"""
+Local GPU-hours accounting: allocated versus used GPU time per job and account.
+
+Every GPU sample is joined with the job that owns each GPU. A GPU is owned by
+the job Slurm allocated it to (``JobMetadata.gpu_indices``, from
+``scontrol -d``), or else by the job whose processes run on it. Between two
+samples, every job is charged:
+
+* allocated GPU-seconds: its allocated GPUs times the elapsed wall time (the
+  GPU count alone when Slurm did not report device indices);
+* used GPU-seconds: the utilization of the GPUs it owns times the elapsed
+  wall time, so an allocated GPU that sits idle adds nothing.
+
+A job starts when its cgroup appears and ends when it disappears. Ended jobs
+stay visible for ``keep_ended`` seconds, so their final totals are scraped; a
+job that reappears within that time (a sample that missed its cgroup or
+processes) continues with its totals.
+
+A job's time is charged to its account only once its scontrol metadata has
+arrived; until then it is held on the job, so account totals are not split
+between the real account and ``unknown``. A job that ends without metadata is
+charged to ``unknown``.
+The per-job series are labelled by ``job_id`` only, so they stay one series
+while the metadata is pending; ``gpu_job_info`` carries the job's account and
+user once known, to join on ``job_id``.
+Account totals are plain counters and only grow; they restart from zero
+with the process, which Prometheus handles like any counter reset.
+"""
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class JobGpuTime:
+    job_id: int
+    account: str = ''
+    user: str = ''
+    started: float = None  # wall time the job cgroup was first seen
+    ended: float = None  # wall time it disappeared
+    allocated_gpus: int = 0  # in the latest sample
+    allocated_seconds: float = 0.0
+    used_seconds: float = 0.0
+    attributed: bool = False  # its metadata arrived, so its time is charged to its account
+    pending_allocated: float = 0.0  # charged to no account yet
+    pending_used: float = 0.0
+
+
+class GpuAccounting:
+    """Integrates allocated and used GPU time per job and account as samples arrive."""
+
+    def __init__(self, keep_ended=3600.0, max_gap=300.0, clock=time.time, monotonic=time.monotonic):
+        """
+        :param keep_ended: Seconds an ended job is still exported.
+        :param max_gap: Longest interval charged between two samples; a longer pause
+                        (e.g. the sampler hung) is only charged up to this.
+        :param clock: Wall clock, for the start and end timestamps.
+        :param monotonic: Monotonic clock, for the intervals.
+        """
+        self.keep_ended = keep_ended
+        self.max_gap = max_gap
+        self.clock = clock
+        self.monotonic = monotonic
+        self.jobs = {}  # job_id -> JobGpuTime
+        self.accounts = {}  # account -> [allocated seconds, used seconds]
+        self.started = 0
+        self.ended = 0
+        self.version = 0
+        self._last = None
+        self._lock = threading.Lock()
+
+    def update(self, snapshot, pid_to_job, job_ids, metadata):
+        """
+        Charges the interval since the previous sample to the jobs of this one.
+
+        :param snapshot: A GpuSnapshot.
+        :param pid_to_job: A dictionary mapping PIDs to job IDs.
+        :param job_ids: The IDs of the jobs on the node (from their cgroups).
+        :param metadata: A dictionary mapping job IDs to JobMetadata.
+        :return: A dictionary mapping GPU indices to the ID of the job owning them.
+        """
+        now, tick = self.clock(), self.monotonic()
+        elapsed = 0.0 if self._last is None else min(tick - self._last, self.max_gap)
+        self._last = tick
+
+        owners = {}
+        for job_id, meta in metadata.items():
+            for index in meta.gpu_indices:
+                owners[index] = job_id
+        running = {}  # job_id -> GPU indices with processes of the job
+        for usage in snapshot.job_usage(pid_to_job):
+            owners.setdefault(usage.gpu.index, usage.job_id)
+            running.setdefault(usage.job_id, set()).add(usage.gpu.index)
+        utilization = {gpu.index: gpu.utilization for gpu in snapshot.gpus.values()}
+
+        with self._lock:
+            live = set(job_ids) | set(running)
+            for job_id in live:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    job = self.jobs[job_id] = JobGpuTime(job_id, started=now)
+                    self.started += 1
+                elif job.ended is not None:
+                    job.ended = None  # missed by a sample, not a new job
+                meta = metadata.get(job_id)
+                if meta is not None:
+                    job.account, job.user = meta.account, meta.user
+                    job.allocated_gpus = len(meta.gpu_indices) or meta.gpu_count
+                    job.attributed = True
+                else:
+                    job.allocated_gpus = len(running.get(job_id, ()))
+                used = sum(utilization.get(index, 0.0) for index, owner in owners.items() if owner == job_id) / 100.0
+                job.allocated_seconds += job.allocated_gpus * elapsed
+                job.used_seconds += used * elapsed
+                job.pending_allocated += job.allocated_gpus * elapsed
+                job.pending_used += used * elapsed
+                if job.attributed:
+                    self._charge(job)
+            for job in self.jobs.values():
+                if job.ended is None and job.job_id not in live:
+                    job.ended = now
+                    job.allocated_gpus = 0
+                    self.ended += 1
+                    self._charge(job)
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job.ended is not None and now - job.ended > self.keep_ended]:
+                del self.jobs[job_id]
+            self.version += 1
+        return owners
+
+    def _charge(self, job):
+        # Moves the time held on a job to its account's totals.
+        totals = self.accounts.setdefault(job.account, [0.0, 0.0])
+        totals[0] += job.pending_allocated
+        totals[1] += job.pending_used
+        job.pending_allocated = job.pending_used = 0.0
+
+    def families(self, family):
+        """
+        :param family: Family factory taking (name, documentation, labels, type).
+        :return: The accounting metric families.
+        """
+        job_labels = ['job_id']
+        account_allocated = family('gpu_account_allocated_hours_total', 'GPU hours allocated to the jobs of an account on this node',
+                                   ['account'], 'counter')
+        account_used = family('gpu_account_used_hours_total', 'GPU hours used by the jobs of an account on this node, weighted by utilization',
+                              ['account'], 'counter')
+        job_allocated = family('gpu_job_allocated_hours_total', 'GPU hours allocated to a job on this node', job_labels, 'counter')
+        job_used = family('gpu_job_used_hours_total', 'GPU hours used by a job on this node, weighted by utilization', job_labels, 'counter')
+        job_gpus = family('gpu_job_allocated_gpus', 'GPUs currently allocated to a job on this node', job_labels, 'gauge')
+        job_start = family('gpu_job_start_timestamp_seconds', 'Time the job cgroup appeared on this node', job_labels, 'gauge')
+        job_end = family('gpu_job_end_timestamp_seconds', 'Time the job cgroup disappeared from this node', job_labels, 'gauge')
+        job_info = family('gpu_job_info', 'Account and user of a job on this node, once known; always 1',
+                          ['job_id', 'account', 'user'], 'gauge')
+        started = family('gpu_accounting_jobs_started_total', 'Jobs seen starting on this node', [], 'counter')
+        ended = family('gpu_accounting_jobs_ended_total', 'Jobs seen ending on this node', [], 'counter')
+        with self._lock:
+            for account, (allocated, used) in sorted(self.accounts.items()):
+                account_allocated.add_metric([account or 'unknown'], allocated / 3600.0)
+                account_used.add_metric([account or 'unknown'], used / 3600.0)
+            for job_id, job in sorted(self.jobs.items()):
+                labels = [str(job_id)]
+                job_allocated.add_metric(labels, job.allocated_seconds / 3600.0)
+                job_used.add_metric(labels, job.used_seconds / 3600.0)
+                job_gpus.add_metric(labels, job.allocated_gpus)
+                job_start.add_metric(labels, job.started)
+                if job.ended is not None:
+                    job_end.add_metric(labels, job.ended)
+                if job.attributed:
+                    job_info.add_metric([str(job_id), job.account or 'unknown', job.user], 1)
+            started.add_metric([], self.started)
+            ended.add_metric([], self.ended)
+        return [account_allocated, account_used, job_allocated, job_used, job_gpus, job_start, job_end, job_info,
+                started, ended]
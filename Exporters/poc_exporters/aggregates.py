@@ -0,0 +1,278 @@
+"""
+Incremental rolling-window aggregates for utilization samples.
+
+Each account keeps one ``RollingWindow`` per configured window (e.g. 7 and 30
+days). A window is a ring of fixed-width buckets holding count, sum, min, max
+and a 1%-resolution histogram. Window-wide count, sum and histogram are kept
+as running totals: every sample adds to them and every expired bucket is
+subtracted. Reads therefore cost the same no matter how many samples the
+window holds. Averages are weighted by sample count, never averages of averages.
+
+``ScrapeWindow`` is the short-lived counterpart: min/avg/max of each series
+over the samples taken since the previous scrape.
+"""
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+
+HISTOGRAM_BINS = 101  # one bin per utilization percent, 0..100
+
+
+@dataclass
+class WindowStats:
+    count: int
+    total: float
+    minimum: float
+    maximum: float
+    p95: float
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+def _bin(value):
+    return min(max(int(value), 0), HISTOGRAM_BINS - 1)
+
+
+class _Bucket:
+    __slots__ = ('start', 'count', 'total', 'minimum', 'maximum', 'histogram')
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+        self.histogram = [0] * HISTOGRAM_BINS
+
+
+class RollingWindow:
+    """Count/sum/min/max/p95 over the last ``span`` seconds, in ``bucket_width``-second buckets."""
+
+    def __init__(self, span, bucket_width=3600):
+        """
+        :param span: Window length in seconds.
+        :param bucket_width: Bucket width in seconds; expiry happens one bucket at a time.
+        """
+        self.span = span
+        self.bucket_width = bucket_width
+        self._buckets = deque()
+        self.count = 0
+        self.total = 0.0
+        self._histogram = [0] * HISTOGRAM_BINS
+
+    def add(self, timestamp, value, count=1, total=None, minimum=None, maximum=None):
+        """
+        Adds one sample, or a pre-aggregated summary of ``count`` samples.
+
+        :param timestamp: Sample time in seconds since the epoch.
+        :param value: Sample value; for summaries, the value used for the p95 histogram (their mean).
+        :param count: Number of samples summarised.
+        :param total: Sum of the summarised samples (defaults to value * count).
+        :param minimum: Minimum of the summarised samples (defaults to value).
+        :param maximum: Maximum of the summarised samples (defaults to value).
+        """
+        total = value * count if total is None else total
+        minimum = value if minimum is None else minimum
+        maximum = value if maximum is None else maximum
+        bucket = self._bucket_for(timestamp - timestamp % self.bucket_width)
+        if bucket is None:
+            return
+        bucket.count += count
+        bucket.total += total
+        bucket.minimum = min(bucket.minimum, minimum)
+        bucket.maximum = max(bucket.maximum, maximum)
+        bucket.histogram[_bin(value)] += count
+        self.count += count
+        self.total += total
+        self._histogram[_bin(value)] += count
+        self._expire(timestamp)
+
+    def _bucket_for(self, start):
+        buckets = self._buckets
+        if not buckets or buckets[-1].start < start:
+            buckets.append(_Bucket(start))
+            return buckets[-1]
+        # Late sample: search from the newest end, where it almost always belongs.
+        # A sample whose bucket was never opened (or already expired) is dropped.
+        for bucket in reversed(buckets):
+            if bucket.start == start:
+                return bucket
+            if bucket.start < start:
+                break
+        return None
+
+    def _expire(self, now):
+        buckets = self._buckets
+        horizon = now - self.span
+        while buckets and buckets[0].start + self.bucket_width <= horizon:
+            bucket = buckets.popleft()
+            self.count -= bucket.count
+            self.total -= bucket.total
+            for index, hits in enumerate(bucket.histogram):
+                if hits:
+                    self._histogram[index] -= hits
+
+    def stats(self, now=None):
+        """
+        :param now: Current time in seconds since the epoch (defaults to time.time()).
+        :return: WindowStats for the window ending at ``now``.
+        """
+        self._expire(time.time() if now is None else now)
+        if not self.count:
+            return WindowStats(0, 0.0, 0.0, 0.0, 0.0)
+        minimum = min(bucket.minimum for bucket in self._buckets)
+        maximum = max(bucket.maximum for bucket in self._buckets)
+        return WindowStats(self.count, self.total, minimum, maximum, self._quantile(0.95))
+
+    def _quantile(self, q):
+        threshold = q * self.count
+        seen = 0
+        for index, hits in enumerate(self._histogram):
+            seen += hits
+            if seen >= threshold:
+                return float(index)
+        return float(HISTOGRAM_BINS - 1)
+
+
+class StreamingAggregator:
+    """Thread-safe per-account rolling windows, updated as each sample arrives."""
+
+    def __init__(self, windows, bucket_width=3600):
+        """
+        :param windows: Mapping of window name (e.g. ``week``) to length in seconds.
+        :param bucket_width: Bucket width in seconds, shared by all windows.
+        """
+        self.windows = dict(windows)
+        self.bucket_width = bucket_width
+        self._accounts = {}
+        self._lock = threading.Lock()
+        self.version = 0  # bumped on every add(), for change detection by readers
+
+    def _windows_for(self, account):
+        windows = self._accounts.get(account)
+        if windows is None:
+            windows = self._accounts[account] = {
+                name: RollingWindow(span, self.bucket_width) for name, span in self.windows.items()
+            }
+        return windows
+
+    def add(self, account, value, timestamp=None, **summary):
+        """
+        Adds a sample (or a summary, see RollingWindow.add) to every window of an account.
+
+        :param account: Account label.
+        :param value: Sample value.
+        :param timestamp: datetime or seconds since the epoch (defaults to now).
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        elif isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        with self._lock:
+            for window in self._windows_for(account).values():
+                window.add(timestamp, value, **summary)
+            self.version += 1
+
+    def snapshot(self, window, now=None):
+        """
+        Returns the current statistics of one window for every account that has samples in it.
+
+        :param window: Window name.
+        :param now: Seconds since the epoch (defaults to time.time()).
+        :return: A dictionary mapping account to WindowStats.
+        """
+        now = time.time() if now is None else now
+        result = {}
+        with self._lock:
+            for account, windows in list(self._accounts.items()):
+                stats = windows[window].stats(now)
+                if stats.count:
+                    result[account] = stats
+                elif all(not w.stats(now).count for w in windows.values()):
+                    del self._accounts[account]
+        return result
+
+    def seed_from_store(self, store, raw_since=None, now=None):
+        """
+        Rebuilds the windows after a restart from the minute rollup tier plus any
+        raw samples not yet rolled up. Seeded minute buckets contribute their mean
+        to the p95 histogram, so p95 is approximate until the window turns over.
+
+        :param store: A UtilizationStore.
+        :param raw_since: datetime from which raw samples are replayed (the minute
+                          rollup watermark), or None to replay the whole window.
+        :param now: datetime used as the end of the windows (defaults to datetime.now()).
+        :return: Number of rows replayed.
+        """
+        now = now or datetime.now()
+        start = datetime.fromtimestamp(now.timestamp() - max(self.windows.values()))
+        raw_start = max(start, raw_since) if raw_since else start
+        # Bound as text in the format the store writes: the datetime adapter is deprecated.
+        rows = store.query("""
+            SELECT bucket, account, samples, sum_utilization, min_utilization, max_utilization
+            FROM gpu_utilization_rollup
+            WHERE tier = 'minute' AND bucket >= ? AND bucket < ?
+            ORDER BY bucket
+        """, (start.isoformat(sep=' '), (raw_since or start).isoformat(sep=' ')))
+        for bucket, account, samples, total, minimum, maximum in rows:
+            self.add(account, total / samples, datetime.fromisoformat(bucket),
+                     count=samples, total=total, minimum=minimum, maximum=maximum)
+        raw = store.query("""
+            SELECT timestamp, account, utilization_percent, samples FROM gpu_utilization_raw
+            WHERE timestamp >= ?
+            ORDER BY timestamp
+        """, (raw_start.isoformat(sep=' '),))
+        for timestamp, account, value, samples in raw:
+            self.add(account, value, datetime.fromisoformat(timestamp), count=samples)
+        return len(rows) + len(raw)
+
+
+class ScrapeWindow:
+    """
+    Thread-safe count/sum/min/max per series over the sampling rounds taken
+    between two scrapes, so short bursts show up in the scraped min/max.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = {}  # key -> [count, total, minimum, maximum]
+        self._rounds = 0
+        self._published = {}
+
+    def record(self, values):
+        """
+        Adds one sampling round.
+
+        :param values: A dictionary mapping series keys to their sampled value.
+        """
+        with self._lock:
+            for key, value in values.items():
+                entry = self._current.get(key)
+                if entry is None:
+                    self._current[key] = [1, value, value, value]
+                else:
+                    entry[0] += 1
+                    entry[1] += value
+                    entry[2] = min(entry[2], value)
+                    entry[3] = max(entry[3], value)
+            self._rounds += 1
+
+    def rotate(self):
+        """
+        Closes the current window and starts a new one. If no round was recorded
+        since the previous call (e.g. two Prometheus servers scraping back to back),
+        the previous window is returned again. p95 is not tracked and is None.
+
+        :return: A dictionary mapping series keys to WindowStats.
+        """
+        with self._lock:
+            if self._rounds:
+                self._published = {key: WindowStats(count, total, minimum, maximum, None)
+                                   for key, (count, total, minimum, maximum) in self._current.items()}
+                self._current = {}
+                self._rounds = 0
+            return dict(self._published)
@@ -0,0 +1,268 @@
+"""
+Central aggregator of the per-job summaries pushed by the node exporters
+(``python3 -m poc_exporters --push ...``); see push.py for the batch format.
+
+Run it as one process for the whole cluster:
+
+    python3 -m poc_exporters.aggregator --listen unix:/run/poc_exporters/aggregator.sock --port 9062
+    python3 -m poc_exporters.aggregator --listen 0.0.0.0:9063 --db /var/lib/poc_exporters/cluster.db
+
+Every batch is merged into one SQLite database with a row per (node, job,
+metric). Nodes send cumulative values stamped with the batch time, so merging
+is an upsert that keeps the newest value: sending a value twice changes
+nothing, and a batch merged after a newer one from the same node (batches are
+merged by concurrent handlers, and a node retries after a timeout) is ignored
+for the rows it is older than. When a newer value is lower (the node exporter
+restarted while the job was running), the previous value is carried over and
+the total keeps growing. A batch is acknowledged only once its rows are
+committed; a node keeps unacknowledged changes and sends them again with its
+next batch, so a crash or a failed write loses nothing. Prometheus scrapes cluster-level account totals from
+the aggregator instead of per-GPU and per-PID series from every node.
+"""
+import argparse
+import os
+import socketserver
+import sqlite3
+import threading
+import time
+
+from .instrumentation import Instrumentation
+from .push import decode_batch, parse_address
+from .store import UtilizationStore
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS job_usage (
+        node TEXT,
+        job_id INTEGER,
+        metric TEXT,
+        account TEXT,
+        user TEXT,
+        value REAL,
+        carried REAL DEFAULT 0,
+        first_seen REAL,
+        last_seen REAL,
+        ended REAL,
+        UNIQUE (node, job_id, metric)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_job_usage_account ON job_usage (account, metric)",
+    """
+    CREATE TABLE IF NOT EXISTS maintenance_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""",
+)
+
+INSERTS = {
+    # Batches from one node may be merged out of order, so ``last_seen`` (the node's batch
+    # time) orders the values: a row no newer than the stored one is ignored, and a lower value
+    # is a counter reset only because it is newer; ``carried`` keeps what was counted before
+    # the reset. Likewise only values newer than an end reopen the job (e.g. a requeued job on
+    # the same node), and an end older than the latest value does not close it.
+    'job_usage': """
+        INSERT INTO job_usage (node, job_id, metric, account, user, value, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (node, job_id, metric) DO UPDATE SET
+            carried = carried + CASE WHEN excluded.value < value THEN value ELSE 0 END,
+            value = excluded.value,
+            account = COALESCE(NULLIF(excluded.account, ''), account),
+            user = COALESCE(NULLIF(excluded.user, ''), user),
+            last_seen = excluded.last_seen,
+            ended = CASE WHEN ended < excluded.last_seen THEN NULL ELSE ended END
+        WHERE excluded.last_seen > job_usage.last_seen
+    """,
+    'job_end': """
+        UPDATE job_usage SET ended = ?
+        WHERE node = ? AND job_id = ? AND ended IS NULL AND last_seen <= ?
+    """,
+}
+
+# Cluster-level families, as (metric, family name, documentation); values are stored in seconds.
+HOURS = (
+    ('gpu_seconds', 'cluster_account_gpu_hours_total', 'GPU hours occupied by the jobs of an account'),
+    ('gpu_busy_seconds', 'cluster_account_gpu_busy_hours_total', 'GPU hours of an account, weighted by GPU utilization'),
+    ('cpu_seconds', 'cluster_account_cpu_hours_total', 'CPU hours consumed by the jobs of an account'),
+)
+
+
+class Aggregator:
+    """Merges node batches into the cluster database and builds the cluster metrics."""
+
+    def __init__(self, store, instrumentation=None, stale_after=300.0, clock=time.time):
+        """
+        :param store: A UtilizationStore opened with this module's SCHEMA and INSERTS.
+        :param instrumentation: Instrumentation the merges are tracked on (``merge``).
+        :param stale_after: Seconds without a batch after which a node or a job no longer counts as running.
+        :param clock: Wall clock, used for the staleness of nodes and jobs.
+        """
+        self.store = store
+        self.instrumentation = instrumentation or Instrumentation('poc_aggregator')
+        self.stale_after = stale_after
+        self.clock = clock
+        self.nodes = {}  # node -> time of its last batch
+        self.batches = 0
+        self.values = 0
+        self._lock = threading.Lock()
+
+    def merge(self, batch):
+        """
+        Writes the rows of one decoded batch in a single transaction.
+
+        :param batch: A batch as returned by push.decode_batch().
+        :raises ValueError: If a job entry is malformed.
+        :raises sqlite3.Error: If the rows could not be committed; nothing of the batch is stored.
+        """
+        node = batch['node']
+        timestamp = float(batch.get('time') or self.clock())
+        rows = []
+        for entry in batch.get('jobs', []):
+            job_id, account, user, values = entry
+            for metric, value in values.items():
+                rows.append((node, int(job_id), str(metric), str(account), str(user), float(value),
+                             timestamp, timestamp))
+        ended = [(timestamp, node, int(job_id), timestamp) for job_id in batch.get('ended', [])]
+        # Committed before merge() returns, so the node is acknowledged only for stored rows.
+        with self.store.transaction() as conn:
+            conn.executemany(self.store.inserts['job_usage'], rows)
+            conn.executemany(self.store.inserts['job_end'], ended)
+        with self._lock:
+            self.nodes[node] = timestamp
+            self.batches += 1
+            self.values += len(rows)
+
+    def version(self):
+        return self.batches
+
+    def build(self, family):
+        """
+        :param family: Family factory taking (name, documentation, labels, type).
+        :return: The cluster-level metric families.
+        """
+        self.store.flush()
+        now = self.clock()
+        families = []
+        totals = {}
+        for account, metric, seconds in self.store.query("""
+                SELECT account, metric, SUM(carried + value) FROM job_usage GROUP BY account, metric"""):
+            totals[(metric, account or 'unknown')] = seconds
+        for metric, name, documentation in HOURS:
+            hours = family(name, documentation, ['account'], 'counter')
+            for (kind, account), seconds in sorted(totals.items()):
+                if kind == metric:
+                    hours.add_metric([account], seconds / 3600.0)
+            families.append(hours)
+
+        running = family('cluster_account_running_jobs', 'Jobs of an account that reported within the stale window',
+                         ['account'], 'gauge')
+        for account, jobs in self.store.query("""
+                SELECT account, COUNT(DISTINCT node || ':' || job_id) FROM job_usage
+                WHERE ended IS NULL AND last_seen >= ? GROUP BY account""", (now - self.stale_after,)):
+            running.add_metric([account or 'unknown'], jobs)
+        families.append(running)
+
+        with self._lock:
+            nodes = dict(self.nodes)
+            batches, values = self.batches, self.values
+        reporting = family('cluster_nodes_reporting', 'Nodes that pushed a batch within the stale window', [], 'gauge')
+        reporting.add_metric([], sum(1 for last in nodes.values() if now - last <= self.stale_after))
+        last_push = family('cluster_node_last_push_timestamp_seconds', 'Time of the last batch pushed by a node',
+                           ['node'], 'gauge')
+        for node, last in sorted(nodes.items()):
+            last_push.add_metric([node], last)
+        received = family('cluster_batches_received_total', 'Batches merged from the nodes', [], 'counter')
+        received.add_metric([], batches)
+        merged = family('cluster_values_merged_total', 'Job values merged from the nodes', [], 'counter')
+        merged.add_metric([], values)
+        families.extend([reporting, last_push, received, merged])
+        return families
+
+
+class _BatchHandler(socketserver.StreamRequestHandler):
+    # One connection may carry several batches; each line is answered with ok once it is
+    # committed, or with an error, after which the node sends the changes again.
+
+    def handle(self):
+        aggregator = self.server.aggregator
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                with aggregator.instrumentation.track('merge'):
+                    aggregator.merge(decode_batch(line))
+            except (ValueError, TypeError, KeyError) as e:
+                print(f"[WARN] Rejected batch: {e}")
+                self.wfile.write(f"error {type(e).__name__}\n".encode('utf-8'))
+                continue
+            except sqlite3.Error as e:
+                print(f"[ERROR] Batch could not be stored: {e}")
+                self.wfile.write(b"error store\n")
+                continue
+            self.wfile.write(b"ok\n")
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address, aggregator):
+    """
+    Listens for node batches in a background thread.
+
+    :param address: ``unix:/path`` or ``host:port``.
+    :param aggregator: The Aggregator batches are merged into.
+    :return: The socketserver server; call shutdown() and server_close() to stop it.
+    """
+    family, target = parse_address(address)
+    if family == _UnixServer.address_family:
+        if os.path.exists(target):
+            os.unlink(target)  # left over by a previous run
+        server = _UnixServer(target, _BatchHandler)
+    else:
+        server = _TcpServer(target, _BatchHandler)
+    server.aggregator = aggregator
+    threading.Thread(target=server.serve_forever, name='aggregator', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(prog="python3 -m poc_exporters.aggregator",
+                                     description="Merges node summaries into cluster-level account GPU/CPU hours.")
+    parser.add_argument("--listen", default=env("POC_AGGREGATOR_LISTEN", "unix:/run/poc_exporters/aggregator.sock"),
+                        help="where nodes push to: unix:/path or host:port")
+    parser.add_argument("--db", default=env("POC_AGGREGATOR_DB", "cluster.db"), help="cluster database")
+    parser.add_argument("--port", type=int, default=int(env("POC_AGGREGATOR_PORT", "9062")), help="HTTP port of /metrics")
+    parser.add_argument("--stale-after", type=float, default=float(env("POC_AGGREGATOR_STALE_AFTER", "300")),
+                        help="seconds without a batch after which a node or job no longer counts as running")
+    args = parser.parse_args(argv)
+
+    from prometheus_client import REGISTRY, start_http_server
+    from .scrape import SnapshotCollector, prometheus_family
+
+    store = UtilizationStore(args.db, schema=SCHEMA, inserts=INSERTS, added_columns=())
+    aggregator = Aggregator(store, stale_after=args.stale_after)
+    # Rebuilt when a batch arrived, and at least once a minute so staleness is reflected.
+    REGISTRY.register(SnapshotCollector(lambda: aggregator.build(prometheus_family), aggregator.version,
+                                        'poc_aggregator', max_age=60))
+    REGISTRY.register(aggregator.instrumentation.collector(store=store))
+    server = serve(args.listen, aggregator)
+    start_http_server(args.port)
+    print(f"[INFO] Aggregating node batches from {args.listen}, serving cluster metrics on :{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
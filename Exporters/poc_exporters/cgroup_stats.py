@@ -0,0 +1,337 @@
+"""
+Per-job resource accounting read from Slurm job cgroups.
+
+A job's cgroup keeps counting after the processes that did the work have
+exited, so job-level totals read here are monotonic for the lifetime of the
+job, and cost one file read per job instead of one per process.
+
+I/O is read from ``io.stat`` (cgroup v2, already hierarchical) or from
+``blkio.throttle.io_service_bytes_recursive`` /
+``blkio.throttle.io_service_bytes`` (cgroup v1), summed over all devices.
+The optional per-PID drill-down reads ``/proc/<pid>/io`` of each job process.
+
+CPU, memory and pressure stall (PSI) figures come from ``cpu.stat``,
+``memory.current``/``memory.peak`` and ``{cpu,memory,io}.pressure`` on
+cgroup v2, or ``cpuacct.usage``, ``cpu.stat`` and ``memory.*usage_in_bytes``
+on cgroup v1 (which has no PSI). ``JobResourceCollector`` keeps the previous
+reading of every job in memory, so utilization and stall percentages are
+derived from two consecutive passes without extra reads.
+
+Collectors take the ``{job_id: path}`` map a JobResolver found while
+resolving PIDs (``JobResolver.job_cgroups``), so one pass over the cgroup
+tree serves every metric; without it they locate the job cgroups themselves.
+"""
+import os
+import time
+from dataclasses import dataclass, field
+
+from .slurm_jobs import CGROUP_ROOT, PROC_ROOT, V1_CONTROLLERS, find_job_cgroups, read_job_pids
+
+PRESSURE_RESOURCES = ('cpu', 'memory', 'io')
+
+# blkio first; the others only serve the per-PID drill-down on nodes where Slurm
+# does not place jobs in a blkio hierarchy.
+V1_IO_CONTROLLERS = ('blkio',) + V1_CONTROLLERS
+V1_IO_FILES = ('blkio.throttle.io_service_bytes_recursive', 'blkio.throttle.io_service_bytes')
+
+
+def controller_path(path, controller, cgroup_root=CGROUP_ROOT):
+    """
+    Maps a job cgroup found under one cgroup v1 controller to the same job under
+    another controller. cgroup v2 paths, where all controllers share one
+    directory, are returned unchanged.
+
+    :param path: Job cgroup directory.
+    :param controller: Target v1 controller, e.g. ``memory``.
+    :param cgroup_root: Mount point of the cgroup filesystem.
+    :return: The job's directory in ``controller``'s hierarchy.
+    """
+    first, _, rest = os.path.relpath(path, cgroup_root).partition(os.sep)
+    if first in V1_CONTROLLERS or first == 'blkio':
+        return os.path.join(cgroup_root, controller, rest)
+    return path
+
+
+def parse_flat_keyed(text):
+    """
+    Parses a flat-keyed cgroup file such as ``cpu.stat`` (``key value`` per line).
+
+    :param text: File contents.
+    :return: A dictionary mapping keys to integers.
+    """
+    values = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            values[parts[0]] = int(parts[1])
+    return values
+
+
+def parse_pressure(text):
+    """
+    Parses a PSI file such as ``cpu.pressure``.
+
+    :param text: File contents (lines like ``some avg10=0.00 avg60=0.00 avg300=0.00 total=1234``).
+    :return: A dictionary mapping ``some``/``full`` to the cumulative stall time in microseconds.
+    """
+    totals = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        for item in parts[1:]:
+            key, _, value = item.partition('=')
+            if key == 'total':
+                totals[parts[0]] = int(value)
+    return totals
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _read_int(path):
+    text = _read(path)
+    try:
+        return int(text) if text is not None else None
+    except ValueError:
+        return None
+
+
+def parse_io_stat(text):
+    """
+    Sums a cgroup v2 ``io.stat`` file over all devices.
+
+    :param text: Contents of io.stat (lines like ``8:0 rbytes=1 wbytes=2 rios=3 ...``).
+    :return: A tuple (read_bytes, write_bytes).
+    """
+    read_bytes = write_bytes = 0
+    for line in text.splitlines():
+        for item in line.split()[1:]:
+            key, _, value = item.partition('=')
+            if key == 'rbytes':
+                read_bytes += int(value)
+            elif key == 'wbytes':
+                write_bytes += int(value)
+    return read_bytes, write_bytes
+
+
+def parse_blkio_service_bytes(text):
+    """
+    Sums a cgroup v1 ``blkio.throttle.io_service_bytes`` file over all devices.
+
+    :param text: File contents (lines like ``8:0 Read 1024``, plus a ``Total`` line).
+    :return: A tuple (read_bytes, write_bytes).
+    """
+    read_bytes = write_bytes = 0
+    for line in text.splitlines():
+        parts = line.split()
+        # The trailing "Total <n>" line has no device column.
+        if len(parts) != 3:
+            continue
+        if parts[1] == 'Read':
+            read_bytes += int(parts[2])
+        elif parts[1] == 'Write':
+            write_bytes += int(parts[2])
+    return read_bytes, write_bytes
+
+
+def read_cgroup_io(path):
+    """
+    Reads the cumulative I/O of one cgroup, v2 or v1.
+
+    :param path: cgroup directory.
+    :return: A tuple (read_bytes, write_bytes), or None if no I/O accounting file is readable.
+    """
+    try:
+        with open(os.path.join(path, 'io.stat'), 'r') as f:
+            return parse_io_stat(f.read())
+    except OSError:
+        pass
+    except ValueError as e:
+        print(f"[WARN] Cannot parse {path}/io.stat: {e}")
+        return None
+    for name in V1_IO_FILES:
+        try:
+            with open(os.path.join(path, name), 'r') as f:
+                return parse_blkio_service_bytes(f.read())
+        except OSError:
+            continue
+        except ValueError as e:
+            print(f"[WARN] Cannot parse {path}/{name}: {e}")
+            return None
+    return None
+
+
+def read_process_io(pid, proc_root=PROC_ROOT):
+    """
+    :param pid: Process ID.
+    :param proc_root: Mount point of the proc filesystem.
+    :return: A tuple (read_bytes, write_bytes) from ``/proc/<pid>/io``, or None if unreadable.
+    """
+    values = {}
+    try:
+        with open(os.path.join(proc_root, str(pid), 'io'), 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                values[key.strip()] = value.strip()
+        return int(values['read_bytes']), int(values['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class JobIoCollector:
+    """Cumulative read/write bytes per Slurm job, optionally broken down per process."""
+
+    def __init__(self, cgroup_root=CGROUP_ROOT, proc_root=PROC_ROOT, per_pid=False):
+        """
+        :param cgroup_root: Mount point of the cgroup filesystem.
+        :param proc_root: Mount point of the proc filesystem (per-PID mode only).
+        :param per_pid: Also read ``/proc/<pid>/io`` of every process in each job.
+        """
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        self.per_pid = per_pid
+
+    def job_paths(self):
+        """
+        :return: A dictionary mapping job IDs to the cgroup directory holding their I/O accounting.
+        """
+        # On cgroup v2 every controller shares one directory; on v1 only blkio has I/O files,
+        # so jobs found under another controller report no totals.
+        return find_job_cgroups(self.cgroup_root, V1_IO_CONTROLLERS)
+
+    def collect(self, paths=None):
+        """
+        Reads the I/O counters of every job on the node.
+
+        :param paths: ``{job_id: path}`` of the job cgroups (e.g. JobResolver.job_cgroups),
+                      or None to locate them.
+        :return: A tuple (jobs, processes). ``jobs`` maps job IDs to (read_bytes, write_bytes).
+                 ``processes`` maps (job ID, PID) to (read_bytes, write_bytes) and is empty
+                 unless per-PID mode is enabled.
+        """
+        jobs = {}
+        processes = {}
+        if paths is None:
+            paths = self.job_paths()
+        for job_id, path in paths.items():
+            totals = read_cgroup_io(controller_path(path, 'blkio', self.cgroup_root))
+            if totals is not None:
+                jobs[job_id] = totals
+            if self.per_pid:
+                for pid in read_job_pids(path):
+                    usage = read_process_io(pid, self.proc_root)
+                    if usage is not None:
+                        processes[(job_id, pid)] = usage
+        return jobs, processes
+
+
+@dataclass
+class JobResources:
+    """CPU, memory and pressure readings of one job cgroup; rates are None on a job's first pass."""
+    job_id: int
+    cpu_usage_seconds: float = None
+    cpu_throttled_seconds: float = None
+    cpu_throttled_periods: int = None
+    memory_current_bytes: int = None
+    memory_peak_bytes: int = None
+    # (resource, 'some'|'full') -> cumulative stall seconds
+    pressure_seconds: dict = field(default_factory=dict)
+    cpu_percent: float = None  # 100 = one core fully busy
+    cpu_throttled_percent: float = None  # share of wall time spent throttled
+    # (resource, 'some'|'full') -> share of wall time stalled, in percent
+    pressure_percent: dict = field(default_factory=dict)
+
+
+class JobResourceCollector:
+    """Per-job CPU, memory and PSI readings, with rates from the previous pass held in memory."""
+
+    def __init__(self, cgroup_root=CGROUP_ROOT, clock=time.monotonic):
+        """
+        :param cgroup_root: Mount point of the cgroup filesystem.
+        :param clock: Monotonic clock in seconds, used to turn counter deltas into rates.
+        """
+        self.cgroup_root = cgroup_root
+        self.clock = clock
+        self._previous = {}  # job_id -> (clock, JobResources)
+
+    def read(self, job_id, path):
+        """
+        Reads the current counters of one job, without rates.
+
+        :param job_id: Job ID.
+        :param path: Job cgroup directory (any controller on v1).
+        :return: JobResources.
+        """
+        sample = JobResources(job_id)
+        cpu_stat = _read(os.path.join(path, 'cpu.stat'))
+        if cpu_stat is not None and 'usage_usec' in cpu_stat:
+            # cgroup v2: one directory, microsecond counters and PSI files.
+            stat = parse_flat_keyed(cpu_stat)
+            sample.cpu_usage_seconds = stat['usage_usec'] / 1e6
+            if 'throttled_usec' in stat:
+                sample.cpu_throttled_seconds = stat['throttled_usec'] / 1e6
+            sample.cpu_throttled_periods = stat.get('nr_throttled')
+            sample.memory_current_bytes = _read_int(os.path.join(path, 'memory.current'))
+            sample.memory_peak_bytes = _read_int(os.path.join(path, 'memory.peak'))
+            for resource in PRESSURE_RESOURCES:
+                text = _read(os.path.join(path, f'{resource}.pressure'))
+                for kind, total in (parse_pressure(text) if text else {}).items():
+                    sample.pressure_seconds[(resource, kind)] = total / 1e6
+            return sample
+        # cgroup v1: nanosecond counters spread over the cpu, cpuacct and memory hierarchies.
+        usage = _read_int(os.path.join(controller_path(path, 'cpuacct', self.cgroup_root), 'cpuacct.usage'))
+        if usage is not None:
+            sample.cpu_usage_seconds = usage / 1e9
+        cpu_stat = _read(os.path.join(controller_path(path, 'cpu', self.cgroup_root), 'cpu.stat'))
+        if cpu_stat is not None:
+            stat = parse_flat_keyed(cpu_stat)
+            if 'throttled_time' in stat:
+                sample.cpu_throttled_seconds = stat['throttled_time'] / 1e9
+            sample.cpu_throttled_periods = stat.get('nr_throttled')
+        memory = controller_path(path, 'memory', self.cgroup_root)
+        sample.memory_current_bytes = _read_int(os.path.join(memory, 'memory.usage_in_bytes'))
+        sample.memory_peak_bytes = _read_int(os.path.join(memory, 'memory.max_usage_in_bytes'))
+        return sample
+
+    def collect(self, paths=None):
+        """
+        Reads every job and derives rates from its previous reading.
+
+        :param paths: ``{job_id: path}`` of the job cgroups (e.g. JobResolver.job_cgroups),
+                      or None to locate them.
+        :return: A dictionary mapping job IDs to JobResources.
+        """
+        if paths is None:
+            paths = find_job_cgroups(self.cgroup_root)
+        now = self.clock()
+        current = {}
+        for job_id, path in paths.items():
+            sample = self.read(job_id, path)
+            previous = self._previous.get(job_id)
+            if previous is not None and now > previous[0]:
+                _set_rates(sample, previous[1], now - previous[0])
+            current[job_id] = (now, sample)
+        # Jobs that ended are forgotten here, so their state does not accumulate.
+        self._previous = current
+        return {job_id: sample for job_id, (_, sample) in current.items()}
+
+
+def _rate(current, previous, elapsed):
+    if current is None or previous is None or current < previous:
+        return None  # missing, or a counter reset (same job ID reused after a requeue)
+    return 100.0 * (current - previous) / elapsed
+
+
+def _set_rates(sample, previous, elapsed):
+    sample.cpu_percent = _rate(sample.cpu_usage_seconds, previous.cpu_usage_seconds, elapsed)
+    sample.cpu_throttled_percent = _rate(sample.cpu_throttled_seconds, previous.cpu_throttled_seconds, elapsed)
+    for key, total in sample.pressure_seconds.items():
+        percent = _rate(total, previous.pressure_seconds.get(key), elapsed)
+        if percent is not None:
+            sample.pressure_percent[key] = percent
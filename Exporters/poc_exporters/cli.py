@@ -0,0 +1,138 @@
+"""
+Command line of the node exporter: ``python3 -m poc_exporters``.
+
+Every option has an environment default, so one systemd unit can be shared
+by all nodes and tuned per node group through an environment file:
+
+    POC_EXPORTERS_COLLECTORS=cpu,io,slurm,storage   # a CPU-only node
+    POC_EXPORTERS_OUTPUT=both
+"""
+import argparse
+import os
+
+from .collectors import DEFAULT_COLLECTORS, REGISTRY, Options
+from .exporter import OUTPUTS, NodeExporter
+
+TEXTFILE = os.path.join(os.environ.get("TEXTFILE_COLLECTOR_DIR", "/var/lib/node_exporter/textfile_collector"),
+                        "poc_exporters.prom")
+
+
+def _names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def status_path(textfile):
+    """
+    :param textfile: Path of the data textfile.
+    :return: Path of the matching status textfile (``<name>_status.prom``).
+    """
+    root, _ = os.path.splitext(textfile)
+    return f"{root}_status.prom"
+
+
+def parser():
+    env = os.environ.get
+    p = argparse.ArgumentParser(prog="python3 -m poc_exporters",
+                                description="Per-job GPU, I/O, CPU, Slurm and storage metrics for Prometheus.")
+    p.add_argument("--collectors", default=env("POC_EXPORTERS_COLLECTORS", ",".join(DEFAULT_COLLECTORS)),
+                   help="comma-separated collectors to enable (default: %(default)s)")
+    p.add_argument("--disable", default=env("POC_EXPORTERS_DISABLE", ""),
+                   help="comma-separated collectors to leave out, e.g. gpu on CPU-only nodes")
+    p.add_argument("--list-collectors", action="store_true", help="print the available collectors and exit")
+    p.add_argument("--output", choices=OUTPUTS, default=env("POC_EXPORTERS_OUTPUT", "textfile"),
+                   help="write a node_exporter textfile, serve /metrics over HTTP, both, "
+                        "or none when only pushing (default: %(default)s)")
+    p.add_argument("--textfile", default=env("POC_EXPORTERS_TEXTFILE", TEXTFILE), help="textfile path")
+    p.add_argument("--status-file", default=env("POC_EXPORTERS_STATUS_FILE"),
+                   help="status textfile path (default: <textfile>_status.prom)")
+    p.add_argument("--port", type=int, default=int(env("POC_EXPORTERS_PORT", "9061")), help="HTTP port")
+    p.add_argument("--interval", type=float, default=float(env("POC_EXPORTERS_INTERVAL", "15")),
+                   help="seconds between two sampling rounds")
+    p.add_argument("--once", action="store_true", help="take one round, write the textfile (and push) and exit")
+    p.add_argument("--namespace", default=env("POC_EXPORTERS_NAMESPACE", "poc_exporters"),
+                   help="prefix of the exporter's own metrics")
+    p.add_argument("--io-per-pid", action="store_true", default=env("POC_EXPORTERS_IO_PER_PID", "0") == "1",
+                   help="also export per-process I/O of job processes (high cardinality)")
+    p.add_argument("--storage-mounts", default=env("STORAGE_MOUNTS", "/"),
+                   help="comma-separated mount points of the storage collector")
+    p.add_argument("--storage-quota-source", default=env("STORAGE_QUOTA_SOURCE", ""),
+                   help="quota source of the storage collector (see poc_exporters.storage)")
+    p.add_argument("--storage-quota-users", default=env("STORAGE_QUOTA_USERS", ""),
+                   help="comma-separated users whose quotas an lfs quota source reports")
+    p.add_argument("--storage-quota-groups", default=env("STORAGE_QUOTA_GROUPS", ""),
+                   help="comma-separated groups whose quotas an lfs quota source reports")
+    p.add_argument("--storage-quota-projects", default=env("STORAGE_QUOTA_PROJECTS", ""),
+                   help="comma-separated project IDs whose quotas an lfs quota source reports")
+    p.add_argument("--push", default=env("POC_EXPORTERS_PUSH"),
+                   help="also push per-job summaries to the aggregator at unix:/path or host:port")
+    p.add_argument("--push-window", type=float, default=float(env("POC_EXPORTERS_PUSH_WINDOW", "60")),
+                   help="seconds between two pushes")
+    p.add_argument("--max-series", type=int, default=int(env("POC_EXPORTERS_MAX_SERIES", "1000")),
+                   help="label sets per metric family before new ones are folded into an overflow series "
+                        "(gauges) or dropped (counters); 0 = no limit")
+    p.add_argument("--series-expiry", type=int, default=int(env("POC_EXPORTERS_SERIES_EXPIRY", "5")),
+                   help="scrapes (or textfile writes) after which a label set no longer seen is forgotten")
+    # Kept for the legacy scripts, whose dashboards use the old metric name and label.
+    p.add_argument("--gpu-memory-metric", default=Options.gpu_memory_metric, help=argparse.SUPPRESS)
+    p.add_argument("--gpu-job-gpu-count", action="store_true", help=argparse.SUPPRESS)
+    return p
+
+
+def main(argv=None):
+    """
+    :param argv: Arguments without the program name; sys.argv[1:] if omitted.
+    :return: The exit status.
+    """
+    args = parser().parse_args(argv)
+    if args.list_collectors:
+        for name, target in sorted(REGISTRY.items()):
+            print(f"{name:10} {target}")
+        return 0
+
+    disabled = set(_names(args.disable))
+    names = [name for name in _names(args.collectors) if name not in disabled]
+    unknown = [name for name in names if name not in REGISTRY]
+    if unknown:
+        print(f"[ERROR] Unknown collectors: {', '.join(unknown)} (available: {', '.join(sorted(REGISTRY))})")
+        return 2
+    if args.once and args.output in ('http', 'both'):
+        print("[ERROR] --once does not apply to HTTP output")
+        return 2
+    if args.output == 'none' and not args.push:
+        print("[ERROR] --output none needs --push")
+        return 2
+
+    options = Options(
+        io_per_pid=args.io_per_pid,
+        gpu_window=args.output != 'textfile',
+        gpu_memory_metric=args.gpu_memory_metric,
+        gpu_job_gpu_count=args.gpu_job_gpu_count,
+        storage_mounts=tuple(_names(args.storage_mounts)),
+        storage_quota_source=args.storage_quota_source,
+        storage_quota_users=tuple(_names(args.storage_quota_users)),
+        storage_quota_groups=tuple(_names(args.storage_quota_groups)),
+        storage_quota_projects=tuple(_names(args.storage_quota_projects)),
+    )
+    status_file = args.status_file or status_path(args.textfile)
+    try:
+        exporter = NodeExporter(names, options, namespace=args.namespace, push=args.push,
+                                push_window=args.push_window, max_series=args.max_series,
+                                series_expiry=args.series_expiry)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return 2
+    if not exporter.collectors:
+        print("[ERROR] No collector is enabled on this node")
+        if args.output in ('textfile', 'both'):
+            from .textfile import TextfileWriter
+
+            TextfileWriter(status_file).write(exporter.instrumentation.textfile_families())
+        return 1
+    try:
+        exporter.run(args.output, textfile=args.textfile, status_file=status_file,
+                     port=args.port, interval=args.interval, once=args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.close()
+    return 0
@@ -0,0 +1,162 @@
+"""
+Pluggable collectors of the node exporter (``python3 -m poc_exporters``).
+
+On every round a collector takes a reading with ``sample(context)``. When an
+output is published, ``families(family)`` turns the readings since the
+previous publication into metric families, built with a factory that takes
+``(name, documentation, labels, type)``. The factory is textfile.MetricFamily
+for textfile output, or prometheus_client families for HTTP output.
+
+Collectors are registered by ``module:attribute`` path and imported only when
+enabled. A CPU-only node therefore never loads the GPU sampler, and nodes
+without Slurm metadata never load the command runner. A collector whose
+prerequisites are missing on the node raises CollectorUnavailable from its
+constructor and is left out.
+
+With ``--push``, ``summarize(summaries)`` also reduces the latest reading to
+per-job totals for the central aggregator (see push.py).
+
+``RoundContext`` holds what several collectors need from one round, such as
+the PID-to-job map and the job cgroups. It is computed once, on first use.
+"""
+import importlib
+from dataclasses import dataclass
+
+REGISTRY = {
+    'gpu': 'poc_exporters.collectors.gpu:GpuCollector',
+    'io': 'poc_exporters.collectors.cgroups:IoCollector',
+    'cpu': 'poc_exporters.collectors.cgroups:ResourceCollector',
+    'slurm': 'poc_exporters.collectors.slurm:SlurmJobCollector',
+    'storage': 'poc_exporters.collectors.storage:StorageCollector',
+}
+
+DEFAULT_COLLECTORS = ('gpu', 'io', 'cpu', 'slurm')
+
+
+class CollectorUnavailable(Exception):
+    """Raised by a collector's constructor when the node lacks what it needs (e.g. GPUs)."""
+
+
+@dataclass
+class Options:
+    io_per_pid: bool = False  # per-process I/O series (high cardinality)
+    gpu_window: bool = False  # also export _min/_max of the GPU samples since the last publication
+    gpu_memory_metric: str = 'cgroups_nvidia_gpu_memory_usage_bytes'
+    gpu_job_gpu_count: bool = False  # add the job's allocated GPU count as a job_gpu_count label
+    storage_mounts: tuple = ('/',)
+    storage_timeout: float = 10.0
+    storage_quota_source: str = ''  # see storage.open_quota_source
+    storage_quota_users: tuple = ()  # users, groups and projects an ``lfs`` quota source reports
+    storage_quota_groups: tuple = ()
+    storage_quota_projects: tuple = ()
+    storage_quota_interval: float = 900.0
+
+
+class Collector:
+    """Base class of the collectors."""
+
+    name = None
+
+    def __init__(self, options):
+        """
+        :param options: Options shared by all collectors.
+        :raises CollectorUnavailable: If the collector cannot work on this node.
+        """
+        self.options = options
+
+    def sample(self, context):
+        """
+        Takes one reading.
+
+        :param context: RoundContext of the current round.
+        """
+
+    def families(self, family):
+        """
+        :param family: Family factory taking (name, documentation, labels, type).
+        :return: A list of metric families from the readings since the previous call.
+        """
+        return []
+
+    def summarize(self, summaries):
+        """
+        Adds the latest reading to the per-job summaries pushed to the aggregator.
+
+        :param summaries: push.JobSummaries of the node.
+        """
+
+    def close(self):
+        """Releases long-lived resources (device handles, ...)."""
+
+
+def register(name, target):
+    """
+    Registers a collector, or replaces a built-in one.
+
+    :param name: Collector name used on the command line.
+    :param target: ``module:attribute`` path of a Collector subclass.
+    """
+    REGISTRY[name] = target
+
+
+def load(name):
+    """
+    Imports a registered collector class.
+
+    :param name: Collector name.
+    :return: The Collector subclass.
+    :raises KeyError: If no collector is registered under ``name``.
+    """
+    module, _, attribute = REGISTRY[name].partition(':')
+    return getattr(importlib.import_module(module), attribute)
+
+
+class RoundContext:
+    """State shared by the collectors during one round; each part is computed on first use."""
+
+    def __init__(self, resolver, instrumentation, metadata_index=None):
+        """
+        :param resolver: The exporter's long-lived JobResolver.
+        :param instrumentation: The exporter's Instrumentation (job lookups are tracked as ``jobs``).
+        :param metadata_index: Callable returning the exporter's JobMetadataIndex.
+        """
+        self.resolver = resolver
+        self.instrumentation = instrumentation
+        self._metadata_index = metadata_index
+        self._pid_to_job = None
+        self._metadata = None
+
+    def _resolve(self):
+        # One resolver pass per round yields both the PID map and the job cgroups it walked.
+        if self._pid_to_job is None:
+            with self.instrumentation.track('jobs'):
+                self._pid_to_job = self.resolver.resolve_all()
+        return self._pid_to_job
+
+    @property
+    def pid_to_job(self):
+        """A dictionary mapping the PIDs of Slurm job processes to their job IDs."""
+        return self._resolve()
+
+    @property
+    def job_cgroups(self):
+        """A dictionary mapping job IDs to cgroup paths, or None when PIDs were resolved via /proc."""
+        self._resolve()
+        return self.resolver.job_cgroups
+
+    def job_ids(self):
+        """
+        :return: The IDs of the jobs on this node, including jobs without processes yet.
+        """
+        if self.job_cgroups is not None:
+            return set(self.job_cgroups)
+        return set(self.pid_to_job.values())
+
+    def metadata(self):
+        """
+        :return: A dictionary mapping the local job IDs to JobMetadata.
+        """
+        if self._metadata is None:
+            with self.instrumentation.track('metadata'):
+                self._metadata = self._metadata_index().get(self.job_ids())
+        return self._metadata
@@ -0,0 +1,107 @@
+"""
+Per-job I/O (``io``) and CPU/memory/pressure (``cpu``) collectors, read from the Slurm job cgroups.
+"""
+from ..cgroup_stats import JobIoCollector, JobResourceCollector
+from . import Collector
+
+
+def io_families(job_io, process_io, family):
+    """
+    Builds the I/O metric families from JobIoCollector.collect() results.
+
+    :param job_io: A dictionary mapping job IDs to (read_bytes, write_bytes).
+    :param process_io: A dictionary mapping (job ID, PID) to (read_bytes, write_bytes); may be empty.
+    :param family: Family factory taking (name, documentation, labels, type), e.g. MetricFamily.
+    :return: A list of metric families.
+    """
+    read_total = family('cgroups_io_read_bytes_total', 'Bytes read from storage by a Slurm job', ['job_id'], 'counter')
+    write_total = family('cgroups_io_write_bytes_total', 'Bytes written to storage by a Slurm job', ['job_id'], 'counter')
+    for job_id, (read, written) in sorted(job_io.items()):
+        read_total.add_metric([str(job_id)], read)
+        write_total.add_metric([str(job_id)], written)
+    families = [read_total, write_total]
+    if process_io:
+        read_bytes = family('cgroups_io_read_bytes', 'Bytes read from storage by a job process', ['pid', 'job_id'], 'gauge')
+        write_bytes = family('cgroups_io_write_bytes', 'Bytes written to storage by a job process', ['pid', 'job_id'], 'gauge')
+        for (job_id, pid), (read, written) in sorted(process_io.items()):
+            read_bytes.add_metric([str(pid), str(job_id)], read)
+            write_bytes.add_metric([str(pid), str(job_id)], written)
+        families.extend([read_bytes, write_bytes])
+    return families
+
+
+def resource_families(resources, family):
+    """
+    Builds the CPU, memory and pressure metric families from JobResourceCollector.collect() results.
+    Rate gauges are only present for jobs seen in a previous round.
+
+    :param resources: A dictionary mapping job IDs to JobResources.
+    :param family: Family factory taking (name, documentation, labels, type), e.g. MetricFamily.
+    :return: A list of metric families.
+    """
+    cpu_seconds = family('cgroups_cpu_usage_seconds_total', 'CPU time consumed by a Slurm job', ['job_id'], 'counter')
+    throttled_seconds = family('cgroups_cpu_throttled_seconds_total', 'Time a Slurm job was throttled by its CPU quota', ['job_id'], 'counter')
+    throttled_periods = family('cgroups_cpu_throttled_periods_total', 'CPU quota periods in which a Slurm job was throttled', ['job_id'], 'counter')
+    cpu_percent = family('cgroups_cpu_utilization_percent', 'CPU usage of a Slurm job since the previous sample (100 = one core)', ['job_id'], 'gauge')
+    throttled_percent = family('cgroups_cpu_throttled_percent', 'Share of wall time a Slurm job was throttled since the previous sample', ['job_id'], 'gauge')
+    memory_current = family('cgroups_memory_usage_bytes', 'Memory currently charged to a Slurm job', ['job_id'], 'gauge')
+    memory_peak = family('cgroups_memory_peak_bytes', 'Peak memory charged to a Slurm job', ['job_id'], 'gauge')
+    stall_seconds = family('cgroups_pressure_stall_seconds_total', 'Time tasks of a Slurm job were stalled on a resource (PSI)', ['job_id', 'resource', 'kind'], 'counter')
+    stall_percent = family('cgroups_pressure_stall_percent', 'Share of wall time tasks of a Slurm job were stalled since the previous sample', ['job_id', 'resource', 'kind'], 'gauge')
+    for job_id, sample in sorted(resources.items()):
+        job = str(job_id)
+        for target, value in ((cpu_seconds, sample.cpu_usage_seconds),
+                              (throttled_seconds, sample.cpu_throttled_seconds),
+                              (throttled_periods, sample.cpu_throttled_periods),
+                              (cpu_percent, sample.cpu_percent),
+                              (throttled_percent, sample.cpu_throttled_percent),
+                              (memory_current, sample.memory_current_bytes),
+                              (memory_peak, sample.memory_peak_bytes)):
+            if value is not None:
+                target.add_metric([job], value)
+        for (resource, kind), value in sorted(sample.pressure_seconds.items()):
+            stall_seconds.add_metric([job, resource, kind], value)
+        for (resource, kind), value in sorted(sample.pressure_percent.items()):
+            stall_percent.add_metric([job, resource, kind], value)
+    return [cpu_seconds, throttled_seconds, throttled_periods, cpu_percent, throttled_percent,
+            memory_current, memory_peak, stall_seconds, stall_percent]
+
+
+class IoCollector(Collector):
+    """Cumulative I/O of each job from its cgroup, optionally per process."""
+
+    name = 'io'
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.collector = JobIoCollector(per_pid=options.io_per_pid)
+        self.io = ({}, {})
+
+    def sample(self, context):
+        # Reuse the job cgroups the resolver just walked instead of searching again.
+        self.io = self.collector.collect(context.job_cgroups)
+
+    def families(self, family):
+        return io_families(*self.io, family=family)
+
+
+class ResourceCollector(Collector):
+    """CPU time, throttling, memory and PSI of each job; rates need two rounds."""
+
+    name = 'cpu'
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.collector = JobResourceCollector()
+        self.resources = {}
+
+    def sample(self, context):
+        self.resources = self.collector.collect(context.job_cgroups)
+
+    def families(self, family):
+        return resource_families(self.resources, family)
+
+    def summarize(self, summaries):
+        for job_id, sample in self.resources.items():
+            if sample.cpu_usage_seconds is not None:
+                summaries.set(job_id, 'cpu_seconds', sample.cpu_usage_seconds)
@@ -0,0 +1,74 @@
+"""
+Per-job GPU utilization and memory collector (``gpu``).
+
+The GPU sampler (NVML, or nvidia-smi read from a pipe) stays open for the
+lifetime of the exporter. Each published value is the average of the rounds
+since the previous publication. With ``Options.gpu_window``, ``_min`` and
+``_max`` variants are published as well, so short bursts between two scrapes
+stay visible.
+"""
+from ..aggregates import ScrapeWindow
+from ..gpu import GpuSamplerError, open_sampler
+from . import Collector, CollectorUnavailable
+
+SERIES = (
+    ('utilization', 'cgroups_nvidia_gpu_utilization', 'GPU utilization (percent) of GPUs used by a Slurm job'),
+    ('memory', None, 'GPU memory used by the processes of a Slurm job'),
+)
+
+
+class GpuCollector(Collector):
+    """GPU utilization and memory of each (GPU, job) pair."""
+
+    name = 'gpu'
+
+    def __init__(self, options):
+        super().__init__(options)
+        try:
+            self.sampler = open_sampler()
+        except GpuSamplerError as e:
+            raise CollectorUnavailable(f"no GPU backend ({e})")
+        self.window = ScrapeWindow()
+        self.usages = []  # JobGpuUsage of the latest round
+        self.labels = ['gpu_id', 'job_id'] + (['job_gpu_count'] if options.gpu_job_gpu_count else [])
+
+    def sample(self, context):
+        snapshot = self.sampler.snapshot()
+        usages = self.usages = snapshot.job_usage(context.pid_to_job)
+        metadata = context.metadata() if self.options.gpu_job_gpu_count and usages else {}
+        values = {}
+        for usage in usages:
+            labels = (str(usage.gpu.index), str(usage.job_id))
+            if self.options.gpu_job_gpu_count:
+                meta = metadata.get(usage.job_id)
+                labels += (str(meta.gpu_count) if meta is not None else '0',)
+            values[('utilization', labels)] = usage.gpu.utilization
+            values[('memory', labels)] = usage.used_memory_bytes
+        self.window.record(values)
+
+    def families(self, family):
+        stats = self.window.rotate()
+        families = []
+        for series, name, documentation in SERIES:
+            name = name or self.options.gpu_memory_metric
+            average = family(name, documentation, self.labels, 'gauge')
+            low = family(f'{name}_min', f'{documentation}, minimum since the previous scrape', self.labels, 'gauge')
+            high = family(f'{name}_max', f'{documentation}, maximum since the previous scrape', self.labels, 'gauge')
+            for (kind, labels), window in sorted(stats.items()):
+                if kind != series:
+                    continue
+                average.add_metric(labels, window.mean)
+                low.add_metric(labels, window.minimum)
+                high.add_metric(labels, window.maximum)
+            families.append(average)
+            if self.options.gpu_window:
+                families.extend([low, high])
+        return families
+
+    def summarize(self, summaries):
+        for usage in self.usages:
+            summaries.add(usage.job_id, 'gpu_seconds', 1.0)
+            summaries.add(usage.job_id, 'gpu_busy_seconds', usage.gpu.utilization / 100.0)
+
+    def close(self):
+        self.sampler.close()
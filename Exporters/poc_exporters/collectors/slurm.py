@@ -0,0 +1,36 @@
+"""
+Slurm job metadata collector (``slurm``): one info series per local job.
+"""
+from . import Collector
+
+
+def job_info_family(metadata, family):
+    """
+    Builds the job info metric, to be joined on ``job_id`` for user/account/partition labels.
+
+    :param metadata: A dictionary mapping job IDs to JobMetadata.
+    :param family: Family factory taking (name, documentation, labels, type), e.g. MetricFamily.
+    :return: A metric family.
+    """
+    info = family('cgroups_job_info', 'Slurm job running on this node; always 1',
+                  ['job_id', 'user', 'account', 'partition', 'gpu_type', 'gpu_count', 'gpu_idx'], 'gauge')
+    for job_id, meta in sorted(metadata.items()):
+        info.add_metric([str(job_id), meta.user, meta.account, meta.partition, meta.gpu_type,
+                         str(meta.gpu_count), ','.join(str(index) for index in meta.gpu_indices)], 1)
+    return info
+
+
+class SlurmJobCollector(Collector):
+    """User, account, partition and GPUs of the local jobs; only new jobs cost a scontrol call."""
+
+    name = 'slurm'
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.jobs = {}
+
+    def sample(self, context):
+        self.jobs = context.metadata()
+
+    def families(self, family):
+        return [job_info_family(self.jobs, family)]
@@ -0,0 +1,76 @@
+"""
+Filesystem capacity and quota collector (``storage``).
+
+Mount points are sampled with statvfs on every round, and each call is bounded
+by a timeout. Quotas, which can be slow to query, are refreshed at most once
+per ``Options.storage_quota_interval``.
+"""
+import time
+
+from ..storage import FilesystemProbe, open_quota_source
+from . import Collector
+
+
+class StorageCollector(Collector):
+    """Bytes and inodes of the configured mount points, plus optional quotas."""
+
+    name = 'storage'
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.probe = FilesystemProbe(timeout=options.storage_timeout)
+        mounts = list(options.storage_mounts)
+        self.quota_source = open_quota_source(options.storage_quota_source, mounts[0] if mounts else '',
+                                              users=options.storage_quota_users,
+                                              groups=options.storage_quota_groups,
+                                              projects=options.storage_quota_projects)
+        self.usage = {}  # mount -> FilesystemUsage, or the exception raised for it
+        self.quotas = []
+        self._quotas_at = None
+
+    def sample(self, context):
+        self.usage = self.probe.usage_many(self.options.storage_mounts)
+        for mount, usage in self.usage.items():
+            if isinstance(usage, Exception):
+                context.instrumentation.error(self.name, type(usage).__name__)
+                print(f"[WARN] Storage sample failed for {mount}: {usage}")
+        now = time.monotonic()
+        if self.quota_source is not None and (
+                self._quotas_at is None or now - self._quotas_at >= self.options.storage_quota_interval):
+            self._quotas_at = now
+            try:
+                self.quotas = self.quota_source.collect()
+            except Exception as e:
+                context.instrumentation.error(self.name, 'quota')
+                print(f"[WARN] Quota collection failed: {e}")
+
+    def families(self, family):
+        up = family('storage_up', 'Whether statvfs on the mount point answered in time', ['mount'], 'gauge')
+        size_bytes = family('storage_size_bytes', 'Size of a filesystem in bytes', ['mount'], 'gauge')
+        used_bytes = family('storage_used_bytes', 'Bytes used on a filesystem', ['mount'], 'gauge')
+        avail_bytes = family('storage_avail_bytes', 'Bytes available to unprivileged users on a filesystem', ['mount'], 'gauge')
+        size_inodes = family('storage_size_inodes', 'Inodes of a filesystem', ['mount'], 'gauge')
+        used_inodes = family('storage_used_inodes', 'Inodes used on a filesystem', ['mount'], 'gauge')
+        for mount, usage in sorted(self.usage.items()):
+            if isinstance(usage, Exception):
+                up.add_metric([mount], 0)
+                continue
+            up.add_metric([mount], 1)
+            size_bytes.add_metric([mount], usage.total_bytes)
+            used_bytes.add_metric([mount], usage.used_bytes)
+            avail_bytes.add_metric([mount], usage.avail_bytes)
+            size_inodes.add_metric([mount], usage.total_inodes)
+            used_inodes.add_metric([mount], usage.used_inodes)
+        families = [up, size_bytes, used_bytes, avail_bytes, size_inodes, used_inodes]
+        if self.quota_source is not None:
+            labels = ['mount', 'kind', 'name']
+            quota_used = family('storage_quota_used_bytes', 'Bytes charged to a user, group or project quota', labels, 'gauge')
+            quota_limit = family('storage_quota_limit_bytes', 'Hard block quota of a user, group or project (0 = none)', labels, 'gauge')
+            quota_inodes = family('storage_quota_used_inodes', 'Inodes charged to a user, group or project quota', labels, 'gauge')
+            for quota in self.quotas:
+                key = [quota.mount, quota.kind, quota.name]
+                quota_used.add_metric(key, quota.used_bytes)
+                quota_limit.add_metric(key, quota.limit_bytes)
+                quota_inodes.add_metric(key, quota.used_inodes)
+            families.extend([quota_used, quota_limit, quota_inodes])
+        return families
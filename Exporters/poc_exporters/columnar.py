@@ -0,0 +1,318 @@
+"""
+Columnar export of the utilization database for chargeback reporting.
+
+``ColumnarExporter`` streams tables of a UtilizationStore into Parquet or
+Arrow IPC datasets, one directory per dataset, partitioned hive-style:
+
+    <directory>/raw/date=2024-05-01/account=gpu0/part-<first key>-0.parquet
+    <directory>/hour/date=2024-05-01/account=gpu0/part-<first key>-0.parquet
+    <directory>/cpu/period=30days/account=physics/part-<first key>-0.parquet
+
+Rows are read in chunks of ``chunk_rows`` with keyset pagination, so memory
+stays bounded whatever the size of the database. After each chunk, the last
+exported key is saved as a watermark in ``maintenance_state``, and a rerun
+only reads newer rows. File names derive from the first key of their chunk.
+A run interrupted between a file and its watermark therefore rewrites the
+same files instead of duplicating them.
+
+Raw samples are deleted by the retention TTL (7 days by default), so export
+more often than that. Rollup rows are only written for closed buckets, and
+never change afterwards.
+
+``gpu_hours`` aggregates an exported dataset per account with Arrow kernels,
+record batch by record batch, without turning rows into Python objects.
+
+pyarrow is optional and imported on first use:
+
+    python3 -m poc_exporters.columnar export --db utilization.db --out /srv/chargeback
+    python3 -m poc_exporters.columnar gpu-hours --out /srv/chargeback --start 2024-01-01 --end 2025-01-01
+"""
+import argparse
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+
+FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}  # --format -> pyarrow.dataset format name
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+@dataclass
+class Dataset:
+    query: str  # selects ``columns`` after the rows greater than the watermark, with a LIMIT
+    columns: tuple  # (name, type) pairs; type is one of string, timestamp, float64, int64
+    partitioning: tuple  # column names used as directories
+    key_columns: int = 1  # leading columns that form the watermark
+    drop: tuple = ()  # columns only used for pagination, not written
+
+
+def _rollup_dataset(tier):
+    return Dataset(
+        query=f"""
+            SELECT bucket, account, substr(bucket, 1, 10), samples, sum_utilization,
+                   min_utilization, max_utilization
+            FROM gpu_utilization_rollup
+            WHERE tier = '{tier}' AND (bucket, account) > (?, ?)
+            ORDER BY bucket, account LIMIT ?""",
+        columns=(('bucket', 'timestamp'), ('account', 'string'), ('date', 'string'), ('samples', 'int64'),
+                 ('sum_utilization', 'float64'), ('min_utilization', 'float64'), ('max_utilization', 'float64')),
+        partitioning=('date', 'account'),
+        key_columns=2,
+    )
+
+
+DATASETS = {
+    'raw': Dataset(
+        query="""
+            SELECT id, timestamp, substr(timestamp, 1, 10), account, utilization_percent, samples
+            FROM gpu_utilization_raw WHERE id > ? ORDER BY id LIMIT ?""",
+        columns=(('id', 'int64'), ('timestamp', 'timestamp'), ('date', 'string'), ('account', 'string'),
+                 ('utilization_percent', 'float64'), ('samples', 'int64')),
+        partitioning=('date', 'account'),
+        drop=('id',),
+    ),
+    'minute': _rollup_dataset('minute'),
+    'hour': _rollup_dataset('hour'),
+    'day': _rollup_dataset('day'),
+    'aggregate': Dataset(
+        query="""
+            SELECT id, date, period, account, average_utilization
+            FROM gpu_utilization_aggregate WHERE id > ? ORDER BY id LIMIT ?""",
+        columns=(('id', 'int64'), ('date', 'string'), ('period', 'string'), ('account', 'string'),
+                 ('average_utilization', 'float64')),
+        partitioning=('date', 'account'),
+        drop=('id',),
+    ),
+    'cpu': Dataset(
+        query="""
+            SELECT id, period, account, cpu_hours, gpu_hours
+            FROM cpu_utilization WHERE id > ? ORDER BY id LIMIT ?""",
+        columns=(('id', 'int64'), ('period', 'string'), ('account', 'string'), ('cpu_hours', 'float64'),
+                 ('gpu_hours', 'float64')),
+        partitioning=('period', 'account'),
+        drop=('id',),
+    ),
+}
+
+DEFAULT_DATASETS = ('raw', 'hour', 'day', 'aggregate', 'cpu')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+    except ImportError as e:
+        raise ImportError("Columnar export needs pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+def _arrow_type(pa, name):
+    return {'string': pa.string(), 'timestamp': pa.timestamp('us'), 'float64': pa.float64(),
+            'int64': pa.int64()}[name]
+
+
+def _partitioning(pa, dataset):
+    types = dict(dataset.columns)
+    schema = pa.schema([(name, _arrow_type(pa, types[name])) for name in dataset.partitioning])
+    return pa.dataset.partitioning(schema, flavor='hive')
+
+
+class ColumnarExporter:
+    """Incrementally exports store tables to partitioned Parquet or Arrow IPC datasets."""
+
+    def __init__(self, store, directory, format='parquet', chunk_rows=200000):
+        """
+        :param store: A UtilizationStore.
+        :param directory: Root directory of the exported datasets.
+        :param format: ``parquet`` or ``arrow`` (Arrow IPC).
+        :param chunk_rows: Maximum number of rows read from the database at once.
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format: {format}")
+        self.store = store
+        self.directory = directory
+        self.format = format
+        self.chunk_rows = chunk_rows
+
+    def watermark(self, name):
+        """
+        :param name: Dataset name.
+        :return: The key columns of the last exported row, or None if never exported.
+        """
+        value = self.store.get_state(f'export_watermark:{name}')
+        if value is None:
+            return None
+        parts = value.split('\t')
+        types = [kind for _, kind in DATASETS[name].columns[:DATASETS[name].key_columns]]
+        return tuple(int(part) if kind == 'int64' else part for part, kind in zip(parts, types))
+
+    def export(self, names=DEFAULT_DATASETS):
+        """
+        Exports the rows added since the previous run.
+
+        :param names: Dataset names (keys of DATASETS).
+        :return: A dictionary mapping dataset names to the number of rows exported.
+        """
+        pa = _pyarrow()
+        self.store.flush()
+        exported = {}
+        for name in names:
+            exported[name] = self._export(pa, name, DATASETS[name])
+        return exported
+
+    def _export(self, pa, name, dataset):
+        key = self.watermark(name)
+        if key is None:
+            key = tuple(0 if kind == 'int64' else '' for _, kind in dataset.columns[:dataset.key_columns])
+        schema = pa.schema([(column, _arrow_type(pa, kind)) for column, kind in dataset.columns
+                            if column not in dataset.drop])
+        partitioning = _partitioning(pa, dataset)
+        base_dir = os.path.join(self.directory, name)
+        total = 0
+        while True:
+            rows = self.store.query(dataset.query, key + (self.chunk_rows,))
+            if not rows:
+                return total
+            arrays = []
+            for index, (column, kind) in enumerate(dataset.columns):
+                if column in dataset.drop:
+                    continue
+                values = [row[index] for row in rows]
+                if kind == 'timestamp':
+                    # SQLite holds 'YYYY-MM-DD HH:MM:SS[.ffffff]' strings; Arrow parses them in C++.
+                    arrays.append(pa.array(values, pa.string()).cast(pa.timestamp('us')))
+                else:
+                    arrays.append(pa.array(values, _arrow_type(pa, kind)))
+            table = pa.Table.from_arrays(arrays, schema=schema)
+            first = re.sub(r'[^A-Za-z0-9_.-]', '_', '-'.join(str(part) for part in rows[0][:dataset.key_columns]))
+            pa.dataset.write_dataset(
+                table, base_dir, format=FORMATS[self.format], partitioning=partitioning,
+                basename_template=f'part-{first}-{{i}}.{EXTENSIONS[self.format]}',
+                existing_data_behavior='overwrite_or_ignore')
+            key = tuple(rows[-1][:dataset.key_columns])
+            self.store.set_state(f'export_watermark:{name}', '\t'.join(str(part) for part in key))
+            total += len(rows)
+            if len(rows) < self.chunk_rows:
+                return total
+
+
+def open_dataset(directory, name, format='parquet'):
+    """
+    :param directory: Root directory of the exported datasets.
+    :param name: Dataset name.
+    :param format: ``parquet`` or ``arrow``.
+    :return: A pyarrow.dataset.Dataset with the partition columns attached.
+    """
+    pa = _pyarrow()
+    dataset = DATASETS[name]
+    # An explicit schema reads files exported before a column was added, with nulls in it.
+    schema = pa.schema([(column, _arrow_type(pa, kind)) for column, kind in dataset.columns
+                        if column not in dataset.drop])
+    return pa.dataset.dataset(os.path.join(directory, name), format=FORMATS[format], schema=schema,
+                              partitioning=_partitioning(pa, dataset))
+
+
+def gpu_hours(directory, start, end, source='hour', sample_interval=30.0, format='parquet'):
+    """
+    GPU hours per account between two times, from an exported GPU dataset.
+
+    Each sample stands for ``sample_interval`` seconds of one GPU, so the occupied
+    hours are samples * interval and the busy hours additionally weight each
+    sample by its utilization. A raw row persisted from the sample ring counts as
+    the samples it averages. Rollup buckets are counted whole, so use a tier no
+    wider than the precision needed at the range edges.
+
+    :param directory: Root directory of the exported datasets.
+    :param start: Start of the range (datetime, inclusive).
+    :param end: End of the range (datetime, exclusive).
+    :param source: ``raw``, ``minute``, ``hour`` or ``day``.
+    :param sample_interval: Seconds between two raw GPU samples (GPU_SAMPLE_INTERVAL of monitoring.py).
+    :param format: ``parquet`` or ``arrow``.
+    :return: A dictionary mapping accounts to (gpu_hours, busy_gpu_hours).
+    """
+    pa = _pyarrow()
+    pc = pa.compute
+    dataset = open_dataset(directory, source, format)
+    if source == 'raw':
+        time_column, columns = 'timestamp', ['account', 'utilization_percent', 'samples']
+    else:
+        time_column, columns = 'bucket', ['account', 'samples', 'sum_utilization']
+    aggregations = [('samples', 'sum'), ('sum_utilization', 'sum')]
+    # The date partitions prune whole directories before any file is opened.
+    condition = ((pc.field('date') >= start.strftime('%Y-%m-%d')) & (pc.field('date') <= end.strftime('%Y-%m-%d'))
+                 & (pc.field(time_column) >= pa.scalar(start, pa.timestamp('us')))
+                 & (pc.field(time_column) < pa.scalar(end, pa.timestamp('us'))))
+    totals = {}
+    for batch in dataset.to_batches(columns=columns, filter=condition):
+        if not batch.num_rows:
+            continue
+        table = pa.Table.from_batches([batch])
+        if source == 'raw':
+            # Rows exported before the samples column existed are single samples.
+            counts = pc.fill_null(table.column('samples'), 1)
+            table = pa.table({'account': table.column('account'), 'samples': counts,
+                              'sum_utilization': pc.multiply(table.column('utilization_percent'),
+                                                             pc.cast(counts, pa.float64()))})
+        grouped = table.group_by('account').aggregate(aggregations)
+        accounts = grouped.column('account').to_pylist()
+        samples = grouped.column('samples_sum').to_pylist()
+        utilization = grouped.column('sum_utilization_sum').to_pylist()
+        for account, count, busy in zip(accounts, samples, utilization):
+            previous = totals.get(account, (0, 0.0))
+            totals[account] = (previous[0] + (count or 0), previous[1] + (busy or 0.0))
+    return {account: (count * sample_interval / 3600.0, busy / 100.0 * sample_interval / 3600.0)
+            for account, (count, busy) in totals.items()}
+
+
+def _datetime(value):
+    return datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(prog="python3 -m poc_exporters.columnar",
+                                     description="Parquet/Arrow export of the utilization database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export the rows added since the previous run")
+    export.add_argument("--db", default=env("UTILIZATION_DB", "utilization.db"), help="utilization database")
+    export.add_argument("--datasets", default=",".join(DEFAULT_DATASETS),
+                        help=f"comma-separated datasets among {', '.join(DATASETS)} (default: %(default)s)")
+    export.add_argument("--chunk-rows", type=int, default=200000, help="rows read from the database at once")
+    query = commands.add_parser("gpu-hours", help="GPU hours per account over a time range")
+    query.add_argument("--start", type=_datetime, required=True, help="start, e.g. 2024-01-01")
+    query.add_argument("--end", type=_datetime, required=True, help="end (exclusive)")
+    query.add_argument("--source", choices=('raw', 'minute', 'hour', 'day'), default='hour')
+    # Rows persisted from a sample ring carry the number of samples they average, so this is
+    # the sampling interval with or without the ring.
+    query.add_argument("--sample-interval", type=float, default=float(env("GPU_SAMPLE_INTERVAL", "30")),
+                       help="seconds one GPU sample stands for")
+    for command in (export, query):
+        command.add_argument("--out", default=env("CHARGEBACK_EXPORT_DIR", "chargeback"), help="dataset directory")
+        command.add_argument("--format", choices=tuple(FORMATS), default=env("CHARGEBACK_EXPORT_FORMAT", "parquet"))
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "export":
+            from .store import UtilizationStore
+
+            store = UtilizationStore(args.db)
+            try:
+                names = [name for name in args.datasets.split(",") if name]
+                exported = ColumnarExporter(store, args.out, args.format, args.chunk_rows).export(names)
+            finally:
+                store.close()
+            print(f"[INFO] Exported {exported} to {args.out}")
+        else:
+            hours = gpu_hours(args.out, args.start, args.end, args.source, args.sample_interval, args.format)
+            print("account,gpu_hours,busy_gpu_hours")
+            for account, (occupied, busy) in sorted(hours.items()):
+                print(f"{account},{occupied:.3f},{busy:.3f}")
+    except (ImportError, KeyError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
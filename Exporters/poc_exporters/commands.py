@@ -0,0 +1,173 @@
+"""
+Timeout-bounded execution of external tools (nvidia-smi, sreport, scontrol, df, ...).
+
+Commands are argv lists, never shell strings. Each runs in its own process
+group under asyncio with its own timeout. When a command hangs (nvidia-smi
+after an Xid error, df on a stuck Lustre mount), the whole group is killed,
+and the child is reaped for a bounded time. After that it is left to
+asyncio's child watcher, so a process stuck in uninterruptible I/O cannot
+block the caller and finished children never linger as zombies. Independent
+commands can be run concurrently with ``run_many``.
+
+Each tool's call count, failures, timeouts and time spent are recorded in
+``CommandRunner.stats``.
+"""
+import asyncio
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass
+
+
+class CommandError(Exception):
+    """Raised when a command cannot be started or exits with a non-zero status."""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+class CommandTimeout(CommandError):
+    """Raised when a command does not finish within its timeout."""
+
+
+@dataclass
+class CommandResult:
+    argv: list
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+    duration: float
+
+    @property
+    def text(self):
+        return self.stdout.decode('utf-8', 'replace')
+
+
+@dataclass
+class CommandStats:
+    calls: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    seconds: float = 0.0
+    last_duration: float = None
+
+
+class CommandRunner:
+    """Runs external commands with timeouts, process-group kills and per-tool statistics."""
+
+    def __init__(self, timeout=30.0, reap_timeout=5.0):
+        """
+        :param timeout: Default timeout in seconds for commands that do not pass one.
+        :param reap_timeout: Seconds to wait for a killed command to exit before giving up on it.
+        """
+        self.timeout = timeout
+        self.reap_timeout = reap_timeout
+        self.stats = {}  # tool name -> CommandStats
+        self._lock = threading.Lock()
+
+    async def run_async(self, argv, timeout=None, check=True):
+        """
+        Runs one command on the current event loop.
+
+        :param argv: Command and arguments as a list.
+        :param timeout: Seconds before the command is killed (defaults to the runner's).
+        :param check: Raise CommandError on a non-zero exit status.
+        :return: CommandResult.
+        :raises CommandTimeout: If the command timed out.
+        :raises CommandError: If the command could not be started or failed (with ``check``).
+        """
+        argv = [str(arg) for arg in argv]
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        except OSError as e:
+            self._record(argv, time.monotonic() - started, failed=True)
+            raise CommandError(f"Cannot run {argv[0]}: {e}")
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            await self._kill(process)
+            duration = time.monotonic() - started
+            self._record(argv, duration, failed=True, timed_out=True)
+            raise CommandTimeout(f"{' '.join(argv)} timed out after {timeout}s")
+        except asyncio.CancelledError:
+            await self._kill(process)
+            raise
+        result = CommandResult(argv, process.returncode, stdout, stderr, time.monotonic() - started)
+        failed = process.returncode != 0
+        self._record(argv, result.duration, failed=failed)
+        if failed and check:
+            message = stderr.decode('utf-8', 'replace').strip()
+            raise CommandError(f"{' '.join(argv)} exited with status {process.returncode}: {message}", result)
+        return result
+
+    async def _kill(self, process):
+        # The command may have spawned children of its own; kill the whole session.
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), self.reap_timeout)
+        except asyncio.TimeoutError:
+            print(f"[WARN] pid {process.pid} did not exit after SIGKILL (uninterruptible I/O?); not waiting for it.")
+
+    def run(self, argv, timeout=None, check=True):
+        """
+        Runs one command from synchronous code; see run_async.
+
+        :return: CommandResult.
+        """
+        return asyncio.run(self.run_async(argv, timeout, check))
+
+    def run_many(self, commands, timeout=None, check=True):
+        """
+        Runs independent commands concurrently, each with its own timeout.
+
+        :param commands: A dictionary mapping names to argv lists or to (argv, timeout) tuples.
+        :param timeout: Default timeout for entries without their own.
+        :param check: Treat a non-zero exit status as a failure.
+        :return: A dictionary mapping each name to its CommandResult, or to the
+                 CommandError it raised; one failure does not affect the others.
+        """
+        async def gather():
+            names = list(commands)
+            calls = []
+            for name in names:
+                spec = commands[name]
+                argv, own_timeout = spec if isinstance(spec, tuple) else (spec, timeout)
+                calls.append(self.run_async(argv, own_timeout, check))
+            results = await asyncio.gather(*calls, return_exceptions=True)
+            return dict(zip(names, results))
+        return asyncio.run(gather())
+
+    def _record(self, argv, duration, failed=False, timed_out=False):
+        tool = os.path.basename(argv[0])
+        with self._lock:
+            stats = self.stats.setdefault(tool, CommandStats())
+            stats.calls += 1
+            stats.failures += failed
+            stats.timeouts += timed_out
+            stats.seconds += duration
+            stats.last_duration = duration
+
+
+# Process-wide runner shared by all collectors, so statistics cover every tool call.
+default_runner = CommandRunner()
+
+
+def run_command(argv, timeout=None, check=True):
+    """
+    Runs a command on the shared runner.
+
+    :param argv: Command and arguments as a list.
+    :param timeout: Seconds before the command is killed.
+    :param check: Raise CommandError on a non-zero exit status.
+    :return: CommandResult.
+    """
+    return default_runner.run(argv, timeout, check)
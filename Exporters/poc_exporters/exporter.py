@@ -0,0 +1,214 @@
+"""
+The node exporter: a set of collectors sampled in rounds and published as a
+node_exporter textfile, over HTTP, or both.
+
+Every round builds a fresh RoundContext, so the collectors share one
+PID-to-job lookup and one metadata lookup. Each collector's ``sample`` runs
+under the exporter's Instrumentation. A failing collector is counted and
+logged, and does not stop the others.
+
+* ``textfile``: families are rendered with textfile.MetricFamily and written
+  atomically; the file is only rewritten when its content changes. Run
+  duration, errors and last success go to a separate status file.
+* ``http``: a SnapshotCollector serves the families; they are rebuilt on a
+  scrape only after a new round. prometheus_client is imported only here.
+* ``both``: the textfile is rendered from the same snapshot as the scrapes.
+  Windowed values (GPU min/avg/max) then cover the rounds since the previous
+  textfile write or scrape, whichever came last.
+* ``none``: nothing is published locally; only useful with a push address.
+
+Every build goes through a series.SeriesLimiter: label sets of jobs and
+processes that are gone are forgotten after a few builds, and a family that
+reaches the series limit folds new label sets into an overflow series (gauges)
+or drops them (counters).
+
+With a push address, every round is also reduced to per-job totals
+(push.JobSummaries) and the changed ones are sent to the central aggregator
+once per push window.
+"""
+import threading
+import time
+
+from .collectors import CollectorUnavailable, RoundContext, load
+from .instrumentation import Instrumentation
+from .series import SeriesLimiter
+from .slurm_jobs import JobResolver
+from .textfile import MetricFamily, TextfileWriter
+
+OUTPUTS = ('textfile', 'http', 'both', 'none')
+
+
+class NodeExporter:
+    """Samples the enabled collectors in rounds and publishes their families."""
+
+    def __init__(self, collectors, options, namespace='poc_exporter', push=None, push_window=60.0,
+                 max_series=1000, series_expiry=5):
+        """
+        :param collectors: Names of the collectors to enable (see collectors.REGISTRY).
+        :param options: collectors.Options shared by all collectors.
+        :param namespace: Prefix of the exporter's own metrics.
+        :param push: Aggregator address (``unix:/path`` or ``host:port``), or None to not push.
+        :param push_window: Seconds between two pushes.
+        :param max_series: Label sets per family before new ones are folded into an overflow series
+                           (gauges) or dropped (counters); 0 for no limit.
+        :param series_expiry: Builds after which a label set no longer seen is forgotten.
+        :raises KeyError: If a collector name is not registered.
+        :raises ValueError: If the push address cannot be parsed.
+        """
+        self.options = options
+        self.namespace = namespace
+        self.instrumentation = Instrumentation(namespace)
+        self.series = SeriesLimiter(namespace, max_series=max_series, expire_after=series_expiry)
+        self.resolver = JobResolver()
+        self._metadata_index = None
+        self.collectors = []
+        for name in collectors:
+            cls = load(name)
+            try:
+                self.collectors.append(cls(options))
+            except CollectorUnavailable as e:
+                self.instrumentation.error(name, 'unavailable')
+                print(f"[WARN] Collector {name} disabled on this node: {e}")
+        self.summaries = self.pusher = None
+        if push:
+            from .push import DeltaPusher, JobSummaries
+
+            self.summaries = JobSummaries()
+            self.pusher = DeltaPusher(push)
+        self.push_window = push_window
+        self._pushed_at = None
+        self.rounds = 0
+        self._stop = threading.Event()
+
+    def metadata_index(self):
+        # Created on first use, so nodes without the slurm collector never import the command runner.
+        if self._metadata_index is None:
+            from .job_metadata import JobMetadataIndex
+
+            self._metadata_index = JobMetadataIndex()
+        return self._metadata_index
+
+    def sample_once(self):
+        """Takes one round of every collector."""
+        context = RoundContext(self.resolver, self.instrumentation, self.metadata_index)
+        for collector in self.collectors:
+            try:
+                with self.instrumentation.track(collector.name):
+                    collector.sample(context)
+            except Exception as e:
+                print(f"[ERROR] Collector {collector.name} failed: {e}")
+        if self.summaries is not None:
+            try:
+                with self.instrumentation.track('summaries'):
+                    self.summaries.start_round()
+                    for collector in self.collectors:
+                        collector.summarize(self.summaries)
+                    self.summaries.observe_jobs(context.job_ids(), context.metadata())
+            except Exception as e:
+                print(f"[ERROR] Job summaries failed: {e}")
+        self.rounds += 1
+
+    def push(self, force=False):
+        """
+        Sends the changed job summaries if the push window has elapsed.
+
+        :param force: Push regardless of the window.
+        """
+        now = time.monotonic()
+        if self.pusher is None or not force and self._pushed_at is not None and now - self._pushed_at < self.push_window:
+            return
+        self._pushed_at = now
+        with self.instrumentation.track('push'):
+            if not self.pusher.push(self.summaries):
+                self.instrumentation.error('push', 'send')
+
+    def build(self, family):
+        """
+        :param family: Family factory taking (name, documentation, labels, type).
+        :return: The families of every collector, from the rounds since the previous build,
+                 followed by the series limiter's own families.
+        """
+        return self.series.build(self._collector_families, family) + self.series.families(family)
+
+    def _collector_families(self, family):
+        families = []
+        for collector in self.collectors:
+            try:
+                families.extend(collector.families(family))
+            except Exception as e:
+                self.instrumentation.error(collector.name, 'families')
+                print(f"[ERROR] Collector {collector.name} could not build its metrics: {e}")
+        return families
+
+    def run(self, output='textfile', textfile=None, status_file=None, port=9061, interval=15.0, once=False):
+        """
+        Samples every ``interval`` seconds and publishes after each round.
+
+        :param output: ``textfile``, ``http`` or ``both``.
+        :param textfile: Path of the textfile (textfile and both).
+        :param status_file: Path of the status textfile, or None to skip it.
+        :param port: HTTP port (http and both).
+        :param interval: Seconds between two rounds.
+        :param once: Take a single round, publish and push it, and return.
+        """
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output: {output}")
+        snapshot = None
+        if output in ('http', 'both'):
+            from prometheus_client import REGISTRY, start_http_server
+            from .commands import default_runner
+            from .instrumentation import install_profiler_signal
+            from .scrape import SnapshotCollector, prometheus_family
+
+            # A scrape only rebuilds the families when a new round was taken since the last one.
+            snapshot = SnapshotCollector(lambda: self.build(prometheus_family), lambda: self.rounds, self.namespace)
+            REGISTRY.register(snapshot)
+            REGISTRY.register(self.instrumentation.collector(runner=default_runner))
+            # kill -USR2 <pid> starts profiling; a second USR2 writes the dump to $PROFILE_DIR
+            install_profiler_signal()
+            start_http_server(port)
+            print(f"[INFO] Serving {', '.join(c.name for c in self.collectors)} metrics on :{port}, "
+                  f"sampling every {interval}s")
+        writer = TextfileWriter(textfile) if output in ('textfile', 'both') else None
+        status = TextfileWriter(status_file) if writer is not None and status_file else None
+
+        next_round = time.monotonic()
+        while not self._stop.is_set():
+            self.sample_once()
+            if writer is not None:
+                self._publish_textfile(writer, status, snapshot)
+            self.push(force=once)
+            if once:
+                break
+            next_round += interval
+            # Fixed rate; after a stall, resume from now instead of catching up.
+            next_round = max(next_round, time.monotonic())
+            self._stop.wait(next_round - time.monotonic())
+
+    def _publish_textfile(self, writer, status, snapshot):
+        try:
+            with self.instrumentation.track('textfile'):
+                if snapshot is None:
+                    writer.write(self.build(MetricFamily))
+                else:
+                    from prometheus_client import generate_latest
+
+                    writer.write_text(generate_latest(snapshot).decode('utf-8'))
+        except OSError as e:
+            print(f"[ERROR] Cannot write {writer.path}: {e}")
+        if status is not None:
+            try:
+                status.write(self.instrumentation.textfile_families())
+            except OSError as e:
+                print(f"[ERROR] Cannot write {status.path}: {e}")
+
+    def stop(self):
+        """Makes run() return after the current round."""
+        self._stop.set()
+
+    def close(self):
+        for collector in self.collectors:
+            try:
+                collector.close()
+            except Exception as e:
+                print(f"[WARN] Closing collector {collector.name} failed: {e}")
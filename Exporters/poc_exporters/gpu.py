@@ -0,0 +1,363 @@
+"""
+Long-lived GPU sampling backends.
+
+Every backend implements the same interface (``gpus()``, ``processes()`` and
+``sample()``) and returns ``GpuSample`` / ``ProcessSample`` records:
+
+* ``NvmlSampler`` keeps NVML initialised and device handles open, querying
+  utilization, memory and compute processes in-process.
+* ``NvidiaSmiSampler`` falls back to ``nvidia-smi`` and parses its CSV output
+  straight from the pipe, without temporary files. Both queries run
+  concurrently under a timeout, so a hung ``nvidia-smi`` is killed.
+* ``FakeSampler`` returns canned data for nodes without GPUs and for tests.
+
+``open_sampler()`` picks the best backend available on the node (or the one
+named in ``$GPU_BACKEND``), and
+``GpuSnapshot`` joins one sample into GPUs keyed by UUID with their processes.
+"""
+import csv
+import os
+import shutil
+from dataclasses import dataclass, field
+
+from .commands import CommandError, default_runner
+
+
+class GpuSamplerError(Exception):
+    """Raised when no GPU backend can be opened or a query fails."""
+
+
+@dataclass
+class GpuSample:
+    uuid: str
+    index: int
+    name: str = ''
+    utilization: float = 0.0
+    memory_used_bytes: int = 0
+    memory_total_bytes: int = 0
+
+
+@dataclass
+class ProcessSample:
+    pid: int
+    gpu_uuid: str
+    used_memory_bytes: int = 0
+
+
+@dataclass
+class JobGpuUsage:
+    """Usage of one GPU by one Slurm job, summed over all of the job's processes."""
+    gpu: GpuSample
+    job_id: int
+    pids: list = field(default_factory=list)
+    used_memory_bytes: int = 0
+
+
+@dataclass
+class GpuSnapshot:
+    """
+    One GPU sample indexed for lookups: GPUs keyed by UUID and the list of
+    compute processes running on each of them.
+    """
+    gpus: dict = field(default_factory=dict)        # uuid -> GpuSample
+    processes: dict = field(default_factory=dict)   # uuid -> [ProcessSample]
+
+    @classmethod
+    def build(cls, gpus, processes):
+        """
+        Indexes a sample in a single pass over each input list.
+
+        :param gpus: GpuSample records.
+        :param processes: ProcessSample records.
+        :return: A GpuSnapshot.
+        """
+        snapshot = cls({gpu.uuid: gpu for gpu in gpus}, {})
+        for proc in processes:
+            snapshot.processes.setdefault(proc.gpu_uuid, []).append(proc)
+        return snapshot
+
+    def job_usage(self, pid_to_job):
+        """
+        Aggregates process samples per (GPU, job). Processes that belong to no job,
+        or run on a GPU missing from the snapshot, are skipped.
+
+        :param pid_to_job: A dictionary mapping PIDs to job IDs.
+        :return: A list of JobGpuUsage records ordered by GPU index and job ID.
+        """
+        usage = {}
+        for uuid, procs in self.processes.items():
+            gpu = self.gpus.get(uuid)
+            if gpu is None:
+                continue
+            for proc in procs:
+                job_id = pid_to_job.get(proc.pid)
+                if job_id is None:
+                    continue
+                entry = usage.get((uuid, job_id))
+                if entry is None:
+                    entry = usage[(uuid, job_id)] = JobGpuUsage(gpu, job_id)
+                entry.pids.append(proc.pid)
+                entry.used_memory_bytes += proc.used_memory_bytes
+        return sorted(usage.values(), key=lambda entry: (entry.gpu.index, entry.job_id))
+
+    def pids(self):
+        """
+        :return: The set of PIDs running on any GPU in the snapshot.
+        """
+        return {proc.pid for procs in self.processes.values() for proc in procs}
+
+
+class GpuSampler:
+    """Base class for GPU sampling backends."""
+
+    name = 'base'
+
+    def gpus(self):
+        """
+        Samples every GPU on the node.
+
+        :return: A list of GpuSample records ordered by device index.
+        """
+        raise NotImplementedError
+
+    def processes(self):
+        """
+        Samples every compute process on every GPU.
+
+        :return: A list of ProcessSample records.
+        """
+        raise NotImplementedError
+
+    def sample(self):
+        """
+        Samples GPUs and their compute processes in one call.
+
+        :return: A tuple (gpus, processes).
+        """
+        return self.gpus(), self.processes()
+
+    def snapshot(self):
+        """
+        Samples GPUs and processes and indexes the result.
+
+        :return: A GpuSnapshot.
+        """
+        return GpuSnapshot.build(*self.sample())
+
+    def close(self):
+        """Releases any resources held by the backend."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NvmlSampler(GpuSampler):
+    """Samples GPUs through NVML (pynvml), keeping device handles open between calls."""
+
+    name = 'nvml'
+
+    def __init__(self):
+        try:
+            import pynvml
+        except ImportError as e:
+            raise GpuSamplerError(f"pynvml is not installed: {e}")
+        self._nvml = pynvml
+        self._handles = None
+        try:
+            pynvml.nvmlInit()
+        except pynvml.NVMLError as e:
+            raise GpuSamplerError(f"NVML initialisation failed: {e}")
+        handles = []
+        try:
+            for index in range(pynvml.nvmlDeviceGetCount()):
+                handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+                uuid = _to_str(pynvml.nvmlDeviceGetUUID(handle))
+                name = _to_str(pynvml.nvmlDeviceGetName(handle))
+                handles.append((index, uuid, name, handle))
+        except Exception as e:
+            # The session is open; close it before open_sampler() falls back to nvidia-smi.
+            try:
+                pynvml.nvmlShutdown()
+            except pynvml.NVMLError:
+                pass
+            if isinstance(e, pynvml.NVMLError):
+                raise GpuSamplerError(f"NVML device enumeration failed: {e}")
+            raise
+        self._handles = handles
+
+    def gpus(self):
+        nvml = self._nvml
+        samples = []
+        try:
+            for index, uuid, name, handle in self._handles:
+                utilization = nvml.nvmlDeviceGetUtilizationRates(handle)
+                memory = nvml.nvmlDeviceGetMemoryInfo(handle)
+                samples.append(GpuSample(uuid, index, name, float(utilization.gpu),
+                                         int(memory.used), int(memory.total)))
+        except nvml.NVMLError as e:
+            raise GpuSamplerError(f"NVML query failed: {e}")
+        return samples
+
+    def processes(self):
+        nvml = self._nvml
+        samples = []
+        try:
+            for _, uuid, _, handle in self._handles:
+                for proc in nvml.nvmlDeviceGetComputeRunningProcesses(handle):
+                    # usedGpuMemory is None when the driver cannot report it (e.g. under MIG).
+                    samples.append(ProcessSample(int(proc.pid), uuid, int(proc.usedGpuMemory or 0)))
+        except nvml.NVMLError as e:
+            raise GpuSamplerError(f"NVML query failed: {e}")
+        return samples
+
+    def close(self):
+        if self._handles is not None:
+            self._handles = None
+            try:
+                self._nvml.nvmlShutdown()
+            except self._nvml.NVMLError:
+                pass
+
+
+class NvidiaSmiSampler(GpuSampler):
+    """Samples GPUs by reading ``nvidia-smi`` CSV output from a pipe."""
+
+    name = 'nvidia-smi'
+
+    GPU_QUERY = 'uuid,index,name,utilization.gpu,memory.used,memory.total'
+    APPS_QUERY = 'pid,used_memory,gpu_uuid'
+
+    def __init__(self, binary='nvidia-smi', timeout=10, runner=None):
+        """
+        :param binary: Name or path of the nvidia-smi executable.
+        :param timeout: Seconds before a hung nvidia-smi is killed.
+        :param runner: CommandRunner used to run nvidia-smi (defaults to the shared one).
+        """
+        self.binary = shutil.which(binary)
+        if self.binary is None:
+            raise GpuSamplerError(f"`{binary}` command not found")
+        self.timeout = timeout
+        self.runner = runner or default_runner
+
+    def _command(self, option, fields):
+        return [self.binary, f'{option}={fields}', '--format=csv,noheader,nounits']
+
+    @staticmethod
+    def _parse(output):
+        return [[value.strip() for value in row]
+                for row in csv.reader(output.splitlines()) if row]
+
+    def _query(self, option, fields):
+        try:
+            result = self.runner.run(self._command(option, fields), self.timeout)
+        except CommandError as e:
+            raise GpuSamplerError(f"Error running nvidia-smi: {e}")
+        return self._parse(result.text)
+
+    @staticmethod
+    def _gpu_rows(rows):
+        return [GpuSample(row[0], int(row[1]), row[2], _to_float(row[3]),
+                          _mib_to_bytes(row[4]), _mib_to_bytes(row[5]))
+                for row in rows if len(row) == 6]
+
+    @staticmethod
+    def _process_rows(rows):
+        return [ProcessSample(int(row[0]), row[2], _mib_to_bytes(row[1]))
+                for row in rows if len(row) == 3 and row[0].isdigit()]
+
+    def gpus(self):
+        return self._gpu_rows(self._query('--query-gpu', self.GPU_QUERY))
+
+    def processes(self):
+        return self._process_rows(self._query('--query-compute-apps', self.APPS_QUERY))
+
+    def sample(self):
+        results = self.runner.run_many({
+            'gpus': self._command('--query-gpu', self.GPU_QUERY),
+            'processes': self._command('--query-compute-apps', self.APPS_QUERY),
+        }, timeout=self.timeout)
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise GpuSamplerError(f"Error running nvidia-smi: {result}")
+        return (self._gpu_rows(self._parse(results['gpus'].text)),
+                self._process_rows(self._parse(results['processes'].text)))
+
+
+class FakeSampler(GpuSampler):
+    """Returns fixed samples; used on GPU-less nodes and in tests."""
+
+    name = 'fake'
+
+    def __init__(self, gpus=(), processes=()):
+        """
+        :param gpus: GpuSample records to return from gpus().
+        :param processes: ProcessSample records to return from processes().
+        """
+        self._gpus = list(gpus)
+        self._processes = list(processes)
+
+    def set(self, gpus=None, processes=None):
+        """
+        Replaces the canned samples.
+
+        :param gpus: New GpuSample records, or None to keep the current ones.
+        :param processes: New ProcessSample records, or None to keep the current ones.
+        """
+        if gpus is not None:
+            self._gpus = list(gpus)
+        if processes is not None:
+            self._processes = list(processes)
+
+    def gpus(self):
+        return list(self._gpus)
+
+    def processes(self):
+        return list(self._processes)
+
+
+BACKENDS = {
+    'nvml': NvmlSampler,
+    'nvidia-smi': NvidiaSmiSampler,
+    'fake': FakeSampler,
+}
+
+
+def open_sampler(backend=None):
+    """
+    Opens a GPU sampler.
+
+    :param backend: ``nvml``, ``nvidia-smi``, ``fake`` or ``auto`` (NVML, falling back to nvidia-smi);
+                    defaults to ``$GPU_BACKEND``, or ``auto`` if unset.
+    :return: A GpuSampler instance.
+    :raises GpuSamplerError: If the requested backend, or no backend for ``auto``, is available.
+    """
+    backend = backend or os.environ.get('GPU_BACKEND', 'auto')
+    if backend != 'auto':
+        if backend not in BACKENDS:
+            raise GpuSamplerError(f"Unknown GPU backend: {backend}")
+        return BACKENDS[backend]()
+    errors = []
+    for candidate in (NvmlSampler, NvidiaSmiSampler):
+        try:
+            return candidate()
+        except GpuSamplerError as e:
+            errors.append(str(e))
+    raise GpuSamplerError('; '.join(errors))
+
+
+def _to_str(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:  # "[N/A]", "[Not Supported]"
+        return 0.0
+
+
+def _mib_to_bytes(value):
+    return int(_to_float(value) * 1024 * 1024)
@@ -0,0 +1,336 @@
+"""
+Self-instrumentation shared by the exporters.
+
+Every collector runs inside ``Instrumentation.track(name)``. That records
+its duration in a histogram, counts errors by reason, and stamps the time of
+its last successful run. A run counts as failed when it raises, or when the
+collector reported a handled problem with ``error(name, reason)``. This lets
+Prometheus tell a stale number from a fresh one.
+
+``Instrumentation.collector()`` exposes these figures to prometheus_client,
+together with the per-tool subprocess statistics of a CommandRunner and the
+write latency and queue depth of a UtilizationStore. prometheus_client is
+imported only when the collector is used. One-shot textfile exporters use
+``textfile_families()`` instead.
+
+``install_profiler_signal()`` makes a signal (SIGUSR2 by default) toggle
+cProfile and tracemalloc. The first signal starts them; the second writes a
+``.prof`` file and text summaries to a directory. The profiling modules are
+only imported once profiling is started.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense; thread-safe."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        """
+        :param buckets: Sorted upper bounds; +Inf is implied.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """
+        :return: A list of (upper bound string, cumulative count) pairs ending with ``+Inf``.
+        """
+        with self._lock:
+            running = 0
+            result = []
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                running += count
+                result.append(('+Inf' if bound == float('inf') else repr(float(bound)), running))
+            return result
+
+
+class _CollectorState:
+    __slots__ = ('duration', 'errors', 'last_success', 'last_duration')
+
+    def __init__(self, buckets):
+        self.duration = Histogram(buckets)
+        self.errors = {}  # reason -> count
+        self.last_success = None
+        self.last_duration = None
+
+
+class Instrumentation:
+    """Duration, error and freshness bookkeeping for the collectors of one exporter."""
+
+    def __init__(self, namespace, buckets=DURATION_BUCKETS, clock=time.time):
+        """
+        :param namespace: Metric name prefix, e.g. ``monitoring``.
+        :param buckets: Histogram buckets for collector durations, in seconds.
+        :param clock: Wall clock used for last-success timestamps.
+        """
+        self.namespace = namespace
+        self.buckets = buckets
+        self.clock = clock
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _state(self, name):
+        with self._lock:
+            state = self._collectors.get(name)
+            if state is None:
+                state = self._collectors[name] = _CollectorState(self.buckets)
+            return state
+
+    @contextmanager
+    def track(self, name):
+        """
+        Times one run of a collector. Exceptions are counted (reason = exception
+        class name) and re-raised.
+
+        :param name: Collector name, used as the ``collector`` label.
+        """
+        state = self._state(name)
+        failed = getattr(self._local, 'failed', None)
+        if failed is None:
+            failed = self._local.failed = set()
+        failed.discard(name)
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.error(name, type(e).__name__)
+            raise
+        finally:
+            duration = time.monotonic() - started
+            state.duration.observe(duration)
+            state.last_duration = duration
+            if name not in failed:
+                state.last_success = self.clock()
+            failed.discard(name)
+
+    def error(self, name, reason):
+        """
+        Counts a handled error; a run inside track(name) that reports one is not a success.
+
+        :param name: Collector name.
+        :param reason: Short, low-cardinality reason, e.g. ``timeout`` or ``parse``.
+        """
+        state = self._state(name)
+        with self._lock:
+            state.errors[reason] = state.errors.get(reason, 0) + 1
+        failed = getattr(self._local, 'failed', None)
+        if failed is not None:
+            failed.add(name)
+
+    def wrap(self, name, func):
+        """
+        :param name: Collector name.
+        :param func: Callable to instrument.
+        :return: A callable that runs ``func`` inside track(name).
+        """
+        def wrapper(*args, **kwargs):
+            with self.track(name):
+                return func(*args, **kwargs)
+        wrapper.__name__ = getattr(func, '__name__', name)
+        wrapper.__doc__ = getattr(func, '__doc__', None)
+        return wrapper
+
+    def snapshot(self):
+        """
+        :return: A dictionary mapping collector names to (histogram, errors by reason,
+                 last success timestamp or None, last duration or None).
+        """
+        with self._lock:
+            return {name: (state.duration, dict(state.errors), state.last_success, state.last_duration)
+                    for name, state in self._collectors.items()}
+
+    def collector(self, runner=None, store=None):
+        """
+        Builds a prometheus_client custom collector exposing this instrumentation.
+
+        :param runner: A CommandRunner whose per-tool statistics are exported, or None.
+        :param store: A UtilizationStore whose write latency and queue depth are exported, or None.
+        :return: An object with describe()/collect() for REGISTRY.register().
+        """
+        return _PrometheusCollector(self, runner, store)
+
+    def textfile_families(self):
+        """
+        Families for one-shot textfile exporters: the last run's duration, errors and
+        success time per collector (counters would reset on every run anyway).
+
+        :return: A list of textfile.MetricFamily.
+        """
+        from .textfile import MetricFamily
+
+        ns = self.namespace
+        duration = MetricFamily(f'{ns}_last_run_duration_seconds', 'Duration of the last run of a collector', ['collector'])
+        errors = MetricFamily(f'{ns}_last_run_errors', 'Errors during the last run of a collector', ['collector', 'reason'])
+        success = MetricFamily(f'{ns}_last_success_timestamp_seconds', 'Time of the last successful run of a collector', ['collector'])
+        for name, (_, reasons, last_success, last_duration) in sorted(self.snapshot().items()):
+            if last_duration is not None:
+                duration.add_metric([name], last_duration)
+            for reason, count in sorted(reasons.items()):
+                errors.add_metric([name, reason], count)
+            if last_success is not None:
+                success.add_metric([name], last_success)
+        return [duration, errors, success]
+
+
+class _PrometheusCollector:
+    def __init__(self, instrumentation, runner, store):
+        self.instrumentation = instrumentation
+        self.runner = runner
+        self.store = store
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+        ns = self.instrumentation.namespace
+        duration = HistogramMetricFamily(f'{ns}_scrape_duration_seconds', 'Duration of collector runs', labels=['collector'])
+        errors = CounterMetricFamily(f'{ns}_errors', 'Collector errors by reason', labels=['collector', 'reason'])
+        success = GaugeMetricFamily(f'{ns}_last_success_timestamp_seconds', 'Time of the last successful collector run', labels=['collector'])
+        for name, (histogram, reasons, last_success, _) in sorted(self.instrumentation.snapshot().items()):
+            duration.add_metric([name], histogram.cumulative(), histogram.sum)
+            for reason, count in sorted(reasons.items()):
+                errors.add_metric([name, reason], count)
+            if last_success is not None:
+                success.add_metric([name], last_success)
+        yield duration
+        yield errors
+        yield success
+
+        if self.runner is not None:
+            labels = ['tool']
+            calls = CounterMetricFamily(f'{ns}_subprocess_calls', 'External command runs by tool', labels=labels)
+            failures = CounterMetricFamily(f'{ns}_subprocess_failures', 'Failed or timed-out external command runs by tool', labels=labels)
+            timeouts = CounterMetricFamily(f'{ns}_subprocess_timeouts', 'External command runs killed after their timeout', labels=labels)
+            seconds = CounterMetricFamily(f'{ns}_subprocess_seconds', 'Wall time spent in external commands by tool', labels=labels)
+            for tool, stats in sorted(dict(self.runner.stats).items()):
+                calls.add_metric([tool], stats.calls)
+                failures.add_metric([tool], stats.failures)
+                timeouts.add_metric([tool], stats.timeouts)
+                seconds.add_metric([tool], stats.seconds)
+            yield calls
+            yield failures
+            yield timeouts
+            yield seconds
+
+        if self.store is not None:
+            latency = self.store.write_latency
+            write = HistogramMetricFamily(f'{ns}_db_write_duration_seconds', 'Duration of batched database writes')
+            write.add_metric([], latency.cumulative(), latency.sum)
+            yield write
+            yield CounterMetricFamily(f'{ns}_db_rows_written', 'Rows written to the database', value=self.store.rows_written)
+            yield CounterMetricFamily(f'{ns}_db_rows_dropped', 'Rows dropped after a failed write', value=self.store.rows_dropped)
+            yield GaugeMetricFamily(f'{ns}_db_queue_depth', 'Rows queued for the database writer', value=self.store.queue_depth())
+
+
+class _Profiler:
+    def __init__(self, directory, frames):
+        self.directory = directory
+        self.frames = frames
+        self.active = False
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def toggle(self, signum=None, frame=None):
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+
+        self._profiles = [cProfile.Profile()]
+        self._profiles[0].enable()
+        # Threads started from now on (e.g. scheduler job runs) get their own profile.
+        threading.setprofile(self._profile_new_thread)
+        tracemalloc.start(self.frames)
+        self.active = True
+        print(f"[INFO] Profiling started (pid {os.getpid()}); send the signal again to write the dump.")
+
+    def _profile_new_thread(self, frame, event, arg):
+        import cProfile
+
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()  # replaces this hook for the rest of the thread
+
+    def stop(self):
+        import io
+        import pstats
+        import tracemalloc
+
+        threading.setprofile(None)
+        self.active = False
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(self.directory, f'profile-{os.getpid()}-{stamp}')
+        self._profiles[0].disable()
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        stats = None
+        for profile in profiles:
+            try:
+                profile.create_stats()
+            except Exception:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        if stats is not None:
+            stats.dump_stats(f'{base}.prof')
+            summary = io.StringIO()
+            stats.stream = summary
+            stats.sort_stats('cumulative').print_stats(50)
+            with open(f'{base}.txt', 'w') as f:
+                f.write(summary.getvalue())
+        with open(f'{base}-memory.txt', 'w') as f:
+            for stat in snapshot.statistics('lineno')[:50]:
+                f.write(f'{stat}\n')
+        print(f"[INFO] Profiling stopped; dump written to {base}.*")
+
+
+def install_profiler_signal(signum=signal.SIGUSR2, directory=None, frames=10):
+    """
+    Makes ``signum`` toggle cProfile + tracemalloc; must be called from the main thread.
+
+    :param signum: Signal number.
+    :param directory: Where dumps are written (defaults to $PROFILE_DIR or the temp directory).
+    :param frames: Traceback depth kept by tracemalloc.
+    :return: The installed profiler.
+    """
+    import tempfile
+
+    directory = directory or os.environ.get('PROFILE_DIR') or tempfile.gettempdir()
+    profiler = _Profiler(directory, frames)
+    if sys.platform != 'win32':
+        signal.signal(signum, profiler.toggle)
+    return profiler
@@ -0,0 +1,231 @@
+"""
+Cached metadata (user, account, partition, GPUs) of the Slurm jobs on this node.
+
+Instead of listing every job in the cluster with ``squeue`` on each scrape,
+``JobMetadataIndex`` asks ``scontrol -d -o show job <id>`` once per job
+that appears on the node (e.g. in the job cgroups). It keeps the answer until
+the job is gone from the node. Steady-state scrapes therefore run no Slurm
+commands at all.
+
+GRES strings are parsed with their type and device indices, e.g.
+``gres/gpu:a100:4``, ``gpu:2(IDX:0-1)``, ``gpu:a100:2(IDX:0,2)``,
+``gres/gpu=4``, ``gpu:tesla:1(S:0)`` or ``gpu(IDX:0-1)``, whose count is the
+number of indices.
+"""
+import re
+import shutil
+import socket
+import time
+from dataclasses import dataclass
+
+from .commands import default_runner
+
+_GRES_ENTRY_RE = re.compile(r'(?:gres[/:])?(?P<name>[^:=(]+)(?:[:=](?P<rest>[^(]*))?(?:\((?P<detail>[^)]*)\))?$')
+_SCONTROL_FIELD_RE = re.compile(r'(?:^|\s)([A-Za-z_/:]+)=(\S*)')
+
+
+@dataclass
+class JobMetadata:
+    job_id: int
+    user: str = ''
+    account: str = ''
+    partition: str = ''
+    gpu_type: str = ''
+    gpu_count: int = 0
+    gpu_indices: tuple = ()  # GPU minor numbers allocated on this node, if Slurm reported them
+
+
+def expand_range_list(text):
+    """
+    Expands an index list such as ``0-2,5``.
+
+    :param text: Comma-separated indices and ranges.
+    :return: A list of integers, in order.
+    """
+    values = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        values.extend(range(int(low), int(high or low) + 1))
+    return values
+
+
+def expand_hostlist(hostlist):
+    """
+    Expands a Slurm hostlist such as ``gpu[01-03,07],login1``.
+
+    :param hostlist: Hostlist expression.
+    :return: A list of host names.
+    """
+    hosts = []
+    for match in re.finditer(r'([^,\[]+)(?:\[([^\]]*)\])?([^,]*)', hostlist):
+        prefix, ranges, suffix = match.groups()
+        if not ranges:
+            hosts.append(prefix + suffix)
+            continue
+        for part in ranges.split(','):
+            low, _, high = part.partition('-')
+            width = len(low)
+            for number in range(int(low), int(high or low) + 1):
+                hosts.append(f'{prefix}{number:0{width}d}{suffix}')
+    return hosts
+
+
+def _split_gres(text):
+    # Entries are comma-separated, but IDX lists inside parentheses contain commas too.
+    entries, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            entries.append(current)
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    entries.append(current)
+    return [entry.strip() for entry in entries if entry.strip()]
+
+
+def parse_gres(text, name='gpu'):
+    """
+    Extracts the allocation of one GRES from a Slurm GRES/TRES string.
+
+    :param text: e.g. ``gres/gpu:a100:4``, ``gpu:2(IDX:0-1),mps:100`` or ``N/A``.
+    :param name: GRES name to look for.
+    :return: A tuple (type, count, indices); type is '' when untyped and indices is
+             empty unless the string carries an ``IDX:`` list.
+    """
+    gres_type, count, indices = '', 0, ()
+    for entry in _split_gres(text or ''):
+        match = _GRES_ENTRY_RE.match(entry)
+        if match is None or match.group('name') != name:
+            continue
+        parts = [part for part in (match.group('rest') or '').replace('=', ':').split(':') if part]
+        entry_count = None
+        entry_type = ''
+        if parts and parts[-1].isdigit():
+            entry_count = int(parts.pop())
+        if parts:
+            entry_type = parts[0]
+        entry_indices = ()
+        detail = match.group('detail') or ''
+        if detail.startswith('IDX:'):
+            try:
+                entry_indices = tuple(expand_range_list(detail[len('IDX:'):]))
+            except ValueError:
+                pass
+        if entry_count is None:
+            # "gpu(IDX:0-1)" and "gpu:a100(IDX:0-3)" carry the count only in the index list.
+            entry_count = len(entry_indices) or 1
+        gres_type = gres_type or entry_type
+        count += entry_count
+        indices += entry_indices
+    return gres_type, count, indices
+
+
+def parse_scontrol_job(text, hostname):
+    """
+    Parses one job from ``scontrol -d -o show job`` output.
+
+    :param text: One output line.
+    :param hostname: Short host name; selects the per-node GRES detail of multi-node jobs.
+    :return: JobMetadata, or None if the line holds no job.
+    """
+    fields = _SCONTROL_FIELD_RE.findall(text)
+    values = {}
+    for key, value in fields:
+        values.setdefault(key, value)
+    if 'JobId' not in values:
+        return None
+    meta = JobMetadata(int(values['JobId']))
+    meta.user = values.get('UserId', '').split('(', 1)[0]
+    meta.account = values.get('Account', '')
+    meta.partition = values.get('Partition', '')
+    # -d adds "Nodes=<hostlist> CPU_IDs=... Mem=... GRES=<gres>" for each allocation.
+    node_gres = None
+    current_nodes = None
+    for key, value in fields:
+        if key == 'Nodes':
+            current_nodes = value
+        elif key == 'GRES' and current_nodes is not None:
+            if hostname in expand_hostlist(current_nodes):
+                node_gres = value
+                break
+            current_nodes = None
+    if node_gres is None:
+        node_gres = values.get('TresPerNode') or values.get('TRES_PER_NODE') or ''
+    meta.gpu_type, meta.gpu_count, meta.gpu_indices = parse_gres(node_gres)
+    return meta
+
+
+class JobMetadataIndex:
+    """Job metadata for the jobs on this node, fetched once per job and cached until it leaves."""
+
+    def __init__(self, hostname=None, binary='scontrol', timeout=10, retry_interval=60, runner=None):
+        """
+        :param hostname: Short name of this node in Slurm (defaults to the local host name).
+        :param binary: Name or path of the scontrol executable.
+        :param timeout: Seconds before a scontrol call is abandoned.
+        :param retry_interval: Seconds before a failed lookup of a job is retried.
+        :param runner: CommandRunner used to run scontrol (defaults to the shared one).
+        """
+        self.hostname = hostname or socket.gethostname().split('.', 1)[0]
+        self.binary = binary
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.runner = runner or default_runner
+        self._jobs = {}  # job_id -> JobMetadata
+        self._failed = {}  # job_id -> time of the last failed lookup
+        self.lookups = 0
+
+    def get(self, job_ids):
+        """
+        Returns metadata for the given jobs, querying Slurm only for jobs not seen before.
+        Cached jobs that are not in ``job_ids`` are considered finished and dropped.
+
+        :param job_ids: Iterable of the job IDs currently on the node.
+        :return: A dictionary mapping job IDs to JobMetadata; jobs that could not be
+                 looked up are left out.
+        """
+        live = {int(job_id) for job_id in job_ids}
+        for job_id in [job_id for job_id in self._jobs if job_id not in live]:
+            del self._jobs[job_id]
+        for job_id in [job_id for job_id in self._failed if job_id not in live]:
+            del self._failed[job_id]
+        now = time.monotonic()
+        missing = [job_id for job_id in sorted(live - self._jobs.keys())
+                   if now - self._failed.get(job_id, now - self.retry_interval) >= self.retry_interval]
+        for job_id, meta in self._lookup(missing).items():
+            if meta is None:
+                self._failed[job_id] = now
+            else:
+                self._failed.pop(job_id, None)
+                self._jobs[job_id] = meta
+        return {job_id: self._jobs[job_id] for job_id in live if job_id in self._jobs}
+
+    def _lookup(self, job_ids):
+        # Jobs that started together are looked up concurrently, each under its own timeout.
+        if not job_ids:
+            return {}
+        binary = shutil.which(self.binary)
+        if binary is None:
+            print(f"[WARN] `{self.binary}` command not found; job metadata unavailable.")
+            return dict.fromkeys(job_ids)
+        self.lookups += len(job_ids)
+        results = self.runner.run_many(
+            {job_id: [binary, '-d', '-o', 'show', 'job', str(job_id)] for job_id in job_ids},
+            timeout=self.timeout)
+        found = {}
+        for job_id, result in results.items():
+            found[job_id] = None
+            if isinstance(result, Exception):
+                print(f"[WARN] scontrol show job {job_id} failed: {result}")
+                continue
+            for line in result.text.splitlines():
+                meta = parse_scontrol_job(line, self.hostname)
+                if meta is not None and meta.job_id == job_id:
+                    found[job_id] = meta
+                    break
+        return found
@@ -0,0 +1,191 @@
+"""
+Node-side pre-aggregation for the central aggregator (``python3 -m poc_exporters.aggregator``).
+
+Instead of exposing per-PID and per-GPU series to Prometheus, a node can
+reduce its rounds to one summary per job and push it to a central process.
+``JobSummaries`` accumulates, per job:
+
+* ``gpu_seconds``: GPU time the job occupied (one GPU with job processes for
+  one second = 1);
+* ``gpu_busy_seconds``: the same, weighted by GPU utilization;
+* ``cpu_seconds``: CPU time of the job cgroup.
+
+All values are cumulative for the lifetime of the job on this node, so a
+batch that is lost or sent twice does no harm: the next one carries the
+current totals again. ``DeltaPusher`` sends, once per window, only the values
+that changed since the last acknowledged batch, plus the jobs that left the node.
+
+Batches are single lines of compact JSON, acknowledged by one ``ok`` line once
+the aggregator has committed them:
+
+    {"node":"gpu01","time":1700000000.0,"jobs":[[4242,"acct","user",{"gpu_seconds":120.0}]],"ended":[4100]}
+
+Addresses are ``unix:/path/to/socket`` or ``host:port``.
+"""
+import json
+import socket
+import time
+
+METRICS = ('gpu_seconds', 'gpu_busy_seconds', 'cpu_seconds')
+
+
+def parse_address(address):
+    """
+    :param address: ``unix:/path`` or ``host:port``.
+    :return: A (socket family, address) tuple for socket.socket()/connect().
+    :raises ValueError: If the address cannot be parsed.
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise ValueError(f"Address must be unix:/path or host:port, not {address!r}")
+    return socket.AF_INET, (host.strip('[]') or '127.0.0.1', int(port))
+
+
+def encode_batch(batch):
+    """
+    :param batch: A batch dictionary (node, time, jobs, ended).
+    :return: The batch as one line of bytes.
+    """
+    return json.dumps(batch, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def decode_batch(line):
+    """
+    :param line: One line received from a node.
+    :return: The batch dictionary.
+    :raises ValueError: If the line is not a valid batch.
+    """
+    batch = json.loads(line)
+    if not isinstance(batch, dict) or not isinstance(batch.get('node'), str):
+        raise ValueError("batch without a node name")
+    if not isinstance(batch.get('jobs', []), list) or not isinstance(batch.get('ended', []), list):
+        raise ValueError("jobs and ended must be lists")
+    return batch
+
+
+class JobSummaries:
+    """Per-job cumulative usage on this node, fed once per round by the collectors."""
+
+    def __init__(self, clock=time.monotonic):
+        """
+        :param clock: Monotonic clock in seconds, used to integrate GPU time between rounds.
+        """
+        self.clock = clock
+        self.values = {}  # job_id -> {metric: cumulative value}
+        self.jobs = {}  # job_id -> (account, user) of the jobs on the node in the latest round
+        self.elapsed = 0.0  # seconds since the previous round; 0 on the first one
+        self._last_round = None
+
+    def start_round(self):
+        """Starts a round; values added with add() are weighted by the time since the previous one."""
+        now = self.clock()
+        self.elapsed = 0.0 if self._last_round is None else now - self._last_round
+        self._last_round = now
+
+    def add(self, job_id, metric, rate):
+        """
+        Integrates a rate over the time since the previous round.
+
+        :param job_id: Slurm job ID.
+        :param metric: One of METRICS.
+        :param rate: Amount per second, e.g. 0.5 for a GPU at 50 % utilization.
+        """
+        job = self.values.setdefault(job_id, {})
+        job[metric] = job.get(metric, 0.0) + rate * self.elapsed
+
+    def set(self, job_id, metric, value):
+        """
+        Records a cumulative counter read from the node, e.g. the CPU time of a job cgroup.
+
+        :param job_id: Slurm job ID.
+        :param metric: One of METRICS.
+        :param value: Current counter value.
+        """
+        self.values.setdefault(job_id, {})[metric] = value
+
+    def observe_jobs(self, job_ids, metadata):
+        """
+        Records the jobs present in this round; jobs that are gone are forgotten.
+
+        :param job_ids: The IDs of the jobs on the node.
+        :param metadata: A dictionary mapping job IDs to JobMetadata; jobs missing from it
+                         (e.g. scontrol failed) are pushed without an account for now.
+        """
+        self.jobs = {}
+        for job_id in job_ids:
+            meta = metadata.get(job_id)
+            self.jobs[job_id] = (meta.account, meta.user) if meta is not None else ('', '')
+        for job_id in set(self.values) - set(self.jobs):
+            del self.values[job_id]
+
+
+class DeltaPusher:
+    """Sends the job summaries that changed since the last acknowledged batch."""
+
+    def __init__(self, address, node=None, timeout=5.0, clock=time.time):
+        """
+        :param address: Aggregator address, ``unix:/path`` or ``host:port``.
+        :param node: Node name sent with every batch; the host name if omitted.
+        :param timeout: Seconds allowed for connecting, sending and the acknowledgement.
+        :param clock: Wall clock stamped on the batches.
+        """
+        self.family, self.address = parse_address(address)
+        self.node = node or socket.gethostname().split('.')[0]
+        self.timeout = timeout
+        self.clock = clock
+        self.sent = {}  # job_id -> {metric: value} as last acknowledged
+        self.batches = 0
+        self.failures = 0
+
+    def build(self, summaries):
+        """
+        :param summaries: The node's JobSummaries.
+        :return: A batch holding the changed values and the ended jobs, or None if nothing changed.
+        """
+        jobs = []
+        for job_id, values in sorted(summaries.values.items()):
+            previous = self.sent.get(job_id, {})
+            changed = {metric: round(value, 3) for metric, value in values.items()
+                       if round(value, 3) != previous.get(metric)}
+            if changed:
+                account, user = summaries.jobs.get(job_id, ('', ''))
+                jobs.append([job_id, account, user, changed])
+        ended = sorted(set(self.sent) - set(summaries.jobs))
+        if not jobs and not ended:
+            return None
+        return {'node': self.node, 'time': self.clock(), 'jobs': jobs, 'ended': ended}
+
+    def push(self, summaries):
+        """
+        Sends one batch; on failure the same changes are sent again with the next one.
+
+        :param summaries: The node's JobSummaries.
+        :return: True if the aggregator acknowledged the batch or there was nothing to send.
+        """
+        batch = self.build(summaries)
+        if batch is None:
+            return True
+        try:
+            self._send(encode_batch(batch))
+        except (OSError, ValueError) as e:
+            self.failures += 1
+            print(f"[WARN] Push to the aggregator failed: {e}")
+            return False
+        for job_id, _, _, changed in batch['jobs']:
+            self.sent.setdefault(job_id, {}).update(changed)
+        for job_id in batch['ended']:
+            self.sent.pop(job_id, None)
+        self.batches += 1
+        return True
+
+    def _send(self, payload):
+        with socket.socket(self.family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            sock.sendall(payload)
+            sock.shutdown(socket.SHUT_WR)
+            reply = sock.makefile('rb').readline().decode('utf-8', 'replace').strip()
+        if reply != 'ok':
+            raise ValueError(f"aggregator replied {reply or 'nothing'!r}")
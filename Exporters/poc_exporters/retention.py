@@ -0,0 +1,229 @@
+"""
+Retention and downsampling for ``gpu_utilization_raw``.
+
+Raw samples are rolled up into ``gpu_utilization_rollup`` at three tiers
+(minute, hour, day). Each tier keeps sample count, sum, min and max per
+account, so higher tiers are built from lower ones without re-averaging
+averages. A raw row that is the mean of several samples (see
+``monitoring.py``'s sample ring) counts as that many samples. Every tier has a watermark in ``maintenance_state``; a run only
+reads the closed buckets between that watermark and now, using range
+predicates the ``(timestamp, account)`` index can serve.
+
+Raw rows and old rollups are deleted in small batches, each in its own
+transaction, once they are past their TTL and already rolled up. The
+database is then ``PRAGMA optimize``'d, and ``VACUUM``'d on a longer interval.
+"""
+from datetime import datetime, timedelta
+
+from .store import STATE_UPSERT
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# tier -> (source tier or None for raw samples, SQLite bucket format, bucket width)
+TIERS = {
+    'minute': (None, '%Y-%m-%d %H:%M:00', timedelta(minutes=1)),
+    'hour': ('minute', '%Y-%m-%d %H:00:00', timedelta(hours=1)),
+    'day': ('hour', '%Y-%m-%d 00:00:00', timedelta(days=1)),
+}
+
+DEFAULT_TTLS = {
+    'raw': timedelta(days=7),
+    'minute': timedelta(days=30),
+    'hour': timedelta(days=400),
+    'day': None,  # kept forever
+}
+
+_ROLLUP_FROM_RAW = """
+    INSERT INTO gpu_utilization_rollup
+        (tier, bucket, account, samples, sum_utilization, min_utilization, max_utilization)
+    SELECT ?, strftime(?, timestamp), account, SUM(samples), SUM(utilization_percent * samples),
+           MIN(utilization_percent), MAX(utilization_percent)
+    FROM gpu_utilization_raw
+    WHERE timestamp >= ? AND timestamp < ?
+    GROUP BY 2, 3
+    ON CONFLICT (tier, bucket, account) DO UPDATE SET
+        samples = samples + excluded.samples,
+        sum_utilization = sum_utilization + excluded.sum_utilization,
+        min_utilization = MIN(min_utilization, excluded.min_utilization),
+        max_utilization = MAX(max_utilization, excluded.max_utilization)
+"""
+
+_ROLLUP_FROM_TIER = """
+    INSERT INTO gpu_utilization_rollup
+        (tier, bucket, account, samples, sum_utilization, min_utilization, max_utilization)
+    SELECT ?, strftime(?, bucket), account, SUM(samples), SUM(sum_utilization),
+           MIN(min_utilization), MAX(max_utilization)
+    FROM gpu_utilization_rollup
+    WHERE tier = ? AND bucket >= ? AND bucket < ?
+    GROUP BY 2, 3
+    ON CONFLICT (tier, bucket, account) DO UPDATE SET
+        samples = samples + excluded.samples,
+        sum_utilization = sum_utilization + excluded.sum_utilization,
+        min_utilization = MIN(min_utilization, excluded.min_utilization),
+        max_utilization = MAX(max_utilization, excluded.max_utilization)
+"""
+
+
+def floor_time(moment, width):
+    """
+    Truncates a datetime to the start of its bucket.
+
+    :param moment: A naive datetime.
+    :param width: Bucket width (one minute, hour or day).
+    :return: The start of the bucket containing ``moment``.
+    """
+    if width >= timedelta(days=1):
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if width >= timedelta(hours=1):
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+
+def _format(moment):
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def _parse(value):
+    return datetime.strptime(value[:19], TIMESTAMP_FORMAT)
+
+
+class RetentionManager:
+    """Rolls raw GPU samples up into minute/hour/day tiers and enforces per-tier TTLs."""
+
+    def __init__(self, store, ttls=None, delete_batch=5000, settle=timedelta(seconds=60),
+                 vacuum_interval=timedelta(days=7)):
+        """
+        :param store: A UtilizationStore.
+        :param ttls: Mapping of ``raw``/``minute``/``hour``/``day`` to a timedelta, or None
+                     to keep that tier forever. Missing keys use DEFAULT_TTLS.
+        :param delete_batch: Maximum number of rows removed per delete transaction.
+        :param settle: Samples newer than ``now - settle`` are not rolled up yet, so
+                       late queued rows still land in an open bucket.
+        :param vacuum_interval: Minimum time between two VACUUMs, or None to never VACUUM.
+        """
+        self.store = store
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.delete_batch = delete_batch
+        self.settle = settle
+        self.vacuum_interval = vacuum_interval
+
+    # ----- state -----
+
+    def watermark(self, tier):
+        """
+        :param tier: Rollup tier name.
+        :return: The datetime up to which ``tier`` has been rolled up, or None if never.
+        """
+        value = self.store.get_state(f'rollup_watermark:{tier}')
+        return _parse(value) if value else None
+
+    # ----- rollup -----
+
+    def rollup(self, now=None):
+        """
+        Rolls every closed bucket since the last run into each tier, lowest tier first.
+
+        :param now: Current time (defaults to datetime.now()).
+        :return: A dictionary mapping tier names to the number of rollup rows written.
+        """
+        now = now or datetime.now()
+        self.store.flush()  # so the first-bucket lookup below sees every queued sample
+        written = {}
+        for tier, (source, bucket_format, width) in TIERS.items():
+            upto = floor_time(now - self.settle, width)
+            if source is not None:
+                source_mark = self.watermark(source)
+                if source_mark is None:
+                    continue
+                upto = min(upto, floor_time(source_mark, width))
+            start = self.watermark(tier) or self._first_bucket(source, width)
+            if start is None or start >= upto:
+                continue
+            with self.store.transaction() as conn:
+                if source is None:
+                    cursor = conn.execute(_ROLLUP_FROM_RAW,
+                                          (tier, bucket_format, _format(start), _format(upto)))
+                else:
+                    cursor = conn.execute(_ROLLUP_FROM_TIER,
+                                          (tier, bucket_format, source, _format(start), _format(upto)))
+                conn.execute(STATE_UPSERT, (f'rollup_watermark:{tier}', _format(upto)))
+            written[tier] = cursor.rowcount
+        return written
+
+    def _first_bucket(self, source, width):
+        if source is None:
+            rows = self.store.query("SELECT MIN(timestamp) FROM gpu_utilization_raw")
+        else:
+            rows = self.store.query("SELECT MIN(bucket) FROM gpu_utilization_rollup WHERE tier = ?", (source,))
+        first = rows[0][0] if rows else None
+        return floor_time(_parse(first), width) if first else None
+
+    # ----- retention -----
+
+    def prune(self, now=None):
+        """
+        Deletes raw samples and rollups older than their TTL, in batches of
+        ``delete_batch`` rows. Raw samples newer than the minute watermark are kept
+        even if expired, so nothing is dropped before it has been rolled up.
+
+        :param now: Current time (defaults to datetime.now()).
+        :return: A dictionary mapping ``raw`` and tier names to the number of rows deleted.
+        """
+        now = now or datetime.now()
+        deleted = {}
+        raw_ttl = self.ttls.get('raw')
+        minute_mark = self.watermark('minute')
+        if raw_ttl is not None and minute_mark is not None:
+            cutoff = min(now - raw_ttl, minute_mark)
+            deleted['raw'] = self._delete_batches("""
+                DELETE FROM gpu_utilization_raw WHERE id IN (
+                    SELECT id FROM gpu_utilization_raw WHERE timestamp < ? LIMIT ?
+                )""", (_format(cutoff),))
+        for tier in TIERS:
+            ttl = self.ttls.get(tier)
+            if ttl is None:
+                continue
+            deleted[tier] = self._delete_batches("""
+                DELETE FROM gpu_utilization_rollup WHERE rowid IN (
+                    SELECT rowid FROM gpu_utilization_rollup WHERE tier = ? AND bucket < ? LIMIT ?
+                )""", (tier, _format(now - ttl)))
+        return deleted
+
+    def _delete_batches(self, sql, params):
+        total = 0
+        while True:
+            count = self.store.execute(sql, params + (self.delete_batch,))
+            total += count
+            if count < self.delete_batch:
+                return total
+
+    def maintain(self, now=None):
+        """
+        Runs ``PRAGMA optimize`` and, once per ``vacuum_interval``, ``VACUUM``.
+
+        :param now: Current time (defaults to datetime.now()).
+        :return: True if the database was vacuumed.
+        """
+        now = now or datetime.now()
+        self.store.execute("PRAGMA optimize", transaction=False)
+        if self.vacuum_interval is None:
+            return False
+        last = self.store.get_state('last_vacuum')
+        if last and now - _parse(last) < self.vacuum_interval:
+            return False
+        self.store.execute("VACUUM", transaction=False)
+        self.store.set_state('last_vacuum', _format(now))
+        return True
+
+    def run(self, now=None):
+        """
+        Runs rollup, prune and maintenance in that order.
+
+        :param now: Current time (defaults to datetime.now()).
+        """
+        now = now or datetime.now()
+        written = self.rollup(now)
+        deleted = self.prune(now)
+        vacuumed = self.maintain(now)
+        print(f"[INFO] Retention run: rolled up {written}, deleted {deleted}, vacuumed={vacuumed}")
@@ -0,0 +1,379 @@
+"""
+Shared-memory ring buffer of high-rate GPU samples.
+
+At one sample per second, one SQLite row per GPU per sample is more than the
+database writer should carry. Storing samples only in SQLite would also force
+the sampler and the HTTP server to share one process. ``SampleRing`` is a
+fixed-size array of slots in a file mapped with ``mmap``, normally under
+``/dev/shm``:
+
+    header   magic, GPU count, slot count and size, creation time,
+             ``claimed`` and ``committed`` sample counters
+    slot     sequence number, timestamp, then per GPU (in index order):
+             float32 utilization, float32 memory used in bytes,
+             uint32 owning job (0 = none)
+
+A single writer (the sampler) appends with ``append()``. Before reusing a slot
+it raises ``claimed``; once the slot is written it raises ``committed``.
+Readers in any process map the same file. They copy a window out of a NumPy
+view of the mapping in one operation, then read ``claimed`` again. A row whose
+slot was claimed for a newer sample meanwhile, or whose sequence number does
+not match, is torn and dropped. Readers never block the writer.
+
+Writing needs only the standard library; reading needs NumPy. ``downsample()``
+reduces a window to one mean per time bucket, GPU and job. Only these means
+go to SQLite, with the number of samples each one averages (see
+``GPU_RING_PATH`` in monitoring.py).
+
+To serve the latest samples from a separate process:
+
+    python3 -m poc_exporters.ring --path /dev/shm/poc_exporters_gpu.ring --port 9064
+"""
+import argparse
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+DEFAULT_PATH = '/dev/shm/poc_exporters_gpu.ring'
+MAGIC = b'POCRING1'
+HEADER_SIZE = 64
+# magic, GPUs, slots, slot size, creation time, claimed, committed
+_HEADER = struct.Struct('<8sIII4xdQQ')
+_COUNTER = struct.Struct('<Q')
+_CLAIMED = 32  # offsets of the counters within the header
+_COMMITTED = 40
+
+
+class RingError(Exception):
+    """Raised when a ring file is missing, is not a ring, or already has a writer."""
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("Reading a sample ring needs numpy (pip install numpy)") from e
+    return numpy
+
+
+def slot_size(gpus):
+    """
+    :param gpus: GPUs per sample.
+    :return: Bytes per slot, a multiple of 8.
+    """
+    return (16 + 12 * gpus + 7) // 8 * 8
+
+
+@dataclass
+class RingWindow:
+    indices: object  # NumPy arrays with one row per sample, oldest first
+    times: object
+    utilization: object  # (samples, GPUs) float32, percent
+    memory: object  # (samples, GPUs) float32, bytes
+    jobs: object  # (samples, GPUs) uint32, 0 for a GPU without a job
+    end: int  # index to read from next time
+    lost: int  # samples overwritten or torn before they could be read
+
+
+class SampleRing:
+    """Fixed-size ring of GPU samples in a memory-mapped file; one writer, any number of readers."""
+
+    def __init__(self, path=DEFAULT_PATH, gpus=None, slots=86400, create=False):
+        """
+        :param path: Ring file, normally under /dev/shm.
+        :param gpus: GPUs per sample; required with ``create``.
+        :param slots: Samples kept (a day at one sample per second); only used with ``create``.
+        :param create: Open as the writer. The file is locked, and replaced by an empty ring
+                       if its layout differs; a ring with the same layout keeps its samples.
+        :raises RingError: If the file cannot be used as a ring.
+        """
+        self.path = path
+        self.writer = create
+        self._lock = threading.Lock()
+        self._array = None
+        if create:
+            self._create(gpus, slots)
+        else:
+            self._open()
+
+    # ----- opening -----
+
+    def _create(self, gpus, slots):
+        if not gpus or slots < 1:
+            raise RingError("A ring needs at least one GPU and one slot")
+        self._lockfile = os.open(f'{self.path}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._lockfile)
+            raise RingError(f"{self.path} already has a writer")
+        size = HEADER_SIZE + slots * slot_size(gpus)
+        try:
+            self._map_file(os.O_RDWR, mmap.ACCESS_WRITE)
+            if (self.gpus, self.slots) == (gpus, slots):
+                return
+            self.close_map()
+        except (OSError, RingError):
+            pass
+        # Built under a temporary name and renamed, so readers never map a half-sized file;
+        # readers of the previous file notice the new inode and reopen.
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            os.pwrite(fd, _HEADER.pack(MAGIC, gpus, slots, slot_size(gpus), time.time(), 0, 0), 0)
+        finally:
+            os.close(fd)
+        os.replace(tmp, self.path)
+        self._map_file(os.O_RDWR, mmap.ACCESS_WRITE)
+
+    def _open(self):
+        try:
+            self._map_file(os.O_RDONLY, mmap.ACCESS_READ)
+        except OSError as e:
+            raise RingError(f"Cannot open {self.path}: {e}")
+
+    def _map_file(self, flags, access):
+        fd = os.open(self.path, flags)
+        try:
+            stat = os.fstat(fd)
+            if stat.st_size < HEADER_SIZE:
+                raise RingError(f"{self.path} is not a sample ring")
+            self._map = mmap.mmap(fd, stat.st_size, access=access)
+        finally:
+            os.close(fd)
+        self._inode = stat.st_ino
+        magic, self.gpus, self.slots, self.slot_size, self.created, _, _ = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or self.slot_size != slot_size(self.gpus) \
+                or stat.st_size < HEADER_SIZE + self.slots * self.slot_size:
+            self.close_map()
+            raise RingError(f"{self.path} is not a sample ring")
+        self._slot = struct.Struct(f'<Qd{self.gpus}f{self.gpus}f{self.gpus}I')
+        self._committed = _COUNTER.unpack_from(self._map, _COMMITTED)[0]
+
+    def _reopen_if_replaced(self):
+        # A restarted writer with another GPU count renames a new ring over the path.
+        try:
+            replaced = os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return
+        if replaced:
+            self.close_map()
+            self._open()
+
+    # ----- writing -----
+
+    def append(self, timestamp, utilization, memory, jobs):
+        """
+        Appends one sample; only the writer may call this.
+
+        :param timestamp: Wall time of the sample.
+        :param utilization: Utilization percent of each GPU, in index order.
+        :param memory: Memory used in bytes of each GPU.
+        :param jobs: ID of the job owning each GPU, 0 for none.
+        :return: The index of the sample.
+        """
+        index = self._committed
+        _COUNTER.pack_into(self._map, _CLAIMED, index + 1)
+        self._slot.pack_into(self._map, HEADER_SIZE + (index % self.slots) * self.slot_size,
+                             index + 1, timestamp, *utilization, *memory, *jobs)
+        _COUNTER.pack_into(self._map, _COMMITTED, index + 1)
+        self._committed = index + 1
+        return index
+
+    # ----- reading -----
+
+    def committed(self):
+        """
+        :return: The number of samples ever appended to this ring.
+        """
+        return _COUNTER.unpack_from(self._map, _COMMITTED)[0]
+
+    def dtype(self):
+        """
+        :return: The NumPy structured dtype of one slot.
+        """
+        np = _numpy()
+        gpus = self.gpus
+        return np.dtype({'names': ['seq', 'time', 'utilization', 'memory', 'jobs'],
+                         'formats': ['<i8', '<f8', ('<f4', (gpus,)), ('<f4', (gpus,)), ('<u4', (gpus,))],
+                         'offsets': [0, 8, 16, 16 + 4 * gpus, 16 + 8 * gpus],
+                         'itemsize': self.slot_size})
+
+    def read(self, since=0):
+        """
+        Copies the samples from ``since`` on out of the ring, without the torn ones.
+
+        :param since: Index of the first sample wanted, e.g. the ``end`` of the previous window.
+        :return: A RingWindow.
+        """
+        np = _numpy()
+        with self._lock:
+            if not self.writer:
+                self._reopen_if_replaced()
+            if self._array is None:
+                # Zero-copy view of the slots; only the rows of a window are ever copied out.
+                self._array = np.frombuffer(self._map, dtype=self.dtype(), count=self.slots, offset=HEADER_SIZE)
+            committed = self.committed()
+            since = min(since, committed)
+            start = max(since, committed - self.slots)
+            indices = np.arange(start, committed, dtype=np.int64)
+            rows = self._array[indices % self.slots]
+            claimed = _COUNTER.unpack_from(self._map, _CLAIMED)[0]
+        valid = (indices + self.slots >= claimed) & (rows['seq'] == indices + 1)
+        rows, indices = rows[valid], indices[valid]
+        return RingWindow(indices, rows['time'], rows['utilization'], rows['memory'], rows['jobs'],
+                          end=committed, lost=start - since + int(len(valid) - valid.sum()))
+
+    def close_map(self):
+        self._array = None
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        with self._lock:
+            self.close_map()
+        if self.writer:
+            os.close(self._lockfile)
+
+
+def downsample(window, interval=None, until=None):
+    """
+    Averages a window per time bucket, GPU and owning job.
+
+    :param window: A RingWindow.
+    :param interval: Bucket width in seconds, or None for a single bucket starting at 0.
+    :param until: Wall time; buckets ending after it are still open and left out, with the
+                  samples after them. None closes every bucket.
+    :return: A (rows, position) tuple. Rows are (bucket start, GPU column, job ID, samples,
+             mean utilization, maximum utilization, mean memory bytes), sorted. ``position`` is
+             the index to read from next time, so that open buckets are read again.
+    """
+    np = _numpy()
+    times = window.times
+    buckets = np.floor(times / interval) * interval if interval else np.zeros(len(times))
+    count = len(times)
+    position = window.end
+    if interval and until is not None:
+        still_open = np.flatnonzero(buckets + interval > until)
+        if len(still_open):
+            count = int(still_open[0])
+            position = int(window.indices[count])
+    rows = []
+    if not count:
+        return rows, position
+    for column in range(window.utilization.shape[1]):
+        keys = np.stack([buckets[:count], window.jobs[:count, column].astype(np.float64)], axis=1)
+        keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        utilization = window.utilization[:count, column].astype(np.float64)
+        samples = np.bincount(inverse, minlength=len(keys))
+        total = np.bincount(inverse, weights=utilization, minlength=len(keys))
+        memory = np.bincount(inverse, weights=window.memory[:count, column], minlength=len(keys))
+        maximum = np.full(len(keys), -np.inf)
+        np.maximum.at(maximum, inverse, utilization)
+        for (bucket, job), n, used, peak, memory_used in zip(keys, samples, total, maximum, memory):
+            rows.append((float(bucket), column, int(job), int(n), float(used / n), float(peak),
+                         float(memory_used / n)))
+    rows.sort()
+    return rows, position
+
+
+class WindowReader:
+    """Builds metric families from the latest seconds of a ring, for a process other than the writer."""
+
+    def __init__(self, ring, window=60.0, sample_interval=1.0, clock=time.time):
+        """
+        :param ring: A SampleRing opened for reading.
+        :param window: Seconds of samples summarized by each build.
+        :param sample_interval: Seconds between two samples of the writer, to size the read.
+        :param clock: Wall clock.
+        """
+        self.ring = ring
+        self.window = window
+        self.sample_interval = sample_interval
+        self.clock = clock
+        self.lost = 0
+
+    def version(self):
+        return self.ring.created, self.ring.committed()
+
+    def families(self, family):
+        """
+        :param family: Family factory taking (name, documentation, labels, type).
+        :return: Per GPU and job utilization and memory over the window, and the ring counters.
+        """
+        wanted = math.ceil(self.window / self.sample_interval) + 1
+        sample = self.ring.read(max(0, self.ring.committed() - wanted))
+        self.lost += sample.lost
+        recent = sample.times >= self.clock() - self.window
+        sample = RingWindow(sample.indices[recent], sample.times[recent], sample.utilization[recent],
+                            sample.memory[recent], sample.jobs[recent], sample.end, sample.lost)
+        labels = ['gpu_id', 'job_id']
+        average = family('gpu_ring_utilization_percent', 'GPU utilization over the ring window', labels, 'gauge')
+        peak = family('gpu_ring_utilization_percent_max', 'Maximum GPU utilization over the ring window', labels, 'gauge')
+        memory = family('gpu_ring_memory_used_bytes', 'GPU memory used over the ring window', labels, 'gauge')
+        samples = family('gpu_ring_window_samples', 'Samples of a GPU and job in the ring window', labels, 'gauge')
+        rows, _ = downsample(sample)
+        for _, column, job, n, mean, maximum, memory_used in rows:
+            key = [str(column), str(job) if job else 'none']
+            average.add_metric(key, mean)
+            peak.add_metric(key, maximum)
+            memory.add_metric(key, memory_used)
+            samples.add_metric(key, n)
+        appended = family('gpu_ring_samples_appended_total', 'Samples appended to the ring by the writer', [], 'counter')
+        appended.add_metric([], sample.end)
+        lost = family('gpu_ring_samples_lost_total', 'Samples overwritten or torn before this reader could read them', [], 'counter')
+        lost.add_metric([], self.lost)
+        last = family('gpu_ring_last_sample_timestamp_seconds', 'Time of the newest sample in the ring', [], 'gauge')
+        if len(sample.times):
+            last.add_metric([], float(sample.times[-1]))
+        return [average, peak, memory, samples, appended, lost, last]
+
+
+def main(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(prog="python3 -m poc_exporters.ring",
+                                     description="Serves the latest window of a GPU sample ring to Prometheus.")
+    parser.add_argument("--path", default=env("GPU_RING_PATH") or DEFAULT_PATH, help="ring file")
+    parser.add_argument("--port", type=int, default=int(env("GPU_RING_PORT", "9064")), help="HTTP port of /metrics")
+    parser.add_argument("--window", type=float, default=float(env("GPU_RING_WINDOW", "60")),
+                        help="seconds of samples summarized by a scrape")
+    parser.add_argument("--sample-interval", type=float, default=float(env("GPU_SAMPLE_INTERVAL", "1")),
+                        help="seconds between two samples of the writer")
+    args = parser.parse_args(argv)
+
+    try:
+        ring = SampleRing(args.path)
+    except RingError as e:
+        print(f"[ERROR] {e}")
+        return 1
+    from prometheus_client import REGISTRY, start_http_server
+    from .scrape import SnapshotCollector, prometheus_family
+    from .series import SeriesLimiter
+
+    reader = WindowReader(ring, window=args.window, sample_interval=args.sample_interval)
+    series = SeriesLimiter('gpu_ring')
+    # Rebuilt after every new sample, and at least once per window so ended jobs age out.
+    REGISTRY.register(SnapshotCollector(
+        lambda: series.build(reader.families, prometheus_family) + series.families(prometheus_family),
+        reader.version, 'gpu_ring', max_age=args.window))
+    start_http_server(args.port)
+    print(f"[INFO] Serving the last {args.window}s of {args.path} ({ring.gpus} GPUs) on :{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
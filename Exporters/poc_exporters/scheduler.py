@@ -0,0 +1,248 @@
+"""
+A single-threaded, heap-based job scheduler.
+
+One dispatcher thread keeps a heap of due times and starts each job on a
+worker thread when it is due. Schedules are either fixed intervals
+(``Every``) or calendar-aligned (``Daily``, ``Weekly``, ``Monthly``). A job's
+next slot is computed from its previous nominal slot, not from when it
+finished, so slow runs do not make later ones drift.
+
+* A job that is still running when its next slot arrives skips that slot.
+* A random jitter is added to each run, so a fleet of nodes does not hit
+  slurmdbd in the same second.
+* When a state store is given, each job's last nominal slot is persisted
+  once the job succeeds. After a restart a job runs once if it missed its
+  slot or its last run failed, and otherwise waits for its next slot instead
+  of running again at startup. A job with no persisted slot at all (a fresh
+  deployment) runs at startup, unless added with ``run_if_never_run=False``,
+  in which case it waits for its first calendar slot. Without a state store,
+  calendar jobs always wait for their next slot.
+* When an Instrumentation is given, every run is tracked under the job name
+  (duration, errors, last success).
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class Every:
+    """Runs every ``seconds`` seconds."""
+
+    def __init__(self, seconds):
+        self.interval = timedelta(seconds=seconds)
+
+    def next_after(self, moment):
+        return moment + self.interval
+
+    def first(self, now):
+        return now
+
+    def __repr__(self):
+        return f"Every({self.interval.total_seconds():g}s)"
+
+
+class Daily:
+    """Runs once a day at ``hour:minute`` local time."""
+
+    def __init__(self, hour=0, minute=0):
+        self.hour = hour
+        self.minute = minute
+
+    def _at(self, day):
+        return day.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+
+    def next_after(self, moment):
+        candidate = self._at(moment)
+        return candidate if candidate > moment else self._at(moment + timedelta(days=1))
+
+    def first(self, now):
+        return self.next_after(now)
+
+    def __repr__(self):
+        return f"Daily({self.hour:02d}:{self.minute:02d})"
+
+
+class Weekly(Daily):
+    """Runs once a week on ``weekday`` (0 = Monday) at ``hour:minute`` local time."""
+
+    def __init__(self, weekday=0, hour=0, minute=0):
+        super().__init__(hour, minute)
+        self.weekday = weekday
+
+    def next_after(self, moment):
+        candidate = self._at(moment + timedelta(days=(self.weekday - moment.weekday()) % 7))
+        return candidate if candidate > moment else candidate + timedelta(days=7)
+
+    def __repr__(self):
+        return f"Weekly({self.weekday}, {self.hour:02d}:{self.minute:02d})"
+
+
+class Monthly(Daily):
+    """Runs once a month on ``day`` (1-28) at ``hour:minute`` local time."""
+
+    def __init__(self, day=1, hour=0, minute=0):
+        if not 1 <= day <= 28:
+            raise ValueError("Monthly day must be between 1 and 28")
+        super().__init__(hour, minute)
+        self.day = day
+
+    def next_after(self, moment):
+        candidate = self._at(moment.replace(day=self.day))
+        if candidate > moment:
+            return candidate
+        year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+        return candidate.replace(year=year, month=month)
+
+    def __repr__(self):
+        return f"Monthly({self.day}, {self.hour:02d}:{self.minute:02d})"
+
+
+class Job:
+    def __init__(self, name, schedule, func, jitter, persist):
+        self.name = name
+        self.schedule = schedule
+        self.func = func
+        self.jitter = jitter
+        self.persist = persist
+        self.running = False
+        self.slot = None  # nominal datetime of the next run
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_duration = None
+
+
+class Scheduler:
+    """Dispatches jobs from a single timer heap; see the module docstring."""
+
+    STATE_PREFIX = 'last_run:'
+
+    def __init__(self, state=None, jitter=0.0, rng=None, instrumentation=None):
+        """
+        :param state: Object with ``get_state(key)`` / ``set_state(key, value)`` used to
+                      persist last-run slots (e.g. a UtilizationStore), or None.
+        :param jitter: Default maximum jitter in seconds added to every run.
+        :param rng: random.Random instance used for jitter.
+        :param instrumentation: Instrumentation that tracks each run under the job name, or None.
+        """
+        self.state = state
+        self.instrumentation = instrumentation
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, name, schedule, func, jitter=None, persist=True, run_if_never_run=True):
+        """
+        Registers a job.
+
+        :param name: Unique job name; also the key its last run is persisted under.
+        :param schedule: An Every, Daily, Weekly or Monthly instance.
+        :param func: Callable run with no arguments.
+        :param jitter: Maximum jitter in seconds for this job (defaults to the scheduler's).
+        :param persist: Persist the last-run slot so restarts neither repeat nor skip runs.
+        :param run_if_never_run: With a persisted state and no recorded run, run now rather
+                                 than at the schedule's first slot (up to a month away for
+                                 Monthly).
+        :return: The Job.
+        """
+        if name in self.jobs:
+            raise ValueError(f"Job {name} already scheduled")
+        job = Job(name, schedule, func, self.jitter if jitter is None else jitter,
+                  persist and self.state is not None)
+        now = datetime.now()
+        last = self._load_last(job)
+        if last is None:
+            job.slot = now if job.persist and run_if_never_run else schedule.first(now)
+        else:
+            # A missed slot becomes due now (once); otherwise wait for the next one.
+            upcoming = schedule.next_after(last)
+            job.slot = now if upcoming <= now else upcoming
+        with self._cond:
+            self.jobs[name] = job
+            self._push(job)
+            self._cond.notify()
+        return job
+
+    def _load_last(self, job):
+        if not job.persist:
+            return None
+        value = self.state.get_state(self.STATE_PREFIX + job.name)
+        return datetime.fromisoformat(value) if value else None
+
+    def _push(self, job):
+        due = job.slot.timestamp() + (self.rng.uniform(0, job.jitter) if job.jitter else 0.0)
+        heapq.heappush(self._heap, (due, next(self._counter), job))
+
+    def start(self):
+        """Starts the dispatcher on a daemon thread."""
+        self._thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the dispatcher; running jobs are left to finish."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def run(self):
+        """Runs the dispatcher loop in the calling thread until stop() is called."""
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, job = self._heap[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                self._dispatch(job)
+
+    def _dispatch(self, job):
+        slot = job.slot
+        job.slot = job.schedule.next_after(slot)
+        # Never queue a backlog: if the process was suspended, jump to the next future slot.
+        now = datetime.now()
+        while job.slot <= now:
+            job.slot = job.schedule.next_after(job.slot)
+        self._push(job)
+        if job.running:
+            job.skipped += 1
+            print(f"[WARN] Skipping {job.name}: previous run still in progress.")
+            return
+        job.running = True
+        threading.Thread(target=self._run_job, args=(job, slot), name=f'job-{job.name}', daemon=True).start()
+
+    def _run_job(self, job, slot):
+        started = time.monotonic()
+        try:
+            if self.instrumentation is None:
+                job.func()
+            else:
+                with self.instrumentation.track(job.name):
+                    job.func()
+        except Exception as e:
+            job.failures += 1
+            print(f"[ERROR] Scheduled job {job.name} failed: {e}")
+        else:
+            # Only a successful run is recorded, so a failed one is retried after a restart.
+            if job.persist:
+                try:
+                    self.state.set_state(self.STATE_PREFIX + job.name, slot.isoformat(sep=' '))
+                except Exception as e:
+                    print(f"[WARN] Could not persist last run of {job.name}: {e}")
+        finally:
+            job.last_duration = time.monotonic() - started
+            job.runs += 1
+            job.running = False
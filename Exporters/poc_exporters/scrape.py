@@ -0,0 +1,87 @@
+"""
+On-scrape Prometheus collectors backed by a cached snapshot.
+
+``SnapshotCollector`` builds its metric families only when a scrape arrives,
+and reuses the previous result when the data behind it has not changed (as
+reported by a caller-supplied version function). Concurrent scrapes serialise
+on one lock, so a burst of scrapes triggers at most one computation. Label
+sets that vanish between two snapshots are simply not exposed again, and
+counted in ``<namespace>_removed_series_total``.
+"""
+import threading
+import time
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+def prometheus_family(name, documentation, labels, type):
+    """
+    Family factory with the signature of textfile.MetricFamily, for prometheus_client output.
+
+    :param name: Metric name; counters end in ``_total``, which prometheus_client appends itself.
+    :param documentation: HELP text.
+    :param labels: Label names.
+    :param type: ``counter`` or ``gauge``.
+    :return: A CounterMetricFamily or GaugeMetricFamily.
+    """
+    if type == 'counter':
+        return CounterMetricFamily(name[:-len('_total')] if name.endswith('_total') else name, documentation,
+                                   labels=labels)
+    return GaugeMetricFamily(name, documentation, labels=labels)
+
+
+class SnapshotCollector:
+    """A prometheus_client custom collector that serves a cached, lazily rebuilt snapshot."""
+
+    def __init__(self, build, version, namespace, max_age=None):
+        """
+        :param build: Callable returning an iterable of metric families.
+        :param version: Callable returning a value that changes whenever ``build`` would
+                        return something different.
+        :param namespace: Prefix for the collector's own bookkeeping metrics.
+        :param max_age: Rebuild at least this often (seconds) even if the version is unchanged,
+                        or None to rely on the version alone.
+        """
+        self._build = build
+        self._version = version
+        self.namespace = namespace
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._families = None
+        self._key = None
+        self._built_at = 0.0
+        self._labelsets = {}
+        self._removed = {}
+        self.builds = 0
+
+    def describe(self):
+        # Returning no descriptions keeps registration from running a full build.
+        return []
+
+    def collect(self):
+        with self._lock:
+            key = self._version()
+            stale = self.max_age is not None and time.monotonic() - self._built_at >= self.max_age
+            if self._families is None or key != self._key or stale:
+                self._families = list(self._build())
+                self._key = key
+                self._built_at = time.monotonic()
+                self.builds += 1
+                self._track_removed(self._families)
+            families = list(self._families)
+        removed = CounterMetricFamily(f'{self.namespace}_removed_series',
+                                      'Label sets that disappeared from a metric family', labels=['family'])
+        for name, count in sorted(self._removed.items()):
+            removed.add_metric([name], count)
+        families.append(removed)
+        return iter(families)
+
+    def _track_removed(self, families):
+        current = {}
+        for family in families:
+            current[family.name] = {tuple(sorted(sample.labels.items())) for sample in family.samples}
+        for name, previous in self._labelsets.items():
+            gone = len(previous - current.get(name, set()))
+            if gone:
+                self._removed[name] = self._removed.get(name, 0) + gone
+        self._labelsets = current
@@ -0,0 +1,130 @@
+"""
+Series lifecycle management: bounded cardinality per metric family.
+
+Families labelled by ``pid`` or ``job_id`` gain a label set with every new
+process or job. ``SeriesLimiter`` sits between a build function and its
+family factory and tracks the label sets of every family it sees:
+
+* a label set that was not seen for ``expire_after`` builds is forgotten and
+  counted as expired, which frees its slot;
+* once a family tracks ``max_series`` label sets, samples of a gauge with a
+  new label set are folded into one overflow series, whose label values are
+  all ``__overflow__`` and whose value is the sum of the folded samples.
+  Samples of a counter are dropped instead: which series are folded changes
+  as slots expire, so a summed counter would go down and look like a reset;
+* ``families()`` exposes the tracked, dropped and expired counts per family.
+
+What the limiter keeps is bounded by the number of families times
+``max_series``, however many jobs pass through the node.
+
+    series = SeriesLimiter('poc_exporters', max_series=1000, expire_after=5)
+    families = series.build(collector.families, prometheus_family)
+"""
+import threading
+
+OVERFLOW = '__overflow__'
+
+
+class _LimitedFamily:
+    # Handed to the build function in place of the real family; add_metric() goes through the limiter.
+
+    def __init__(self, limiter, name, family, labels, type):
+        self.limiter = limiter
+        self.name = name  # as given to the factory; prometheus_client strips _total from counters
+        self.family = family
+        self.labels = tuple(labels)
+        self.fold = type != 'counter'
+        self.overflow = None  # sum of the folded samples, or None if nothing was folded
+
+    def __getattr__(self, name):
+        return getattr(self.family, name)
+
+    def add_metric(self, labels, value):
+        if self.limiter._admit(self.name, tuple(labels)):
+            self.family.add_metric(labels, value)
+        elif self.fold:
+            self.overflow = (self.overflow or 0) + value
+
+    def finish(self):
+        if self.overflow is not None:
+            self.family.add_metric([OVERFLOW] * len(self.labels), self.overflow)
+        return self.family
+
+
+class SeriesLimiter:
+    """Caps the label sets of each metric family and expires the ones no longer seen."""
+
+    def __init__(self, namespace, max_series=1000, expire_after=5):
+        """
+        :param namespace: Prefix of the limiter's own metrics.
+        :param max_series: Label sets kept per family before new ones go to the overflow
+                           series (gauges) or are dropped (counters); 0 for no limit.
+        :param expire_after: Builds a label set may be missing before its slot is freed.
+        """
+        self.namespace = namespace
+        self.max_series = max_series
+        self.expire_after = expire_after
+        self.builds = 0
+        self._seen = {}  # family name -> {label values: build in which they were last seen}
+        self._dropped = {}  # family name -> samples folded into the overflow series or dropped
+        self._expired = {}  # family name -> label sets forgotten
+        self._lock = threading.Lock()
+
+    def build(self, build, family):
+        """
+        Runs one build through the limiter.
+
+        :param build: Callable taking a family factory and returning a list of families
+                      built with it.
+        :param family: Family factory taking (name, documentation, labels, type).
+        :return: The families returned by ``build``, with their overflow series added.
+        """
+        def factory(name, documentation, labels, type):
+            return _LimitedFamily(self, name, family(name, documentation, labels, type), labels, type)
+
+        with self._lock:
+            families = [limited.finish() if isinstance(limited, _LimitedFamily) else limited
+                        for limited in build(factory)]
+            self._expire()
+            self.builds += 1
+        return families
+
+    def _admit(self, name, labels):
+        seen = self._seen.setdefault(name, {})
+        if labels in seen or not self.max_series or len(seen) < self.max_series:
+            seen[labels] = self.builds
+            return True
+        self._dropped[name] = self._dropped.get(name, 0) + 1
+        return False
+
+    def _expire(self):
+        oldest = self.builds - self.expire_after
+        for name, seen in self._seen.items():
+            stale = [labels for labels, last in seen.items() if last <= oldest]
+            for labels in stale:
+                del seen[labels]
+            if stale:
+                self._expired[name] = self._expired.get(name, 0) + len(stale)
+
+    def families(self, family):
+        """
+        :param family: Family factory taking (name, documentation, labels, type).
+        :return: The limiter's own families: tracked label sets, dropped samples and
+                 expired label sets per family.
+        """
+        ns = self.namespace
+        tracked = family(f'{ns}_series', 'Label sets of a metric family seen within the expiry window',
+                         ['family'], 'gauge')
+        dropped = family(f'{ns}_series_dropped_total',
+                         'Samples folded into the overflow series or dropped because their family reached the series limit',
+                         ['family'], 'counter')
+        expired = family(f'{ns}_series_expired_total', 'Label sets forgotten after missing from the expiry window',
+                         ['family'], 'counter')
+        with self._lock:
+            for name, seen in sorted(self._seen.items()):
+                tracked.add_metric([name], len(seen))
+            for name, count in sorted(self._dropped.items()):
+                dropped.add_metric([name], count)
+            for name, count in sorted(self._expired.items()):
+                expired.add_metric([name], count)
+        return [tracked, dropped, expired]
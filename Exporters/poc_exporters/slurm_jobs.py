@@ -0,0 +1,251 @@
+"""
+Resolves process IDs to Slurm job IDs by reading the cgroup filesystem directly.
+
+Two strategies are supported:
+
+* ``proc``: read ``/proc/<pid>/cgroup`` for every PID and pick out the ``job_<n>``
+  component of the Slurm cgroup path.
+* ``cgroup``: walk every Slurm job cgroup once and read its ``cgroup.procs`` files,
+  the inverse lookup ``getJobIDFromPID`` performs in ``gpu_io_exporter.go``.
+
+Both cgroup v1 (``<controller>/slurm/uid_<uid>/job_<n>/step_<s>/...``) and cgroup v2
+(``system.slice/slurmstepd.scope/job_<n>/...`` or ``slurm/uid_<uid>/job_<n>/...``)
+layouts are understood. Results are cached by PID and process start time, so a
+recycled PID is never charged to the job that previously owned the number.
+"""
+import glob
+import os
+import re
+
+# Overridable for containers with the host filesystems mounted elsewhere, and for benchmarks.
+PROC_ROOT = os.environ.get('PROC_ROOT', '/proc')
+CGROUP_ROOT = os.environ.get('CGROUP_ROOT', '/sys/fs/cgroup')
+
+# Job cgroup directories relative to CGROUP_ROOT, in lookup order. ``{controller}``
+# is substituted for cgroup v1 hierarchies.
+V2_JOB_GLOBS = (
+    'system.slice/slurmstepd.scope/job_*',
+    'slurm/uid_*/job_*',
+)
+V1_JOB_GLOB = '{controller}/slurm/uid_*/job_*'
+V1_CONTROLLERS = ('cpuacct', 'cpu,cpuacct', 'memory', 'freezer', 'cpuset', 'devices')
+
+_JOB_RE = re.compile(r'/job_(\d+)(?=/|$)')
+
+
+def parse_cgroup_job_id(cgroup_text):
+    """
+    Extracts the Slurm job ID from the contents of a ``/proc/<pid>/cgroup`` file.
+
+    :param cgroup_text: Contents of the cgroup file.
+    :return: Job ID as an integer if the process belongs to a Slurm job, None otherwise.
+    """
+    for line in cgroup_text.splitlines():
+        if 'slurm' not in line:
+            continue
+        match = _JOB_RE.search(line.rsplit(':', 1)[-1])
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def read_start_time(pid, proc_root=PROC_ROOT):
+    """
+    Reads the start time of a process (field 22 of ``/proc/<pid>/stat``, in clock ticks).
+
+    :param pid: Process ID.
+    :param proc_root: Mount point of the proc filesystem.
+    :return: Start time as an integer, or None if the process has exited.
+    """
+    try:
+        with open(os.path.join(proc_root, str(pid), 'stat'), 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces and parentheses, so split after the last ')'.
+    fields = stat[stat.rfind(b')') + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def list_pids(proc_root=PROC_ROOT):
+    """
+    Lists the numeric entries of the proc filesystem.
+
+    :param proc_root: Mount point of the proc filesystem.
+    :return: A list of PIDs as integers.
+    """
+    return [int(entry) for entry in os.listdir(proc_root) if entry.isdigit()]
+
+
+def find_job_cgroups(cgroup_root=CGROUP_ROOT, controllers=V1_CONTROLLERS):
+    """
+    Locates the cgroup directory of every Slurm job on this node.
+
+    The cgroup v2 layouts are tried first; for cgroup v1 the first controller in
+    ``controllers`` that has a Slurm hierarchy is used.
+
+    :param cgroup_root: Mount point of the cgroup filesystem.
+    :param controllers: cgroup v1 controllers to search, in order of preference.
+    :return: A dictionary mapping job IDs (int) to cgroup directory paths.
+    """
+    patterns = list(V2_JOB_GLOBS) + [V1_JOB_GLOB.format(controller=c) for c in controllers]
+    for pattern in patterns:
+        if not os.path.isdir(os.path.join(cgroup_root, pattern.split('/', 1)[0])):
+            continue
+        jobs = {}
+        for path in glob.glob(os.path.join(cgroup_root, pattern)):
+            job_id = os.path.basename(path)[len('job_'):]
+            if job_id.isdigit() and os.path.isdir(path):
+                jobs[int(job_id)] = path
+        if jobs:
+            return jobs
+    return {}
+
+
+def slurm_cgroup_present(cgroup_root=CGROUP_ROOT, controllers=V1_CONTROLLERS):
+    """
+    Checks whether a Slurm cgroup hierarchy exists, even if no jobs are running.
+
+    :param cgroup_root: Mount point of the cgroup filesystem.
+    :param controllers: cgroup v1 controllers to search.
+    :return: True if one of the known Slurm hierarchies exists.
+    """
+    bases = ['system.slice/slurmstepd.scope', 'slurm'] + [f'{c}/slurm' for c in controllers]
+    return any(os.path.isdir(os.path.join(cgroup_root, base)) for base in bases)
+
+
+def read_job_pids(job_path):
+    """
+    Collects every PID in a job cgroup, including those in step and task sub-cgroups.
+
+    :param job_path: Path of the job cgroup directory.
+    :return: A list of PIDs as integers.
+    """
+    pids = []
+    for dirpath, _, filenames in os.walk(job_path):
+        if 'cgroup.procs' not in filenames:
+            continue
+        try:
+            with open(os.path.join(dirpath, 'cgroup.procs'), 'r') as f:
+                pids.extend(int(line) for line in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return pids
+
+
+class JobResolver:
+    """
+    Maps PIDs to Slurm job IDs, caching each answer by (PID, start time).
+
+    A single instance is meant to live for the lifetime of an exporter so that
+    repeated scrapes only read the cgroup file of processes it has not seen before.
+    """
+
+    def __init__(self, proc_root=PROC_ROOT, cgroup_root=CGROUP_ROOT, mode='auto'):
+        """
+        :param proc_root: Mount point of the proc filesystem.
+        :param cgroup_root: Mount point of the cgroup filesystem.
+        :param mode: ``proc``, ``cgroup`` or ``auto`` (``cgroup`` when a Slurm
+                     hierarchy exists, ``proc`` otherwise).
+        """
+        if mode not in ('auto', 'proc', 'cgroup'):
+            raise ValueError(f"Unknown resolver mode: {mode}")
+        self.proc_root = proc_root
+        self.cgroup_root = cgroup_root
+        self.mode = mode
+        self._cache = {}  # pid -> (start_time, job_id)
+        # job_id -> cgroup path found by the last resolve_all() in cgroup mode, for
+        # collectors that read per-job files in the same pass; None in proc mode.
+        self.job_cgroups = None
+
+    def job_id(self, pid):
+        """
+        Returns the job ID for a single PID.
+
+        :param pid: Process ID (int or numeric string).
+        :return: Job ID as an integer if found, None otherwise.
+        """
+        pid = int(pid)
+        start_time = read_start_time(pid, self.proc_root)
+        if start_time is None:
+            self._cache.pop(pid, None)
+            return None
+        cached = self._cache.get(pid)
+        if cached is not None and cached[0] == start_time:
+            return cached[1]
+        try:
+            with open(os.path.join(self.proc_root, str(pid), 'cgroup'), 'r') as f:
+                job_id = parse_cgroup_job_id(f.read())
+        except OSError:
+            return None
+        self._cache[pid] = (start_time, job_id)
+        return job_id
+
+    def resolve_all(self):
+        """
+        Resolves every process on the node that belongs to a Slurm job.
+
+        :return: A dictionary mapping PIDs (int) to job IDs (int).
+        """
+        mode = self.mode
+        if mode == 'auto':
+            mode = 'cgroup' if slurm_cgroup_present(self.cgroup_root) else 'proc'
+        if mode == 'cgroup':
+            return self._resolve_from_cgroups()
+        self.job_cgroups = None
+        return self._resolve_from_proc()
+
+    def _resolve_from_proc(self):
+        live = list_pids(self.proc_root)
+        self.prune(live)
+        pid_to_job = {}
+        for pid in live:
+            job_id = self.job_id(pid)
+            if job_id is not None:
+                pid_to_job[pid] = job_id
+        return pid_to_job
+
+    def _resolve_from_cgroups(self):
+        pid_to_job = {}
+        self.job_cgroups = find_job_cgroups(self.cgroup_root)
+        for job_id, path in self.job_cgroups.items():
+            for pid in read_job_pids(path):
+                pid_to_job[pid] = job_id
+        # cgroup.procs is authoritative at read time, so it replaces the cache.
+        cache = {}
+        for pid, job_id in pid_to_job.items():
+            start_time = read_start_time(pid, self.proc_root)
+            if start_time is not None:
+                cache[pid] = (start_time, job_id)
+        self._cache = cache
+        return pid_to_job
+
+    def prune(self, live_pids):
+        """
+        Drops cache entries for processes that no longer exist.
+
+        :param live_pids: Iterable of PIDs currently present on the node.
+        """
+        live = set(live_pids)
+        for pid in [pid for pid in self._cache if pid not in live]:
+            del self._cache[pid]
+
+
+_default_resolver = None
+
+
+def get_job_id_from_pid(pid):
+    """
+    Extracts the job ID for a given process ID (PID) from its cgroup membership,
+    using a process-wide cached resolver.
+
+    :param pid: Process ID for which to find the job ID.
+    :return: Job ID as an integer if found, None otherwise.
+    """
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = JobResolver()
+    return _default_resolver.job_id(pid)
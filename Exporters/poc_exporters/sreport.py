@@ -0,0 +1,207 @@
+"""
+Slurm accounting queries through ``sreport``, with a cluster-wide result cache.
+
+Every node that runs an exporter asks slurmdbd the same cluster-wide question,
+so results are cached as JSON files in a directory shared by the nodes (e.g.
+on NFS), keyed by (report, start, end, extra arguments) and kept for a TTL.
+When the cache is stale, the node that wins a ``lockf`` lock on the entry's
+lock file runs ``sreport`` and rewrites the entry atomically. The other nodes
+wait for that node to finish and read its result instead of querying
+slurmdbd themselves. If the leader's ``sreport`` fails, the failure is recorded
+in the entry: for ``retry_interval`` seconds every node returns the last
+result (or the error, if there is none) without running ``sreport`` again.
+
+The cache only spans nodes if ``SREPORT_CACHE_DIR`` points at shared storage.
+Without it, results are cached in a node-local directory and every node
+queries slurmdbd; a warning says so on the first query.
+
+Output is requested with ``--parsable2`` and parsed in a single pass. Tests
+can put a stub ``sreport`` script on PATH, since the binary is resolved on
+every call.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from .commands import CommandError, CommandTimeout, default_runner
+
+LOCAL_CACHE_DIR = '/var/tmp/poc_exporters/sreport'  # used when SREPORT_CACHE_DIR is unset
+
+
+class SreportError(Exception):
+    """Raised when sreport cannot be run or its output cannot be parsed."""
+
+
+def parse_parsable(output):
+    """
+    Parses ``sreport --parsable2`` output in one pass. Report title and separator
+    lines (which contain no ``|``) are skipped; the first ``|`` line is the header.
+
+    :param output: sreport stdout as a string.
+    :return: A list of dictionaries keyed by the header's column names.
+    """
+    header = None
+    rows = []
+    for line in output.splitlines():
+        if '|' not in line:
+            continue
+        fields = [field.strip() for field in line.split('|')]
+        if header is None:
+            header = fields
+        else:
+            rows.append(dict(zip(header, fields)))
+    return rows
+
+
+class SreportClient:
+    """Runs sreport queries, sharing results between nodes through a cache directory."""
+
+    def __init__(self, cache_dir=None, ttl=3600, lock_timeout=300, timeout=120, binary='sreport',
+                 runner=None, retry_interval=300):
+        """
+        :param cache_dir: Directory for cached results and lock files; share it between nodes.
+                          Defaults to ``$SREPORT_CACHE_DIR``, else a node-local directory.
+        :param ttl: Seconds a cached result stays fresh.
+        :param lock_timeout: Seconds a follower waits for the leader before giving up.
+        :param timeout: Seconds before a running sreport is killed.
+        :param binary: Name or path of the sreport executable.
+        :param runner: CommandRunner used to run sreport (defaults to the shared one).
+        :param retry_interval: Seconds after a failed sreport run before any node runs it again.
+        """
+        self.shared = bool(cache_dir or os.environ.get('SREPORT_CACHE_DIR'))
+        self.cache_dir = cache_dir or os.environ.get('SREPORT_CACHE_DIR') or LOCAL_CACHE_DIR
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.timeout = timeout
+        self.binary = binary
+        self.runner = runner or default_runner
+        self.retry_interval = retry_interval
+        self._memory = {}
+        # lockf locks are per process, so threads of one process also take this lock.
+        self._thread_lock = threading.Lock()
+        self._ready = False  # the directory is created by the first query, not at import time
+
+    def query(self, report, start=None, end=None, extra=()):
+        """
+        Returns the parsed rows of an sreport report, from the cache when fresh.
+
+        :param report: Report as a sequence, e.g. ``('cluster', 'Utilization')``.
+        :param start: ``start=`` argument (date or relative, e.g. ``-7days``), or None.
+        :param end: ``end=`` argument, or None.
+        :param extra: Further arguments such as ``format=...`` or ``-t Hours``.
+        :return: A list of row dictionaries (see parse_parsable).
+        :raises SreportError: If no fresh or stale result can be obtained.
+        """
+        key = [list(report), start, end, list(extra)]
+        digest = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()[:32]
+        cached = self._memory.get(digest)
+        if cached is not None and self._fresh(cached):
+            return cached['rows']
+        self._prepare()
+        path = os.path.join(self.cache_dir, f'{digest}.json')
+        entry = self._read(path)
+        if entry is not None and self._fresh(entry):
+            self._memory[digest] = entry
+            return entry['rows']
+        if entry is not None and self._failed_recently(entry):
+            return self._stale(entry, report)
+
+        with self._thread_lock, open(os.path.join(self.cache_dir, f'{digest}.lock'), 'a+') as lock:
+            if not self._lock(lock):
+                if entry is not None and entry.get('rows') is not None:
+                    print(f"[WARN] sreport leader did not finish in {self.lock_timeout}s; using stale result.")
+                    return entry['rows']
+                raise SreportError(f"Timed out waiting for another node to run sreport {' '.join(report)}")
+            try:
+                # Another node may have refreshed the entry, or failed to, while we waited for the lock.
+                entry = self._read(path)
+                if (entry is None or not self._fresh(entry)) and not self._failed_recently(entry):
+                    try:
+                        entry = {'key': key, 'fetched_at': time.time(),
+                                 'rows': parse_parsable(self._run(report, start, end, extra))}
+                    except SreportError as e:
+                        # Kept with the previous rows, so followers use them instead of retrying.
+                        entry = dict(entry or {'key': key, 'fetched_at': 0, 'rows': None},
+                                     failed_at=time.time(), error=str(e))
+                    self._write(path, entry)
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+        if 'failed_at' in entry:
+            return self._stale(entry, report)
+        self._memory[digest] = entry
+        return entry['rows']
+
+    def _prepare(self):
+        if self._ready:
+            return
+        if not self.shared:
+            print(f"[WARN] SREPORT_CACHE_DIR is not set; sreport results are cached in {self.cache_dir} "
+                  f"on this node only, so every node queries slurmdbd. Point it at a directory shared by the nodes.")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._ready = True
+
+    def _fresh(self, entry):
+        return time.time() - entry.get('fetched_at', 0) < self.ttl
+
+    def _failed_recently(self, entry):
+        return entry is not None and time.time() - entry.get('failed_at', 0) < self.retry_interval
+
+    @staticmethod
+    def _stale(entry, report):
+        # The last sreport run failed; fall back to the previous result if there is one.
+        if entry.get('rows') is None:
+            raise SreportError(entry.get('error') or f"sreport {' '.join(report)} failed")
+        age = (time.time() - entry['fetched_at']) / 3600
+        print(f"[WARN] sreport {' '.join(report)} failed ({entry.get('error')}); using the result from {age:.1f} h ago.")
+        return entry['rows']
+
+    def _lock(self, lock):
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.lockf(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.5)
+
+    def _run(self, report, start, end, extra):
+        binary = shutil.which(self.binary)
+        if binary is None:
+            raise SreportError(f"`{self.binary}` command not found")
+        cmd = [binary, '--parsable2'] + list(report)
+        if start:
+            cmd.append(f'start={start}')
+        if end:
+            cmd.append(f'end={end}')
+        cmd.extend(extra)
+        try:
+            return self.runner.run(cmd, self.timeout).text
+        except CommandTimeout:
+            raise SreportError(f"sreport timed out after {self.timeout}s: {' '.join(cmd)}")
+        except CommandError as e:
+            raise SreportError(f"Error executing sreport: {e}")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, entry):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.sreport-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
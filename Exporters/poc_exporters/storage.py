@@ -0,0 +1,308 @@
+"""
+Filesystem capacity and quota sampling for shared storage (Lustre/DDN, NFS, ...).
+
+``FilesystemProbe`` calls ``os.statvfs`` on each mount point and reports
+exact byte and inode counts, with no ``df`` output to parse. statvfs on a
+hung network mount can block in the kernel indefinitely, so every call runs
+on its own daemon thread and is abandoned after a timeout. A mount whose
+previous call is still stuck is reported as hung without starting another
+thread, so threads never pile up.
+
+Quota sources are pluggable; each returns ``QuotaUsage`` records:
+
+* ``LfsQuotaSource`` parses ``lfs quota -q`` for given users/groups/projects.
+* ``RepquotaSource`` parses ``repquota -p`` for all users or groups.
+* ``FileQuotaSource`` reads a CSV file; used for tests and for sites that
+  export quotas by other means.
+"""
+import csv
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from .commands import default_runner
+
+
+class StorageTimeout(Exception):
+    """Raised when statvfs on a mount point does not return in time."""
+
+
+@dataclass
+class FilesystemUsage:
+    mount: str
+    total_bytes: int
+    used_bytes: int
+    free_bytes: int
+    avail_bytes: int  # free space available to unprivileged users
+    total_inodes: int
+    used_inodes: int
+    free_inodes: int
+
+    @property
+    def used_percent(self):
+        # Same definition as df: reserved blocks count as neither used nor available.
+        usable = self.used_bytes + self.avail_bytes
+        return 100.0 * self.used_bytes / usable if usable else 0.0
+
+    @classmethod
+    def from_statvfs(cls, mount, st):
+        fragment = st.f_frsize or st.f_bsize
+        total = st.f_blocks * fragment
+        free = st.f_bfree * fragment
+        return cls(mount, total, total - free, free, st.f_bavail * fragment,
+                   st.f_files, st.f_files - st.f_ffree, st.f_ffree)
+
+
+class FilesystemProbe:
+    """statvfs on a list of mount points, each call bounded by a timeout."""
+
+    def __init__(self, timeout=10.0, statvfs=os.statvfs):
+        """
+        :param timeout: Seconds to wait for statvfs before the mount is reported as hung.
+        :param statvfs: statvfs implementation (replaceable in tests).
+        """
+        self.timeout = timeout
+        self.statvfs = statvfs
+        self._pending = {}  # mount -> thread of a call that has not returned yet
+        self._lock = threading.Lock()
+
+    def usage_many(self, mounts):
+        """
+        Samples several mount points concurrently.
+
+        :param mounts: Iterable of mount point paths.
+        :return: A dictionary mapping each mount to a FilesystemUsage, or to the
+                 exception (OSError or StorageTimeout) raised for it.
+        """
+        results = {}
+        threads = {}
+        with self._lock:
+            for mount in mounts:
+                stuck = self._pending.get(mount)
+                if stuck is not None and stuck.is_alive():
+                    results[mount] = StorageTimeout(f"statvfs({mount}) from an earlier sample is still hung")
+                    continue
+                thread = threading.Thread(target=self._call, args=(mount, results),
+                                          name=f'statvfs-{mount}', daemon=True)
+                self._pending[mount] = threads[mount] = thread
+                thread.start()
+        deadline = time.monotonic() + self.timeout
+        for mount, thread in threads.items():
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                results.setdefault(mount, StorageTimeout(f"statvfs({mount}) did not return within {self.timeout}s"))
+            else:
+                with self._lock:
+                    self._pending.pop(mount, None)
+        return results
+
+    def usage(self, mount):
+        """
+        :param mount: Mount point path.
+        :return: FilesystemUsage.
+        :raises StorageTimeout: If statvfs hangs.
+        :raises OSError: If statvfs fails.
+        """
+        result = self.usage_many([mount])[mount]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _call(self, mount, results):
+        try:
+            value = FilesystemUsage.from_statvfs(mount, self.statvfs(mount))
+        except OSError as e:
+            value = e
+        # Writes after the caller timed out are harmless: the caller has already
+        # stored StorageTimeout for this mount and returned.
+        results.setdefault(mount, value)
+
+
+@dataclass
+class QuotaUsage:
+    mount: str
+    kind: str  # user, group or project
+    name: str
+    used_bytes: int
+    limit_bytes: int  # hard limit; 0 when unlimited
+    used_inodes: int
+    limit_inodes: int
+
+
+class QuotaSource:
+    """Base class for quota sources."""
+
+    def collect(self):
+        """
+        :return: A list of QuotaUsage records.
+        """
+        raise NotImplementedError
+
+
+def _kib(value):
+    # lfs quota and repquota print KiB, with a trailing '*' once a limit is exceeded.
+    return int(value.rstrip('*')) * 1024
+
+
+def _count(value):
+    value = value.rstrip('*')
+    multipliers = {'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9}
+    if value and value[-1].lower() in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1].lower()])
+    return int(value)
+
+
+def parse_lfs_quota(output, mount, kind, name):
+    """
+    Parses ``lfs quota -q`` output for one user, group or project.
+
+    :param output: Command output (``<fs> used quota limit grace files quota limit grace``;
+                   a long filesystem name may sit on its own line).
+    :return: QuotaUsage, or None if the output holds no figures.
+    """
+    tokens = output.split()
+    for position, token in enumerate(tokens):
+        if token.rstrip('/') != mount.rstrip('/'):
+            continue
+        fields = tokens[position + 1:position + 9]
+        if len(fields) < 7:
+            return None
+        try:
+            # Grace columns are '-' or a duration; block figures are KiB.
+            return QuotaUsage(mount, kind, name, _kib(fields[0]), _kib(fields[2]),
+                              _count(fields[4]), _count(fields[6]))
+        except ValueError:
+            return None
+    return None
+
+
+class LfsQuotaSource(QuotaSource):
+    """Quotas of named users, groups and projects on a Lustre mount, via ``lfs quota``."""
+
+    FLAGS = {'user': '-u', 'group': '-g', 'project': '-p'}
+
+    def __init__(self, mount, users=(), groups=(), projects=(), binary='lfs', timeout=30, runner=None):
+        """
+        :param mount: Lustre mount point.
+        :param users: User names to report.
+        :param groups: Group names to report.
+        :param projects: Project IDs to report.
+        :param binary: Name or path of the lfs executable.
+        :param timeout: Seconds before one lfs call is killed.
+        :param runner: CommandRunner (defaults to the shared one).
+        """
+        self.mount = mount
+        self.targets = ([('user', u) for u in users] + [('group', g) for g in groups]
+                        + [('project', str(p)) for p in projects])
+        self.binary = binary
+        self.timeout = timeout
+        self.runner = runner or default_runner
+
+    def collect(self):
+        results = self.runner.run_many(
+            {(kind, name): [self.binary, 'quota', '-q', self.FLAGS[kind], name, self.mount]
+             for kind, name in self.targets}, timeout=self.timeout)
+        quotas = []
+        for (kind, name), result in results.items():
+            if isinstance(result, Exception):
+                print(f"[WARN] lfs quota for {kind} {name} failed: {result}")
+                continue
+            usage = parse_lfs_quota(result.text, self.mount, kind, name)
+            if usage is not None:
+                quotas.append(usage)
+        return quotas
+
+
+def parse_repquota(output, mount, kind):
+    """
+    Parses ``repquota -p`` output (grace periods printed as numbers).
+
+    :param output: Command output; rows after the ``----`` separator are
+                   ``name flags used soft hard grace files soft hard grace``.
+    :return: A list of QuotaUsage records.
+    """
+    quotas = []
+    in_table = False
+    for line in output.splitlines():
+        if line.startswith('-----'):
+            in_table = True
+            continue
+        parts = line.split()
+        if not in_table or len(parts) < 10:
+            in_table = in_table and bool(parts)
+            continue
+        try:
+            quotas.append(QuotaUsage(mount, kind, parts[0].lstrip('#'), _kib(parts[2]), _kib(parts[4]),
+                                     _count(parts[6]), _count(parts[8])))
+        except ValueError:
+            continue
+    return quotas
+
+
+class RepquotaSource(QuotaSource):
+    """Quotas of every user or group on a filesystem with Linux quotas, via ``repquota``."""
+
+    def __init__(self, mount, kind='user', binary='repquota', timeout=30, runner=None):
+        """
+        :param mount: Mount point.
+        :param kind: ``user`` or ``group``.
+        :param binary: Name or path of the repquota executable.
+        :param timeout: Seconds before repquota is killed.
+        :param runner: CommandRunner (defaults to the shared one).
+        """
+        self.mount = mount
+        self.kind = kind
+        self.binary = binary
+        self.timeout = timeout
+        self.runner = runner or default_runner
+
+    def collect(self):
+        flag = '-g' if self.kind == 'group' else '-u'
+        result = self.runner.run([self.binary, '-p', flag, self.mount], self.timeout)
+        return parse_repquota(result.text, self.mount, self.kind)
+
+
+class FileQuotaSource(QuotaSource):
+    """
+    Quotas read from a CSV file with the header
+    ``mount,kind,name,used_bytes,limit_bytes,used_inodes,limit_inodes``.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: CSV file path.
+        """
+        self.path = path
+
+    def collect(self):
+        with open(self.path, 'r', newline='') as f:
+            return [QuotaUsage(row['mount'], row['kind'], row['name'], int(row['used_bytes']),
+                               int(row['limit_bytes']), int(row['used_inodes']), int(row['limit_inodes']))
+                    for row in csv.DictReader(f)]
+
+
+def open_quota_source(spec, mount, users=(), groups=(), projects=()):
+    """
+    Builds a quota source from a configuration string.
+
+    :param spec: ``lfs``, ``repquota``, ``repquota:group``, ``file:<path>``, or empty for none.
+    :param mount: Mount point the source reports on (unused for ``file``).
+    :param users: Users to report (``lfs`` only).
+    :param groups: Groups to report (``lfs`` only).
+    :param projects: Projects to report (``lfs`` only).
+    :return: A QuotaSource, or None if ``spec`` is empty.
+    """
+    if not spec:
+        return None
+    name, _, argument = spec.partition(':')
+    if name == 'lfs':
+        if not (users or groups or projects):
+            print("[WARN] The lfs quota source has no users, groups or projects to report "
+                  "(STORAGE_QUOTA_USERS, STORAGE_QUOTA_GROUPS, STORAGE_QUOTA_PROJECTS).")
+        return LfsQuotaSource(mount, users, groups, projects)
+    if name == 'repquota':
+        return RepquotaSource(mount, argument or 'user')
+    if name == 'file':
+        return FileQuotaSource(argument)
+    raise ValueError(f"Unknown quota source: {spec}")
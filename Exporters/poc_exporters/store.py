@@ -0,0 +1,372 @@
+"""
+SQLite storage layer for the utilization database used by monitoring.py.
+
+The store owns a single writer connection in WAL mode. Collectors never touch
+it directly: they ``put()`` rows onto an in-memory queue and one writer thread
+flushes the queue with ``executemany`` in a single transaction once either the
+batch size or the flush interval is reached. Readers get their own read-only
+connection per thread, so scrapes never share a cursor with the writer.
+"""
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .instrumentation import Histogram
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS gpu_utilization_raw (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        account TEXT,
+        utilization_percent REAL,
+        samples INTEGER NOT NULL DEFAULT 1
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS gpu_utilization_aggregate (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date DATE,
+        period TEXT,
+        account TEXT,
+        average_utilization REAL
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS storage_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date DATE DEFAULT CURRENT_DATE,
+        usage_gb REAL,
+        usage_percent REAL,
+        timestamp TIMESTAMP,
+        mount TEXT,
+        total_bytes INTEGER,
+        used_bytes INTEGER,
+        avail_bytes INTEGER,
+        total_inodes INTEGER,
+        used_inodes INTEGER
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS storage_quota (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TIMESTAMP,
+        mount TEXT,
+        kind TEXT,
+        name TEXT,
+        used_bytes INTEGER,
+        limit_bytes INTEGER,
+        used_inodes INTEGER,
+        limit_inodes INTEGER
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS cpu_utilization (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        period TEXT,
+        account TEXT,
+        cpu_hours REAL,
+        gpu_hours REAL
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS gpu_utilization_rollup (
+        tier TEXT,
+        bucket TIMESTAMP,
+        account TEXT,
+        samples INTEGER,
+        sum_utilization REAL,
+        min_utilization REAL,
+        max_utilization REAL,
+        UNIQUE (tier, bucket, account)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS maintenance_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_gpu_raw_timestamp_account ON gpu_utilization_raw (timestamp, account)",
+    "CREATE INDEX IF NOT EXISTS idx_gpu_aggregate_period_date ON gpu_utilization_aggregate (period, date, account)",
+    "CREATE INDEX IF NOT EXISTS idx_cpu_period_account ON cpu_utilization (period, account)",
+    "CREATE INDEX IF NOT EXISTS idx_storage_date_mount ON storage_usage (date, mount)",
+    "CREATE INDEX IF NOT EXISTS idx_quota_timestamp ON storage_quota (timestamp)",
+)
+
+# Columns added to existing tables after their first release, as (table, column, type).
+# Databases created by older versions get them via ALTER TABLE before SCHEMA runs. The
+# original storage_usage lacked a comma, so its "usage_percent" column never existed.
+# A gpu_utilization_raw row persisted from the sample ring is the mean of ``samples`` samples.
+ADDED_COLUMNS = (
+    ('gpu_utilization_raw', 'samples', 'INTEGER NOT NULL DEFAULT 1'),
+    ('storage_usage', 'usage_percent', 'REAL'),
+    ('storage_usage', 'timestamp', 'TIMESTAMP'),
+    ('storage_usage', 'mount', 'TEXT'),
+    ('storage_usage', 'total_bytes', 'INTEGER'),
+    ('storage_usage', 'used_bytes', 'INTEGER'),
+    ('storage_usage', 'avail_bytes', 'INTEGER'),
+    ('storage_usage', 'total_inodes', 'INTEGER'),
+    ('storage_usage', 'used_inodes', 'INTEGER'),
+)
+
+# Queued inserts, keyed by the table name passed to put()/put_many().
+INSERTS = {
+    'gpu_utilization_raw':
+        "INSERT INTO gpu_utilization_raw (timestamp, account, utilization_percent, samples) VALUES (?, ?, ?, ?)",
+    'cpu_utilization':
+        "INSERT INTO cpu_utilization (period, account, cpu_hours, gpu_hours) VALUES (?, ?, ?, ?)",
+    'storage_usage':
+        """INSERT INTO storage_usage (timestamp, date, mount, usage_gb, usage_percent, total_bytes, used_bytes,
+                                      avail_bytes, total_inodes, used_inodes)
+           VALUES (?, DATE(?), ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'storage_quota':
+        """INSERT INTO storage_quota (timestamp, mount, kind, name, used_bytes, limit_bytes, used_inodes, limit_inodes)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+}
+
+STATE_UPSERT = """
+    INSERT INTO maintenance_state (key, value) VALUES (?, ?)
+    ON CONFLICT (key) DO UPDATE SET value = excluded.value
+"""
+
+_STOP = object()
+_FLUSH = object()
+
+
+class UtilizationStore:
+    """Owns the utilization database: a queued batch writer plus per-thread read-only readers."""
+
+    def __init__(self, path, batch_size=500, flush_interval=5.0, schema=SCHEMA, inserts=None,
+                 added_columns=ADDED_COLUMNS):
+        """
+        :param path: Path of the SQLite database file.
+        :param batch_size: Number of queued rows that triggers a flush.
+        :param flush_interval: Maximum number of seconds a queued row waits before being flushed.
+        :param schema: CREATE statements run when the store is opened.
+        :param inserts: Mapping of table name to INSERT statement accepted by put(); defaults to INSERTS.
+        :param added_columns: (table, column, type) triples added to existing tables that lack them.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.inserts = dict(INSERTS if inserts is None else inserts)
+        self._queue = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._flushed = threading.Condition()
+        self._flush_requests = 0
+        self._flush_generation = 0
+        self.write_latency = Histogram()  # seconds per batch, including retries
+        self.rows_written = 0
+        self.rows_dropped = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._write_lock:
+            self._conn.execute("BEGIN")
+            for table, column, column_type in added_columns:
+                existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                if existing and column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            for statement in schema:
+                self._conn.execute(statement)
+            self._conn.execute("COMMIT")
+
+        self._writer = threading.Thread(target=self._run_writer, name='sqlite-writer', daemon=True)
+        self._writer.start()
+
+    # ----- writes -----
+
+    def put(self, table, row):
+        """
+        Queues one row for insertion.
+
+        :param table: Table name; must be a key of ``inserts``.
+        :param row: Tuple of values in the order of the table's INSERT statement.
+        """
+        if table not in self.inserts:
+            raise KeyError(f"No queued insert registered for table {table}")
+        self._queue.put((table, row))
+
+    def put_many(self, table, rows):
+        """
+        Queues several rows for the same table.
+
+        :param table: Table name; must be a key of ``inserts``.
+        :param rows: Iterable of row tuples.
+        """
+        for row in rows:
+            self.put(table, row)
+
+    def queue_depth(self):
+        """
+        :return: Approximate number of rows waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every row queued before this call has been written.
+
+        :param timeout: Maximum number of seconds to wait, or None to wait indefinitely.
+        :return: True if the flush completed, False on timeout.
+        """
+        with self._flushed:
+            self._flush_requests += 1
+            target = self._flush_requests
+            self._queue.put(_FLUSH)
+            return self._flushed.wait_for(lambda: self._flush_generation >= target, timeout)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Flushes queued rows, then yields the writer connection inside a single
+        transaction that is committed on exit or rolled back on error.
+
+        :return: Context manager yielding a sqlite3.Connection.
+        """
+        self.flush()
+        with self._write_lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def execute(self, sql, params=(), transaction=True):
+        """
+        Runs a write statement (e.g. an aggregation) on the writer connection,
+        after flushing queued rows so it sees them.
+
+        :param sql: SQL statement.
+        :param params: Statement parameters.
+        :param transaction: Wrap the statement in its own transaction; pass False for
+                            statements that cannot run inside one, such as VACUUM.
+        :return: Number of rows changed.
+        """
+        if transaction:
+            with self.transaction() as conn:
+                return conn.execute(sql, params).rowcount
+        self.flush()
+        with self._write_lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def _run_writer(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._write_batch(pending)
+                self._mark_flushed()
+                return
+            if item is not None and item is not _FLUSH:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) < self.batch_size:
+                    continue
+            self._write_batch(pending)
+            pending = []
+            deadline = None
+            if item is _FLUSH:
+                self._mark_flushed()
+
+    def _mark_flushed(self):
+        with self._flushed:
+            self._flush_generation += 1
+            self._flushed.notify_all()
+
+    def _write_batch(self, pending):
+        if not pending:
+            return
+        by_table = {}
+        for table, row in pending:
+            by_table.setdefault(table, []).append(row)
+        started = time.monotonic()
+        with self._write_lock:
+            dropped = self._insert_tables(by_table)
+        self.write_latency.observe(time.monotonic() - started)
+        self.rows_written += len(pending) - dropped
+        self.rows_dropped += dropped
+
+    def _insert_tables(self, by_table):
+        # Returns the number of rows dropped.
+        try:
+            self._conn.execute("BEGIN")
+            for table, rows in by_table.items():
+                self._conn.executemany(self.inserts[table], rows)
+            self._conn.execute("COMMIT")
+            return 0
+        except sqlite3.Error as e:
+            self._conn.execute("ROLLBACK")
+            print(f"[WARN] Batch write failed ({e}); retrying table by table.")
+        # Isolate the failing table so one bad batch does not drop the others.
+        dropped = 0
+        for table, rows in by_table.items():
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(self.inserts[table], rows)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                print(f"[ERROR] Dropped {len(rows)} rows for {table}: {e}")
+                dropped += len(rows)
+        return dropped
+
+    # ----- reads -----
+
+    def reader(self):
+        """
+        Returns this thread's read-only connection, opening it on first use.
+
+        :return: A sqlite3.Connection opened with ``mode=ro``.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f'{pathlib.Path(self.path).resolve().as_uri()}?mode=ro', uri=True)
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql, params=()):
+        """
+        Runs a read-only query on this thread's reader connection.
+
+        :param sql: SQL statement.
+        :param params: Statement parameters.
+        :return: A list of result rows.
+        """
+        return self.reader().execute(sql, params).fetchall()
+
+    def get_state(self, key):
+        """
+        :param key: Key in the maintenance_state table.
+        :return: The stored string value, or None.
+        """
+        rows = self.query("SELECT value FROM maintenance_state WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_state(self, key, value):
+        """
+        Stores a string value in the maintenance_state table.
+
+        :param key: Key to set.
+        :param value: String value.
+        """
+        self.execute(STATE_UPSERT, (key, value))
+
+    def close(self):
+        """Flushes queued rows, stops the writer thread and closes the writer connection."""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        with self._write_lock:
+            self._conn.close()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
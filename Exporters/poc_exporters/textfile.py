@@ -0,0 +1,163 @@
+"""
+Writer for node_exporter's textfile collector.
+
+Metric families are rendered into one buffer in the Prometheus text format,
+with escaped label values and a single HELP/TYPE header per family. The
+buffer is written to a temporary file in the target directory and renamed
+over the ``.prom`` file, so node_exporter never reads a half-written file.
+When the rendered content hashes the same as what is already on disk,
+nothing is written at all.
+
+``MetricFamily.add_metric`` takes the same arguments as prometheus_client's
+metric families, so the same collection code can feed either output.
+"""
+import hashlib
+import math
+import os
+import tempfile
+
+
+def escape_label_value(value):
+    """
+    :param value: A label value; converted to a string.
+    :return: The value with backslashes, double quotes and newlines escaped.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def escape_help(text):
+    """
+    :param text: HELP text.
+    :return: The text with backslashes and newlines escaped.
+    """
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def format_value(value):
+    """
+    :param value: A sample value (int, float, or a numeric string).
+    :return: The value as written in the text format (``NaN``, ``+Inf`` and ``-Inf`` included).
+    """
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            value = float(value)
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class MetricFamily:
+    """A metric name with its HELP/TYPE header and labelled samples."""
+
+    def __init__(self, name, documentation, labels=(), type='gauge'):
+        """
+        :param name: Metric name (for counters, including the ``_total`` suffix).
+        :param documentation: HELP text.
+        :param labels: Label names, in the order add_metric() receives their values.
+        :param type: ``gauge``, ``counter`` or ``untyped``.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.type = type
+        self.samples = []
+
+    def add_metric(self, labels, value):
+        """
+        Adds one sample.
+
+        :param labels: Label values, in the order of the family's label names.
+        :param value: Sample value.
+        """
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {list(labels)}")
+        self.samples.append((tuple(labels), value))
+
+    def render(self):
+        """
+        :return: The family in the Prometheus text format, ending with a newline.
+        """
+        lines = [f'# HELP {self.name} {escape_help(self.documentation)}', f'# TYPE {self.name} {self.type}']
+        for values, value in self.samples:
+            if values:
+                pairs = ','.join(f'{label}="{escape_label_value(v)}"' for label, v in zip(self.labels, values))
+                lines.append(f'{self.name}{{{pairs}}} {format_value(value)}')
+            else:
+                lines.append(f'{self.name} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def render(families):
+    """
+    :param families: Iterable of MetricFamily.
+    :return: The exposition text of all families, in order.
+    """
+    return ''.join(family.render() for family in families)
+
+
+class TextfileWriter:
+    """Atomically replaces one ``.prom`` file, skipping writes that would not change it."""
+
+    def __init__(self, path, mode=0o644):
+        """
+        :param path: Target file, normally in node_exporter's textfile collector directory.
+        :param mode: Permissions of the written file (node_exporter usually runs as another user).
+        """
+        self.path = path
+        self.mode = mode
+        self._digest = None  # hash of the content last written or found on disk
+
+    def write(self, families):
+        """
+        Renders ``families`` and writes them if the content differs from the current file.
+
+        :param families: Iterable of MetricFamily.
+        :return: True if the file was rewritten, False if it was already up to date.
+        """
+        return self.write_text(render(families))
+
+    def write_text(self, text):
+        """
+        Writes pre-rendered exposition text, with the same atomicity and change detection as write().
+
+        :param text: Exposition text.
+        :return: True if the file was rewritten.
+        """
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).digest()
+        if self._digest is None:
+            self._digest = self._digest_on_disk()
+        if digest == self._digest:
+            return False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # Same directory as the target: rename is only atomic within one filesystem, and
+        # node_exporter ignores the temp file because it does not end in ``.prom``.
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp, self.mode)
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self._digest = digest
+        return True
+
+    def _digest_on_disk(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return hashlib.sha256(f.read()).digest()
+        except OSError:
+            return b''
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+# The tests import poc_exporters and the top-level scripts (monitoring.py, ...) from Exporters/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeNode:
+    """A /proc and cgroup tree in a temporary directory."""
+
+    def __init__(self, root):
+        self.proc_root = str(root / 'proc')
+        self.cgroup_root = str(root / 'cgroup')
+        os.makedirs(self.proc_root)
+        os.makedirs(self.cgroup_root)
+
+    def process(self, pid, start_time, cgroup='0::/user.slice', io=None):
+        """Adds /proc/<pid> with a stat, a cgroup file and optionally an io file of (read, write) bytes."""
+        directory = os.path.join(self.proc_root, str(pid))
+        os.makedirs(directory, exist_ok=True)
+        fields = ['S'] + ['0'] * 18 + [str(start_time)] + ['0'] * 10
+        self.write(os.path.join(directory, 'stat'), f"{pid} (python3 (worker)) {' '.join(fields)}\n")
+        self.write(os.path.join(directory, 'cgroup'), cgroup + '\n')
+        if io is not None:
+            self.write(os.path.join(directory, 'io'), f'rchar: 1\nwchar: 2\nread_bytes: {io[0]}\nwrite_bytes: {io[1]}\n')
+
+    def exit(self, pid):
+        directory = os.path.join(self.proc_root, str(pid))
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    def cgroup(self, path, pids=(), **files):
+        """Adds a cgroup directory with its cgroup.procs and other files (dots in names as __)."""
+        directory = os.path.join(self.cgroup_root, path)
+        os.makedirs(directory, exist_ok=True)
+        self.write(os.path.join(directory, 'cgroup.procs'), ''.join(f'{pid}\n' for pid in pids))
+        for name, text in files.items():
+            self.write(os.path.join(directory, name.replace('__', '.')), text)
+        return directory
+
+    @staticmethod
+    def write(path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+@pytest.fixture
+def fake_node(tmp_path):
+    return FakeNode(tmp_path)
@@ -0,0 +1,104 @@
+import pytest
+
+from poc_exporters.accounting import GpuAccounting
+from poc_exporters.gpu import FakeSampler, GpuSample, ProcessSample
+from poc_exporters.job_metadata import JobMetadata
+from poc_exporters.textfile import MetricFamily
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def node():
+    clock = Clock()
+    accounting = GpuAccounting(keep_ended=600, max_gap=7200, clock=clock, monotonic=clock)
+    sampler = FakeSampler([GpuSample('GPU-0', 0, utilization=100.0), GpuSample('GPU-1', 1, utilization=50.0)],
+                          [ProcessSample(100, 'GPU-0'), ProcessSample(101, 'GPU-1')])
+
+    def sample(job_ids, metadata, advance=3600.0):
+        clock.now += advance
+        return accounting.update(sampler.snapshot(), {100: 42, 101: 42} if 42 in job_ids else {},
+                                 job_ids, metadata)
+
+    return accounting, sample
+
+
+META = {42: JobMetadata(42, user='alice', account='physics', gpu_count=2, gpu_indices=(0, 1))}
+
+
+def account_hours(accounting):
+    families = {family.name: family for family in accounting.families(MetricFamily)}
+    return ({labels[0]: value for labels, value in families['gpu_account_allocated_hours_total'].samples},
+            {labels[0]: value for labels, value in families['gpu_account_used_hours_total'].samples})
+
+
+def test_allocated_and_used_hours(node):
+    accounting, sample = node
+    sample([42], META, advance=0)
+    assert sample([42], META) == {0: 42, 1: 42}
+    assert account_hours(accounting) == ({'physics': 2.0}, {'physics': 1.5})
+    job = accounting.jobs[42]
+    assert (job.allocated_seconds, job.used_seconds) == (7200.0, 5400.0)
+
+
+def test_hours_before_metadata_go_to_the_real_account(node):
+    accounting, sample = node
+    sample([42], {}, advance=0)
+    sample([42], {})  # scontrol has not answered yet: the job's processes hold two GPUs
+    assert account_hours(accounting) == ({}, {})
+    sample([42], META)
+    assert account_hours(accounting) == ({'physics': 4.0}, {'physics': 3.0})
+    assert accounting.jobs[42].account == 'physics'
+
+
+def test_job_ending_without_metadata_is_charged_to_unknown(node):
+    accounting, sample = node
+    sample([42], {}, advance=0)
+    sample([42], {})
+    sample([], {})
+    assert account_hours(accounting) == ({'unknown': 2.0}, {'unknown': 1.5})
+
+
+def test_missed_job_keeps_its_totals(node):
+    accounting, sample = node
+    sample([42], META, advance=0)
+    sample([42], META)
+    sample([], {}, advance=60)  # a sample that missed the job cgroup
+    assert accounting.jobs[42].ended == 3660.0
+    sample([42], META, advance=60)
+    job = accounting.jobs[42]
+    assert job.ended is None
+    assert job.allocated_seconds == 7200.0 + 2 * 60
+    assert (accounting.started, accounting.ended) == (1, 1)
+
+
+def test_ended_jobs_are_dropped_after_keep_ended(node):
+    accounting, sample = node
+    sample([42], META, advance=0)
+    sample([], {}, advance=60)
+    sample([], {}, advance=601)
+    assert 42 not in accounting.jobs
+    sample([42], META, advance=60)
+    assert accounting.jobs[42].allocated_seconds == 120.0
+    assert accounting.started == 2
+
+
+def test_job_series_do_not_change_when_metadata_arrives(node):
+    accounting, sample = node
+
+    def job_series():
+        families = {family.name: family for family in accounting.families(MetricFamily)}
+        return ({labels for labels, _ in families['gpu_job_allocated_hours_total'].samples},
+                families['gpu_job_info'].samples)
+
+    sample([42], {}, advance=0)
+    sample([42], {})
+    assert job_series() == ({('42',)}, [])  # no account yet: no info series rather than an unknown one
+    sample([42], META)
+    assert job_series() == ({('42',)}, [(('42', 'physics', 'alice'), 1)])
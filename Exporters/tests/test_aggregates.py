@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import pytest
+
+from poc_exporters.aggregates import RollingWindow, ScrapeWindow, StreamingAggregator, WindowStats
+from poc_exporters.store import UtilizationStore
+
+
+def test_window_stats_and_p95():
+    window = RollingWindow(span=3600, bucket_width=60)
+    for second in range(100):
+        window.add(1000 + second, float(second))
+    stats = window.stats(now=1100)
+    assert (stats.count, stats.total, stats.minimum, stats.maximum) == (100, 4950.0, 0.0, 99.0)
+    assert stats.mean == pytest.approx(49.5)
+    assert stats.p95 == 94.0
+
+
+def test_window_expires_whole_buckets():
+    window = RollingWindow(span=120, bucket_width=60)
+    window.add(0, 10.0)
+    window.add(60, 20.0)
+    window.add(130, 30.0)
+    assert window.stats(now=179).count == 3  # the first bucket ends at 60, after the horizon 179 - 120
+    stats = window.stats(now=180)
+    assert (stats.count, stats.total, stats.minimum) == (2, 50.0, 20.0)
+    assert window.stats(now=1000) == WindowStats(0, 0.0, 0.0, 0.0, 0.0)
+
+
+def test_late_samples_join_their_bucket_or_are_dropped():
+    window = RollingWindow(span=3600, bucket_width=60)
+    window.add(120, 10.0)
+    window.add(180, 20.0)
+    window.add(150, 30.0)  # late, its bucket is open
+    window.add(30, 90.0)  # late, its bucket was never opened
+    stats = window.stats(now=200)
+    assert (stats.count, stats.total, stats.maximum) == (3, 60.0, 30.0)
+
+
+def test_summaries_count_as_their_samples():
+    window = RollingWindow(span=3600, bucket_width=60)
+    window.add(0, 50.0, count=10, total=500.0, minimum=0.0, maximum=100.0)
+    window.add(10, 100.0)
+    stats = window.stats(now=10)
+    assert (stats.count, stats.total, stats.minimum, stats.maximum) == (11, 600.0, 0.0, 100.0)
+
+
+def test_aggregator_forgets_accounts_without_samples():
+    aggregator = StreamingAggregator({'hour': 3600, 'day': 86400}, bucket_width=60)
+    aggregator.add('physics', 50.0, timestamp=0)
+    aggregator.add('chemistry', 20.0, timestamp=80000)
+    assert sorted(aggregator.snapshot('day', now=80000)) == ['chemistry', 'physics']
+    assert sorted(aggregator.snapshot('hour', now=80000)) == ['chemistry']
+    assert sorted(aggregator.snapshot('day', now=90000)) == ['chemistry']
+    assert 'physics' not in aggregator._accounts
+    assert aggregator.version == 2
+
+
+def test_scrape_window_republishes_without_new_rounds():
+    window = ScrapeWindow()
+    window.record({'gpu0': 10.0, 'gpu1': 50.0})
+    window.record({'gpu0': 30.0})
+    first = window.rotate()
+    assert first['gpu0'] == WindowStats(2, 40.0, 10.0, 30.0, None)
+    assert first['gpu1'].count == 1
+    assert window.rotate() == first  # a second scraper right after the first
+
+
+class RecordingStore:
+    def __init__(self, store):
+        self.store = store
+        self.params = []
+
+    def query(self, sql, params=()):
+        self.params.extend(params)
+        return self.store.query(sql, params)
+
+
+def test_seed_from_rollups_and_raw_samples(tmp_path):
+    store = UtilizationStore(str(tmp_path / 'utilization.db'))
+    with store.transaction() as conn:
+        conn.executemany("""
+            INSERT INTO gpu_utilization_rollup
+                (tier, bucket, account, samples, sum_utilization, min_utilization, max_utilization)
+            VALUES ('minute', ?, 'physics', ?, ?, ?, ?)""", [
+            ('2026-10-16 10:00:00', 60, 6000.0, 100.0, 100.0),  # older than the day window
+            ('2026-10-17 10:30:00', 60, 3000.0, 0.0, 100.0),
+            ('2026-10-17 11:40:00', 60, 600.0, 10.0, 10.0),  # after the watermark: replayed from raw instead
+        ])
+    store.put_many('gpu_utilization_raw', [
+        ('2026-10-17 11:29:00', 'physics', 10.0, 1),  # before the watermark: already in the rollup
+        ('2026-10-17 11:45:00', 'physics', 80.0, 3),  # a ring mean of three samples
+    ])
+    store.flush()
+    aggregator = StreamingAggregator({'hour': 3600, 'day': 86400}, bucket_width=60)
+    recording = RecordingStore(store)
+    now = datetime(2026, 10, 17, 12, 0)
+
+    assert aggregator.seed_from_store(recording, raw_since=datetime(2026, 10, 17, 11, 30), now=now) == 2
+    day = aggregator.snapshot('day', now=now.timestamp())['physics']
+    assert (day.count, day.total, day.minimum, day.maximum) == (63, 3240.0, 0.0, 100.0)
+    hour = aggregator.snapshot('hour', now=now.timestamp())['physics']
+    assert (hour.count, hour.total) == (3, 240.0)
+    # Times are bound in the store's text format, not through sqlite3's deprecated datetime adapter.
+    assert recording.params == ['2026-10-16 12:00:00', '2026-10-17 11:30:00', '2026-10-17 11:30:00']
+    store.close()
@@ -0,0 +1,137 @@
+import pytest
+
+from poc_exporters.cgroup_stats import (JobIoCollector, JobResourceCollector, controller_path,
+                                        parse_blkio_service_bytes, parse_io_stat, parse_pressure)
+
+V2_JOB = 'system.slice/slurmstepd.scope/job_{job}'
+V1_JOB = '{controller}/slurm/uid_1000/job_{job}'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('', (0, 0)),
+    ('8:0 rbytes=1024 wbytes=2048 rios=1 wios=2 dbytes=0 dios=0\n', (1024, 2048)),
+    ('8:0 rbytes=1 wbytes=2 rios=1 wios=1\n259:0 rbytes=10 wbytes=20 rios=1 wios=1\n', (11, 22)),
+    ('253:0 rios=1 wios=1\n', (0, 0)),
+])
+def test_parse_io_stat(text, expected):
+    assert parse_io_stat(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('', (0, 0)),
+    ('Total 0\n', (0, 0)),
+    ('8:0 Read 1024\n8:0 Write 2048\n8:0 Sync 3072\n8:0 Async 0\n8:0 Total 3072\nTotal 3072\n', (1024, 2048)),
+    ('8:0 Read 1\n8:0 Write 2\n8:16 Read 10\n8:16 Write 20\nTotal 33\n', (11, 22)),
+])
+def test_parse_blkio_service_bytes(text, expected):
+    assert parse_blkio_service_bytes(text) == expected
+
+
+def test_parse_pressure():
+    text = 'some avg10=0.00 avg60=0.00 avg300=0.00 total=1500\nfull avg10=0.00 avg60=0.00 avg300=0.00 total=500\n'
+    assert parse_pressure(text) == {'some': 1500, 'full': 500}
+
+
+def test_controller_path(fake_node):
+    root = fake_node.cgroup_root
+    v1 = f'{root}/memory/slurm/uid_1000/job_42'
+    assert controller_path(v1, 'blkio', root) == f'{root}/blkio/slurm/uid_1000/job_42'
+    v2 = f'{root}/system.slice/slurmstepd.scope/job_42'
+    assert controller_path(v2, 'blkio', root) == v2
+
+
+def test_io_v2_reads_job_totals_and_per_pid_io(fake_node):
+    job = V2_JOB.format(job=42)
+    fake_node.cgroup(job, io__stat='8:0 rbytes=100 wbytes=200 rios=1 wios=1\n')
+    fake_node.cgroup(f'{job}/step_0/user/task_0', pids=[10, 11])
+    fake_node.cgroup(V2_JOB.format(job=43))  # no io.stat: no totals
+    fake_node.process(10, 1, io=(30, 40))
+    fake_node.process(11, 1)  # no io file (another user's process): skipped
+
+    collector = JobIoCollector(fake_node.cgroup_root, fake_node.proc_root)
+    assert collector.collect() == ({42: (100, 200)}, {})
+    collector.per_pid = True
+    assert collector.collect() == ({42: (100, 200)}, {(42, 10): (30, 40)})
+
+
+def test_io_v1_reads_the_blkio_hierarchy(fake_node):
+    fake_node.cgroup(V1_JOB.format(controller='blkio', job=42),
+                     blkio__throttle__io_service_bytes_recursive='8:0 Read 100\n8:0 Write 200\nTotal 300\n')
+    # Older kernels only have the non-recursive file.
+    fake_node.cgroup(V1_JOB.format(controller='blkio', job=43),
+                     blkio__throttle__io_service_bytes='8:0 Read 1\n8:0 Write 2\nTotal 3\n')
+    collector = JobIoCollector(fake_node.cgroup_root, fake_node.proc_root)
+    assert collector.collect() == ({42: (100, 200), 43: (1, 2)}, {})
+
+    # Paths the resolver found under another controller are mapped to blkio.
+    memory = fake_node.cgroup(V1_JOB.format(controller='memory', job=42), pids=[10])
+    fake_node.process(10, 1, io=(5, 6))
+    collector.per_pid = True
+    assert collector.collect({42: memory}) == ({42: (100, 200)}, {(42, 10): (5, 6)})
+
+
+def test_io_v1_without_blkio_reports_only_processes(fake_node):
+    fake_node.cgroup(V1_JOB.format(controller='memory', job=42), pids=[10])
+    fake_node.process(10, 1, io=(5, 6))
+    assert JobIoCollector(fake_node.cgroup_root, fake_node.proc_root, per_pid=True).collect() == \
+        ({}, {(42, 10): (5, 6)})
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def pressure(total):
+    return f'some avg10=0.00 avg60=0.00 avg300=0.00 total={total}\n'
+
+
+def test_resources_v2_rates_from_two_passes(fake_node):
+    clock = Clock()
+    job = V2_JOB.format(job=42)
+    fake_node.cgroup(job, cpu__stat='usage_usec 1000000\nnr_throttled 0\nthrottled_usec 0\n',
+                     memory__current='1024\n', memory__peak='2048\n', cpu__pressure=pressure(0))
+    collector = JobResourceCollector(fake_node.cgroup_root, clock)
+    first = collector.collect()[42]
+    assert (first.cpu_usage_seconds, first.memory_current_bytes, first.memory_peak_bytes) == (1.0, 1024, 2048)
+    assert first.cpu_percent is None
+
+    clock.now = 10.0
+    fake_node.cgroup(job, cpu__stat='usage_usec 21000000\nnr_throttled 3\nthrottled_usec 1000000\n',
+                     cpu__pressure=pressure(5000000))
+    second = collector.collect()[42]
+    assert second.cpu_percent == pytest.approx(200.0)  # two cores busy
+    assert second.cpu_throttled_percent == pytest.approx(10.0)
+    assert second.cpu_throttled_periods == 3
+    assert second.pressure_percent == {('cpu', 'some'): pytest.approx(50.0)}
+
+
+def test_resources_counter_reset_has_no_rate(fake_node):
+    clock = Clock()
+    job = V2_JOB.format(job=42)
+    fake_node.cgroup(job, cpu__stat='usage_usec 5000000\n')
+    collector = JobResourceCollector(fake_node.cgroup_root, clock)
+    collector.collect()
+    clock.now = 10.0
+    fake_node.cgroup(job, cpu__stat='usage_usec 1000\n')  # job ID reused after a requeue
+    assert collector.collect()[42].cpu_percent is None
+
+
+def test_resources_v1_reads_every_hierarchy(fake_node):
+    clock = Clock()
+    cpuacct = fake_node.cgroup(V1_JOB.format(controller='cpuacct', job=42), cpuacct__usage='1000000000\n')
+    fake_node.cgroup(V1_JOB.format(controller='cpu', job=42), cpu__stat='nr_throttled 2\nthrottled_time 0\n')
+    fake_node.cgroup(V1_JOB.format(controller='memory', job=42), memory__usage_in_bytes='1024\n',
+                     memory__max_usage_in_bytes='4096\n')
+    collector = JobResourceCollector(fake_node.cgroup_root, clock)
+    collector.collect({42: cpuacct})
+    clock.now = 4.0
+    fake_node.cgroup(V1_JOB.format(controller='cpuacct', job=42), cpuacct__usage='3000000000\n')
+    sample = collector.collect({42: cpuacct})[42]
+    assert (sample.cpu_usage_seconds, sample.cpu_percent) == (3.0, pytest.approx(50.0))
+    assert (sample.cpu_throttled_seconds, sample.cpu_throttled_periods) == (0.0, 2)
+    assert (sample.memory_current_bytes, sample.memory_peak_bytes) == (1024, 4096)
+    assert sample.pressure_seconds == {}
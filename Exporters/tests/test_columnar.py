@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+from poc_exporters.columnar import ColumnarExporter, gpu_hours, open_dataset
+from poc_exporters.store import UtilizationStore
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UtilizationStore(str(tmp_path / 'utilization.db'))
+    store.put_many('gpu_utilization_raw', [
+        ('2026-10-16 23:59:30', 'physics', 100.0, 1),
+        ('2026-10-17 10:00:00', 'physics', 50.0, 1),
+        ('2026-10-17 10:00:30', 'chemistry', 20.0, 120),  # a ring mean of an hour of samples
+        ('2026-10-17 10:01:00', 'physics', 0.0, 1),
+    ])
+    store.flush()
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_export_is_incremental(store, tmp_path, format):
+    out = str(tmp_path / 'chargeback')
+    exporter = ColumnarExporter(store, out, format=format, chunk_rows=3)
+    assert exporter.export(['raw']) == {'raw': 4}
+    assert exporter.watermark('raw') == (4,)
+    assert exporter.export(['raw']) == {'raw': 0}  # nothing new since the previous run
+
+    store.put('gpu_utilization_raw', ('2026-10-17 10:01:30', 'physics', 10.0, 1))
+    assert exporter.export(['raw']) == {'raw': 1}
+    table = open_dataset(out, 'raw', format).to_table()
+    assert table.num_rows == 5
+    assert sorted(table.column('date').unique().to_pylist()) == ['2026-10-16', '2026-10-17']
+
+
+def test_gpu_hours_weights_raw_rows_by_their_samples(store, tmp_path):
+    out = str(tmp_path / 'chargeback')
+    ColumnarExporter(store, out).export(['raw'])
+    hours = gpu_hours(out, datetime(2026, 10, 17), datetime(2026, 10, 18), source='raw', sample_interval=30.0)
+    assert hours['chemistry'] == pytest.approx((1.0, 0.2))
+    assert hours['physics'] == pytest.approx((60 / 3600, 0.5 * 30 / 3600))
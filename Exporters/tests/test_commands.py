@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+
+import pytest
+
+from poc_exporters.commands import CommandError, CommandRunner, CommandTimeout
+
+PYTHON = sys.executable
+
+
+def alive(pid):
+    # A killed orphan may stay a zombie until init reaps it; it no longer runs.
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def test_run_many_times_out_one_command_and_kills_its_group(tmp_path):
+    pidfile = tmp_path / 'child.pid'
+    runner = CommandRunner(reap_timeout=2)
+    started = time.monotonic()
+    results = runner.run_many({
+        'fast': [PYTHON, '-c', 'print("ok")'],
+        # A shell whose own child would keep running if only the shell were killed.
+        'hung': (['sh', '-c', f'sleep 30 & echo $! > {pidfile}; wait'], 0.5),
+        'failed': [PYTHON, '-c', 'import sys; sys.exit("no such job")'],
+    }, timeout=10)
+    assert time.monotonic() - started < 5
+    assert results['fast'].text == 'ok\n'
+    assert isinstance(results['hung'], CommandTimeout)
+    assert isinstance(results['failed'], CommandError)
+    assert results['failed'].result.returncode == 1
+    assert 'no such job' in str(results['failed'])
+    deadline = time.monotonic() + 5
+    while alive(int(pidfile.read_text())):
+        assert time.monotonic() < deadline, "the command's child survived the timeout"
+        time.sleep(0.05)
+
+
+def test_stats_per_tool():
+    runner = CommandRunner()
+    runner.run([PYTHON, '-c', 'pass'])
+    assert runner.run([PYTHON, '-c', 'exit(3)'], check=False).returncode == 3
+    with pytest.raises(CommandTimeout):
+        runner.run(['sleep', '5'], timeout=0.2)
+    with pytest.raises(CommandError):
+        runner.run(['/nonexistent/nvidia-smi'])
+    python = runner.stats[os.path.basename(PYTHON)]
+    assert (python.calls, python.failures, python.timeouts) == (2, 1, 0)
+    assert (runner.stats['sleep'].failures, runner.stats['sleep'].timeouts) == (1, 1)
+    assert runner.stats['sleep'].last_duration < 5
+    assert runner.stats['nvidia-smi'].failures == 1
@@ -0,0 +1,180 @@
+import sys
+import types
+
+import pytest
+
+from poc_exporters.commands import CommandResult, CommandTimeout
+from poc_exporters.gpu import (FakeSampler, GpuSample, GpuSamplerError, NvidiaSmiSampler, ProcessSample,
+                               open_sampler)
+
+GIB = 1024 ** 3
+MIB = 1024 ** 2
+
+
+def fake_node():
+    return FakeSampler([GpuSample('GPU-0', 0, 'A100', 90.0, 10 * GIB, 40 * GIB),
+                        GpuSample('GPU-1', 1, 'A100', 0.0, 0, 40 * GIB)],
+                       [ProcessSample(100, 'GPU-0', 4 * GIB), ProcessSample(101, 'GPU-0', 6 * GIB),
+                        ProcessSample(200, 'GPU-1', GIB), ProcessSample(300, 'GPU-9', GIB)])
+
+
+def test_job_usage_sums_the_processes_of_a_job_per_gpu():
+    snapshot = fake_node().snapshot()
+    usage = snapshot.job_usage({100: 42, 101: 42, 200: 43, 300: 44})
+    assert [(entry.gpu.uuid, entry.job_id, entry.pids, entry.used_memory_bytes) for entry in usage] == [
+        ('GPU-0', 42, [100, 101], 10 * GIB),
+        ('GPU-1', 43, [200], GIB),
+    ]
+    assert snapshot.pids() == {100, 101, 200, 300}
+
+
+def test_job_usage_skips_processes_outside_jobs():
+    snapshot = fake_node().snapshot()
+    assert [entry.job_id for entry in snapshot.job_usage({200: 43})] == [43]
+    assert snapshot.job_usage({}) == []
+
+
+def test_fake_sampler_set_replaces_only_what_is_given():
+    sampler = fake_node()
+    sampler.set(processes=[])
+    gpus, processes = sampler.sample()
+    assert [sample.uuid for sample in gpus] == ['GPU-0', 'GPU-1']
+    assert processes == []
+    sampler.set(gpus=[])
+    assert sampler.snapshot().gpus == {}
+
+
+class FakeRunner:
+    def __init__(self, outputs):
+        self.outputs = outputs  # query option -> stdout, or an exception
+        self.calls = 0
+
+    def _result(self, argv):
+        output = self.outputs[argv[1].split('=')[0]]
+        if isinstance(output, Exception):
+            return output
+        return CommandResult(argv, 0, output.encode(), b'', 0.0)
+
+    def run(self, argv, timeout=None):
+        self.calls += 1
+        result = self._result(argv)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run_many(self, commands, timeout=None):
+        self.calls += 1
+        return {key: self._result(argv) for key, argv in commands.items()}
+
+
+GPU_CSV = ("GPU-0, 0, NVIDIA A100-SXM4-40GB, 87, 1024, 40960\n"
+           "GPU-1, 1, NVIDIA A100-SXM4-40GB, [N/A], [N/A], 40960\n"
+           "\n")
+APPS_CSV = ("1234, 512, GPU-0\n"
+            "1235, [N/A], GPU-1\n"
+            "[Not Supported], 1, GPU-1\n")
+
+
+def smi(outputs):
+    # Any executable does for the which() lookup; the runner never starts it.
+    return NvidiaSmiSampler(binary=sys.executable, runner=FakeRunner(outputs))
+
+
+def test_nvidia_smi_parses_csv_and_unavailable_fields():
+    sampler = smi({'--query-gpu': GPU_CSV, '--query-compute-apps': APPS_CSV})
+    gpus, processes = sampler.sample()
+    assert gpus == [GpuSample('GPU-0', 0, 'NVIDIA A100-SXM4-40GB', 87.0, GIB, 40 * GIB),
+                    GpuSample('GPU-1', 1, 'NVIDIA A100-SXM4-40GB', 0.0, 0, 40 * GIB)]
+    assert processes == [ProcessSample(1234, 'GPU-0', 512 * MIB), ProcessSample(1235, 'GPU-1', 0)]
+    assert sampler.runner.calls == 1
+    assert sampler.gpus() == gpus
+    assert sampler.processes() == processes
+
+
+def test_nvidia_smi_failures_raise_sampler_errors():
+    sampler = smi({'--query-gpu': GPU_CSV, '--query-compute-apps': CommandTimeout('nvidia-smi timed out')})
+    with pytest.raises(GpuSamplerError, match='timed out'):
+        sampler.sample()
+    with pytest.raises(GpuSamplerError, match='timed out'):
+        sampler.processes()
+
+
+def test_nvidia_smi_needs_the_binary():
+    with pytest.raises(GpuSamplerError, match='not found'):
+        NvidiaSmiSampler(binary='/nonexistent/nvidia-smi')
+
+
+class FakeNvml(types.ModuleType):
+    class NVMLError(Exception):
+        pass
+
+    def __init__(self, devices, broken=()):
+        super().__init__('pynvml')
+        self.devices = devices  # [(uuid, name, utilization, used, total, [(pid, used memory or None)])]
+        self.broken = broken  # indices of devices whose handle cannot be obtained
+        self.shutdown = False
+
+    def nvmlInit(self):
+        pass
+
+    def nvmlShutdown(self):
+        self.shutdown = True
+
+    def nvmlDeviceGetCount(self):
+        return len(self.devices)
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        if index in self.broken:
+            raise self.NVMLError('GPU is lost')
+        return self.devices[index]
+
+    def nvmlDeviceGetUUID(self, handle):
+        return handle[0].encode()
+
+    def nvmlDeviceGetName(self, handle):
+        return handle[1]
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        return types.SimpleNamespace(gpu=handle[2])
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        return types.SimpleNamespace(used=handle[3], total=handle[4])
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        return [types.SimpleNamespace(pid=pid, usedGpuMemory=used) for pid, used in handle[5]]
+
+
+def test_nvml_sampler_reads_the_open_handles(monkeypatch):
+    nvml = FakeNvml([('GPU-0', 'A100', 75, GIB, 40 * GIB, [(100, GIB), (101, None)])])
+    monkeypatch.setitem(sys.modules, 'pynvml', nvml)
+    with open_sampler('nvml') as sampler:
+        gpus, processes = sampler.sample()
+    assert gpus == [GpuSample('GPU-0', 0, 'A100', 75.0, GIB, 40 * GIB)]
+    assert processes == [ProcessSample(100, 'GPU-0', GIB), ProcessSample(101, 'GPU-0', 0)]
+    assert nvml.shutdown
+
+
+def test_nvml_enumeration_failure_shuts_nvml_down(monkeypatch):
+    nvml = FakeNvml([('GPU-0', 'A100', 75, GIB, 40 * GIB, []), ('GPU-1', 'A100', 0, 0, 40 * GIB, [])], broken={1})
+    monkeypatch.setitem(sys.modules, 'pynvml', nvml)
+    with pytest.raises(GpuSamplerError, match='enumeration failed: GPU is lost'):
+        open_sampler('nvml')
+    assert nvml.shutdown
+
+
+def test_open_sampler_honours_the_backend_setting(monkeypatch):
+    monkeypatch.setenv('GPU_BACKEND', 'fake')
+    assert isinstance(open_sampler(), FakeSampler)
+    with pytest.raises(GpuSamplerError, match='Unknown GPU backend'):
+        open_sampler('cuda')
+
+
+def test_auto_falls_back_to_nvidia_smi_and_reports_every_failure(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, 'pynvml', None)
+    monkeypatch.setenv('PATH', str(tmp_path))
+    with pytest.raises(GpuSamplerError, match='pynvml is not installed.*not found'):
+        open_sampler('auto')
+    stub = tmp_path / 'nvidia-smi'
+    stub.write_text('#!/bin/sh\n')
+    stub.chmod(0o755)
+    assert isinstance(open_sampler('auto'), NvidiaSmiSampler)
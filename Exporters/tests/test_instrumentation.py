@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from poc_exporters.instrumentation import Histogram, Instrumentation
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [('0.1', 2), ('1.0', 3), ('+Inf', 4)]
+    assert (histogram.count, histogram.sum) == (4, pytest.approx(2.65))
+
+
+def test_track_records_duration_and_success():
+    clock = Clock()
+    instrumentation = Instrumentation('test', clock=clock)
+    with instrumentation.track('gpu'):
+        time.sleep(0.02)
+    histogram, errors, last_success, last_duration = instrumentation.snapshot()['gpu']
+    assert histogram.count == 1 and histogram.sum == last_duration >= 0.02
+    assert (errors, last_success) == ({}, 1000.0)
+
+
+def test_failed_runs_count_errors_and_keep_the_last_success():
+    clock = Clock()
+    instrumentation = Instrumentation('test', clock=clock)
+    with instrumentation.track('slurm'):
+        pass
+    clock.now = 1060.0
+    with pytest.raises(TimeoutError):
+        with instrumentation.track('slurm'):
+            raise TimeoutError
+    clock.now = 1120.0
+    with instrumentation.track('slurm'):
+        instrumentation.error('slurm', 'parse')  # handled, but the run is not a success
+    histogram, errors, last_success, _ = instrumentation.snapshot()['slurm']
+    assert histogram.count == 3  # failed runs are timed too
+    assert errors == {'TimeoutError': 1, 'parse': 1}
+    assert last_success == 1000.0
+    clock.now = 1180.0
+    with instrumentation.track('slurm'):
+        pass  # the error of the previous run does not carry over
+    assert instrumentation.snapshot()['slurm'][2] == 1180.0
+
+
+def test_wrap_and_textfile_families():
+    instrumentation = Instrumentation('test', clock=Clock())
+
+    def collect():
+        """Collects."""
+        raise ValueError('bad output')
+
+    wrapped = instrumentation.wrap('sreport', collect)
+    assert (wrapped.__name__, wrapped.__doc__) == ('collect', 'Collects.')
+    with pytest.raises(ValueError):
+        wrapped()
+    duration, errors, success = instrumentation.textfile_families()
+    assert [labels for labels, _ in duration.samples] == [('sreport',)]
+    assert errors.samples == [(('sreport', 'ValueError'), 1)]
+    assert success.samples == []
@@ -0,0 +1,95 @@
+import sys
+
+import pytest
+
+from poc_exporters.commands import CommandResult
+from poc_exporters.job_metadata import JobMetadataIndex, parse_gres, parse_scontrol_job
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('', ('', 0, ())),
+    ('N/A', ('', 0, ())),
+    ('(null)', ('', 0, ())),
+    ('gres/gpu=4', ('', 4, ())),
+    ('gres/gpu:4', ('', 4, ())),
+    ('gres/gpu:a100:4', ('a100', 4, ())),
+    ('gres:gpu:a100:4', ('a100', 4, ())),
+    ('gpu:2(IDX:0-1)', ('', 2, (0, 1))),
+    ('gpu:a100:2(IDX:0,2)', ('a100', 2, (0, 2))),
+    ('gpu:tesla:1(S:0)', ('tesla', 1, ())),
+    ('gpu', ('', 1, ())),
+    ('gpu:a100', ('a100', 1, ())),
+    # Without an explicit count, the index list is the count.
+    ('gpu(IDX:0-1)', ('', 2, (0, 1))),
+    ('gpu:a100(IDX:0-3)', ('a100', 4, (0, 1, 2, 3))),
+    ('gpu:a100(IDX:0,2-3)', ('a100', 3, (0, 2, 3))),
+    ('gpu:a100(IDX:N/A)', ('a100', 1, ())),
+    # Other GRES and several GPU entries.
+    ('gpu:2(IDX:0-1),mps:100', ('', 2, (0, 1))),
+    ('mps:100(IDX:0),gpu:a100:1(IDX:3)', ('a100', 1, (3,))),
+    ('gpu:a100:1(IDX:0),gpu:v100:2(IDX:4-5)', ('a100', 3, (0, 4, 5))),
+    ('mps:100', ('', 0, ())),
+])
+def test_parse_gres(text, expected):
+    assert parse_gres(text) == expected
+
+
+def test_parse_gres_other_name():
+    assert parse_gres('gpu:2(IDX:0-1),mps:100', name='mps') == ('', 100, ())
+
+
+SCONTROL_LINE = ('JobId=42 JobName=train UserId=alice(1001) GroupId=alice(1001) Account=physics '
+                 'Partition=gpu TresPerNode=gres:gpu:4 '
+                 'Nodes=gpu[01-02] CPU_IDs=0-7 Mem=1024 GRES=gpu:a100(IDX:0-1) '
+                 'Nodes=gpu03 CPU_IDs=0-3 Mem=512 GRES=gpu:a100:1(IDX:2)')
+
+
+def test_parse_scontrol_job_per_node_gres():
+    meta = parse_scontrol_job(SCONTROL_LINE, 'gpu02')
+    assert (meta.job_id, meta.user, meta.account, meta.partition) == (42, 'alice', 'physics', 'gpu')
+    assert (meta.gpu_type, meta.gpu_count, meta.gpu_indices) == ('a100', 2, (0, 1))
+    meta = parse_scontrol_job(SCONTROL_LINE, 'gpu03')
+    assert (meta.gpu_count, meta.gpu_indices) == (1, (2,))
+
+
+def test_parse_scontrol_job_falls_back_to_tres_per_node():
+    meta = parse_scontrol_job(SCONTROL_LINE, 'login1')
+    assert (meta.gpu_type, meta.gpu_count, meta.gpu_indices) == ('', 4, ())
+    assert parse_scontrol_job('slurm_load_jobs error: Invalid job id specified', 'gpu01') is None
+
+
+class FakeRunner:
+    def __init__(self, lines):
+        self.lines = lines
+        self.calls = []
+
+    def run_many(self, commands, timeout=None):
+        self.calls.append(sorted(commands))
+        results = {}
+        for key, argv in commands.items():
+            job_id = int(argv[-1])
+            if job_id in self.lines:
+                results[key] = CommandResult(argv, 0, self.lines[job_id].encode(), b'', 0.0)
+            else:
+                results[key] = RuntimeError('Invalid job id specified')
+        return results
+
+
+def test_index_looks_up_each_job_once():
+    runner = FakeRunner({42: SCONTROL_LINE, 43: SCONTROL_LINE.replace('JobId=42', 'JobId=43')})
+    index = JobMetadataIndex(hostname='gpu01', binary=sys.executable, runner=runner)
+    assert sorted(index.get([42, 43])) == [42, 43]
+    assert index.get(['42', 43])[42].gpu_count == 2
+    assert runner.calls == [[42, 43]]
+    # A job that left the node is dropped and looked up again if it comes back.
+    assert sorted(index.get([43])) == [43]
+    index.get([42, 43])
+    assert runner.calls == [[42, 43], [42]]
+
+
+def test_index_retries_failed_lookups_after_interval():
+    runner = FakeRunner({})
+    index = JobMetadataIndex(hostname='gpu01', binary=sys.executable, runner=runner, retry_interval=3600)
+    assert index.get([7]) == {}
+    assert index.get([7]) == {}
+    assert runner.calls == [[7]]
@@ -0,0 +1,19 @@
+import nvidia_gpu_exporter
+from poc_exporters import cli
+
+
+def collectors(monkeypatch, argv):
+    calls = []
+    monkeypatch.setattr(cli, 'main', lambda args: calls.append(args) or 0)
+    assert nvidia_gpu_exporter.main(argv) == 0
+    args = calls[0]
+    return args[args.index('--collectors') + 1]
+
+
+def test_one_shot_runs_only_fork_free_collectors(monkeypatch):
+    # A one-shot run has no metadata cache, so the slurm collector would run scontrol for every job each time.
+    assert collectors(monkeypatch, []) == 'gpu,io'
+
+
+def test_daemon_adds_the_cached_collectors(monkeypatch):
+    assert collectors(monkeypatch, ['--daemon']) == 'gpu,io,cpu,slurm'
@@ -0,0 +1,139 @@
+import os
+import tempfile
+
+import pytest
+
+from poc_exporters.aggregator import INSERTS, SCHEMA, Aggregator, serve
+from poc_exporters.job_metadata import JobMetadata
+from poc_exporters.push import DeltaPusher, JobSummaries, decode_batch, encode_batch, parse_address
+from poc_exporters.store import UtilizationStore
+from poc_exporters.textfile import MetricFamily
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    # Unix socket paths are limited to about 100 bytes, so the socket does not go in tmp_path.
+    directory = tempfile.mkdtemp(prefix='agg')
+    store = UtilizationStore(str(tmp_path / 'cluster.db'), schema=SCHEMA, inserts=INSERTS, added_columns=())
+    aggregator = Aggregator(store, clock=Clock(2000.0))
+    address = f'unix:{directory}/aggregator.sock'
+    server = serve(address, aggregator)
+    yield aggregator, address
+    server.shutdown()
+    server.server_close()
+    store.close()
+    os.unlink(f'{directory}/aggregator.sock')
+    os.rmdir(directory)
+
+
+def hours(aggregator):
+    families = {family.name: family for family in aggregator.build(MetricFamily)}
+    return {labels[0]: value for labels, value in families['cluster_account_gpu_hours_total'].samples}
+
+
+def summaries_with(jobs, gpu_seconds):
+    clock = Clock(0.0)
+    summaries = JobSummaries(clock=clock)
+    summaries.start_round()
+    clock.now = gpu_seconds
+    summaries.start_round()
+    for job_id, account in jobs.items():
+        summaries.add(job_id, 'gpu_seconds', 1.0)
+    summaries.observe_jobs(jobs, {job_id: JobMetadata(job_id, user='alice', account=account)
+                                  for job_id, account in jobs.items()})
+    return summaries
+
+
+def test_batch_round_trip():
+    batch = {'node': 'gpu01', 'time': 1.0, 'jobs': [[1, 'a', 'u', {'gpu_seconds': 2.0}]], 'ended': []}
+    line = encode_batch(batch)
+    assert line.endswith(b'\n') and b'\n' not in line[:-1]
+    assert decode_batch(line) == batch
+    with pytest.raises(ValueError):
+        decode_batch(b'{"jobs": []}')
+    assert parse_address('unix:/run/a.sock')[1] == '/run/a.sock'
+    assert parse_address('agg:9063')[1] == ('agg', 9063)
+    with pytest.raises(ValueError):
+        parse_address('agg')
+
+
+def test_push_over_unix_socket(cluster):
+    aggregator, address = cluster
+    pusher = DeltaPusher(address, node='gpu01', clock=Clock(1990.0))
+    summaries = summaries_with({42: 'physics', 43: 'chemistry'}, 3600.0)
+    assert pusher.push(summaries)
+    assert hours(aggregator) == {'physics': 1.0, 'chemistry': 1.0}
+    # Unchanged values are not sent again; ended jobs are.
+    assert pusher.build(summaries) is None
+    summaries.observe_jobs([42], {})
+    assert pusher.build(summaries)['ended'] == [43]
+    assert pusher.push(summaries)
+    assert aggregator.batches == 2
+
+
+def test_counter_reset_is_carried_over(cluster):
+    aggregator, address = cluster
+    assert DeltaPusher(address, node='gpu01', clock=Clock(1000.0)).push(summaries_with({42: 'physics'}, 7200.0))
+    # The node exporter restarted while the job was running: its totals start again from 0.
+    assert DeltaPusher(address, node='gpu01', clock=Clock(1060.0)).push(summaries_with({42: 'physics'}, 1800.0))
+    assert hours(aggregator) == {'physics': 2.5}
+
+
+def batch(time, gpu_seconds, ended=()):
+    return {'node': 'gpu01', 'time': time, 'jobs': [[42, 'physics', 'alice', {'gpu_seconds': gpu_seconds}]],
+            'ended': list(ended)}
+
+
+def test_batches_merged_out_of_order(cluster):
+    aggregator, _ = cluster
+    # The first batch timed out on the node and is committed after the one that followed it.
+    aggregator.merge(batch(1060.0, 7200.0))
+    aggregator.merge(batch(1000.0, 3600.0))
+    assert hours(aggregator) == {'physics': 2.0}
+    aggregator.merge(batch(1060.0, 7200.0))  # sent twice
+    assert hours(aggregator) == {'physics': 2.0}
+    # A lower value that is newer is still a restart of the node exporter.
+    aggregator.merge(batch(1120.0, 1800.0))
+    assert hours(aggregator) == {'physics': 2.5}
+
+
+def test_job_end_merged_out_of_order(cluster):
+    aggregator, _ = cluster
+    aggregator.merge(batch(1000.0, 3600.0))
+    aggregator.merge({'node': 'gpu01', 'time': 1120.0, 'jobs': [], 'ended': [42]})
+    aggregator.merge(batch(1060.0, 4800.0))  # older than the end: does not reopen the job
+    assert aggregator.store.query("SELECT value, ended FROM job_usage") == [(4800.0, 1120.0)]
+    # An end sent before the latest value was merged does not close the job.
+    aggregator.merge(batch(1180.0, 6000.0))
+    aggregator.merge({'node': 'gpu01', 'time': 1150.0, 'jobs': [], 'ended': [42]})
+    assert aggregator.store.query("SELECT value, ended FROM job_usage") == [(6000.0, None)]
+
+
+def test_batch_is_acknowledged_only_once_committed(cluster):
+    aggregator, address = cluster
+    inserts = dict(aggregator.store.inserts)
+    aggregator.store.inserts['job_usage'] = 'INSERT INTO missing_table VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+    pusher = DeltaPusher(address, node='gpu01')
+    summaries = summaries_with({42: 'physics'}, 3600.0)
+    assert not pusher.push(summaries)
+    assert pusher.sent == {} and pusher.failures == 1
+    assert hours(aggregator) == {}
+    # The next push carries the same changes again once the aggregator can store them.
+    aggregator.store.inserts.update(inserts)
+    assert pusher.push(summaries)
+    assert hours(aggregator) == {'physics': 1.0}
+
+
+def test_unreachable_aggregator_keeps_changes(tmp_path):
+    pusher = DeltaPusher(f'unix:{tmp_path}/none.sock', node='gpu01', timeout=1)
+    summaries = summaries_with({42: 'physics'}, 60.0)
+    assert not pusher.push(summaries)
+    assert pusher.build(summaries)['jobs'] == [[42, 'physics', 'alice', {'gpu_seconds': 60.0}]]
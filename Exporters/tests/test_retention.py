@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from poc_exporters.retention import RetentionManager
+from poc_exporters.store import UtilizationStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UtilizationStore(str(tmp_path / 'utilization.db'))
+    yield store
+    store.close()
+
+
+def raw(store, *rows):
+    # (timestamp, utilization, samples) for account physics
+    store.put_many('gpu_utilization_raw', [(timestamp, 'physics', value, samples)
+                                           for timestamp, value, samples in rows])
+
+
+def tier(store, name):
+    return store.query("SELECT bucket, samples, sum_utilization, min_utilization, max_utilization "
+                       "FROM gpu_utilization_rollup WHERE tier = ? ORDER BY bucket", (name,))
+
+
+DAY_ONE = datetime(2026, 10, 17, 12, 0, 30)
+DAY_TWO = datetime(2026, 10, 18, 1, 0, 30)
+
+
+@pytest.fixture
+def rolled_up(store):
+    retention = RetentionManager(store)
+    raw(store, ('2026-10-17 10:00:00', 50.0, 1), ('2026-10-17 10:00:30', 100.0, 1),
+        ('2026-10-17 10:01:00', 0.0, 3),  # a mean of three samples
+        ('2026-10-17 11:59:10', 80.0, 1))  # within the settle time: its bucket is still open
+    assert retention.rollup(DAY_ONE) == {'minute': 2, 'hour': 1}
+    return retention
+
+
+def test_rollup_builds_each_tier_from_the_one_below(store, rolled_up):
+    assert tier(store, 'minute') == [('2026-10-17 10:00:00', 2, 150.0, 50.0, 100.0),
+                                     ('2026-10-17 10:01:00', 3, 0.0, 0.0, 0.0)]
+    assert tier(store, 'hour') == [('2026-10-17 10:00:00', 5, 150.0, 0.0, 100.0)]
+    assert tier(store, 'day') == []  # the day is not over
+    assert rolled_up.watermark('minute') == datetime(2026, 10, 17, 11, 59)
+    assert rolled_up.watermark('hour') == datetime(2026, 10, 17, 11, 0)
+    assert rolled_up.watermark('day') is None
+
+
+def test_rerun_is_idempotent(store, rolled_up):
+    before = {name: tier(store, name) for name in ('minute', 'hour', 'day')}
+    assert rolled_up.rollup(DAY_ONE) == {}
+    assert rolled_up.rollup(DAY_ONE + timedelta(seconds=20)) == {}  # same closed buckets
+    assert {name: tier(store, name) for name in ('minute', 'hour', 'day')} == before
+
+
+def test_later_run_only_reads_new_buckets(store, rolled_up):
+    raw(store, ('2026-10-18 00:59:00', 20.0, 1))  # still open at DAY_TWO
+    assert rolled_up.rollup(DAY_TWO) == {'minute': 1, 'hour': 1, 'day': 1}
+    assert tier(store, 'minute')[-1] == ('2026-10-17 11:59:00', 1, 80.0, 80.0, 80.0)
+    assert tier(store, 'hour') == [('2026-10-17 10:00:00', 5, 150.0, 0.0, 100.0),
+                                   ('2026-10-17 11:00:00', 1, 80.0, 80.0, 80.0)]
+    assert tier(store, 'day') == [('2026-10-17 00:00:00', 6, 230.0, 0.0, 100.0)]
+
+
+def test_prune_respects_ttls_and_the_rollup_watermark(store):
+    retention = RetentionManager(store, ttls={'raw': timedelta(days=1), 'minute': timedelta(days=2), 'hour': None},
+                                 delete_batch=1)
+    raw(store, ('2026-10-17 10:00:00', 50.0, 1), ('2026-10-17 11:59:00', 80.0, 1), ('2026-10-18 00:59:00', 20.0, 1))
+    retention.rollup(DAY_TWO)  # minute watermark: 2026-10-18 00:59
+    now = datetime(2026, 10, 19, 11, 59)
+    # Raw: past its TTL, but the 00:59 sample is not rolled up yet and stays.
+    # Minute: a bucket starting exactly at the cutoff (now - 2 days) stays.
+    assert retention.prune(now) == {'raw': 2, 'minute': 1}
+    assert store.query("SELECT timestamp FROM gpu_utilization_raw") == [('2026-10-18 00:59:00',)]
+    assert [row[0] for row in tier(store, 'minute')] == ['2026-10-17 11:59:00']
+    assert len(tier(store, 'hour')) == 2  # kept forever
+
+
+def test_prune_before_any_rollup_keeps_raw_samples(store):
+    retention = RetentionManager(store, ttls={'raw': timedelta(days=1)})
+    raw(store, ('2026-10-01 10:00:00', 50.0, 1))
+    store.flush()
+    assert 'raw' not in retention.prune(DAY_TWO)
+    assert store.query("SELECT COUNT(*) FROM gpu_utilization_raw") == [(1,)]
+
+
+def test_vacuum_runs_once_per_interval(store):
+    retention = RetentionManager(store, vacuum_interval=timedelta(days=7))
+    assert retention.maintain(DAY_ONE)
+    assert not retention.maintain(DAY_ONE + timedelta(days=1))
+    assert retention.maintain(DAY_ONE + timedelta(days=8))
+    assert not RetentionManager(store, vacuum_interval=None).maintain(DAY_TWO)
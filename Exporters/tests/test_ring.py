@@ -0,0 +1,131 @@
+import importlib
+import sys
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from poc_exporters.gpu import GpuSample
+from poc_exporters.ring import RingError, SampleRing, downsample
+
+
+def test_append_and_read(tmp_path):
+    path = str(tmp_path / 'gpu.ring')
+    writer = SampleRing(path, gpus=2, slots=8, create=True)
+    for second in range(3):
+        writer.append(100.0 + second, [10.0 * second, 50.0], [1e9, 2e9], [42, 0])
+    reader = SampleRing(path)
+    window = reader.read(0)
+    assert list(window.indices) == [0, 1, 2]
+    assert list(window.times) == [100.0, 101.0, 102.0]
+    assert window.utilization[:, 0].tolist() == [0.0, 10.0, 20.0]
+    assert window.jobs[:, 0].tolist() == [42, 42, 42]
+    assert (window.end, window.lost) == (3, 0)
+    assert len(reader.read(window.end).indices) == 0
+    reader.close()
+    writer.close()
+
+
+def test_overwritten_samples_are_counted_as_lost(tmp_path):
+    path = str(tmp_path / 'gpu.ring')
+    ring = SampleRing(path, gpus=1, slots=4, create=True)
+    for second in range(10):
+        ring.append(float(second), [float(second)], [0.0], [0])
+    window = ring.read(0)
+    assert list(window.indices) == [6, 7, 8, 9]
+    assert window.lost == 6
+    ring.close()
+
+
+def test_single_writer_and_layout_change(tmp_path):
+    path = str(tmp_path / 'gpu.ring')
+    writer = SampleRing(path, gpus=1, slots=4, create=True)
+    with pytest.raises(RingError):
+        SampleRing(path, gpus=1, slots=4, create=True)
+    writer.append(1.0, [5.0], [0.0], [0])
+    reader = SampleRing(path)
+    writer.close()
+    # A writer with the same layout keeps the samples; another layout starts an empty ring.
+    writer = SampleRing(path, gpus=1, slots=4, create=True)
+    assert writer.committed() == 1
+    writer.close()
+    writer = SampleRing(path, gpus=3, slots=4, create=True)
+    assert writer.committed() == 0
+    writer.append(2.0, [1.0, 2.0, 3.0], [0.0] * 3, [0] * 3)
+    assert reader.read(0).utilization.shape == (1, 3)
+    reader.close()
+    writer.close()
+
+
+def test_downsample_leaves_open_buckets(tmp_path):
+    ring = SampleRing(str(tmp_path / 'gpu.ring'), gpus=1, slots=16, create=True)
+    for second, (utilization, job) in enumerate([(10, 1), (30, 1), (50, 2), (70, 2), (90, 2)]):
+        ring.append(60.0 + 20 * second, [float(utilization)], [100.0], [job])
+    rows, position = downsample(ring.read(0), 60, until=150.0)
+    # Buckets [60, 120) is closed; [120, 180) is still open at 150.
+    assert rows == [(60.0, 0, 1, 2, 20.0, 30.0, 100.0), (60.0, 0, 2, 1, 50.0, 50.0, 100.0)]
+    assert position == 3
+    rows, position = downsample(ring.read(position), 60)
+    assert rows == [(120.0, 0, 2, 2, 80.0, 90.0, 100.0)]
+    assert position == 5
+    ring.close()
+
+
+@pytest.fixture
+def monitoring(tmp_path, monkeypatch):
+    monkeypatch.setenv('UTILIZATION_DB', str(tmp_path / 'utilization.db'))
+    monkeypatch.setenv('GPU_RING_PATH', str(tmp_path / 'gpu.ring'))
+    monkeypatch.setenv('GPU_RING_SLOTS', '4096')
+    monkeypatch.setenv('GPU_ROLLUP_INTERVAL', '1')
+    monkeypatch.setenv('SREPORT_CACHE_DIR', str(tmp_path / 'sreport'))
+    monkeypatch.setenv('STORAGE_MOUNTS', str(tmp_path))
+    sys.modules.pop('monitoring', None)
+    module = importlib.import_module('monitoring')
+    yield module
+    if module.gpu_ring is not None:
+        module.gpu_ring.close()
+    module.store.close()
+    sys.modules.pop('monitoring', None)
+
+
+def test_persist_races_ring_replacement(monitoring):
+    # The sampler replaces the ring whenever the GPU count changes while the scheduler persists it.
+    start = time.time() - 600
+    stop = threading.Event()
+
+    def sample():
+        for n in range(3000):
+            gpus = [GpuSample(f'GPU-{i}', i, utilization=50.0) for i in range(2 + (n // 100) % 2)]
+            monitoring.append_to_ring(gpus, ['physics'] * len(gpus), [7] * len(gpus), start + n * 0.1)
+        stop.set()
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    while not stop.is_set():
+        monitoring.persist_gpu_samples()
+    sampler.join()
+    monitoring.persist_gpu_samples(close_all=True)
+    monitoring.store.flush()
+
+    assert 'persist_gpu_samples' not in monitoring.instrumentation.snapshot()
+    rows = monitoring.store.query('SELECT account, SUM(samples) FROM gpu_utilization_raw GROUP BY account')
+    # 3000 rounds, alternating between 2 and 3 GPUs every 100: each sample persisted exactly once.
+    assert rows == [('physics', 1500 * 2 + 1500 * 3)]
+
+
+def test_persisted_means_keep_their_sample_count(monitoring):
+    # A full bucket and a nearly empty one: the rollup must weight them 9 to 1, not 1 to 1.
+    start = (time.time() // 60 - 10) * 60
+    gpus = [GpuSample('GPU-0', 0, utilization=100.0)]
+    for n in range(9):
+        monitoring.append_to_ring(gpus, ['physics'], [7], start + n * 0.1)
+    monitoring.append_to_ring([GpuSample('GPU-0', 0, utilization=0.0)], ['physics'], [7], start + 1.0)
+    monitoring.persist_gpu_samples(close_all=True)
+
+    assert monitoring.store.query('SELECT utilization_percent, samples FROM gpu_utilization_raw '
+                                  'ORDER BY timestamp') == [(100.0, 9), (0.0, 1)]
+    monitoring.retention.rollup()
+    assert monitoring.store.query("SELECT samples, sum_utilization FROM gpu_utilization_rollup "
+                                  "WHERE tier = 'minute'") == [(10, 900.0)]
@@ -0,0 +1,137 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from poc_exporters.scheduler import Daily, Every, Monthly, Scheduler, Weekly
+
+
+class FakeState:
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    def get_state(self, key):
+        return self.values.get(key)
+
+    def set_state(self, key, value):
+        self.values[key] = value
+
+
+@pytest.mark.parametrize('schedule, moment, expected', [
+    (Daily(0, 5), datetime(2026, 10, 17, 0, 4), datetime(2026, 10, 17, 0, 5)),
+    (Daily(0, 5), datetime(2026, 10, 17, 0, 5), datetime(2026, 10, 18, 0, 5)),  # a slot is never its own next
+    (Daily(0, 5), datetime(2026, 12, 31, 12, 0), datetime(2027, 1, 1, 0, 5)),
+    (Weekly(0, 0, 30), datetime(2026, 10, 18, 23, 0), datetime(2026, 10, 19, 0, 30)),  # Sunday -> Monday
+    (Weekly(0, 0, 30), datetime(2026, 10, 19, 0, 30), datetime(2026, 10, 26, 0, 30)),
+    (Weekly(6, 12, 0), datetime(2026, 12, 28, 9, 0), datetime(2027, 1, 3, 12, 0)),  # across the year
+    (Monthly(1, 0, 45), datetime(2026, 10, 17, 12, 0), datetime(2026, 11, 1, 0, 45)),
+    (Monthly(1, 0, 45), datetime(2026, 12, 1, 0, 45), datetime(2027, 1, 1, 0, 45)),  # December
+    (Monthly(28, 1, 0), datetime(2026, 1, 30, 0, 0), datetime(2026, 2, 28, 1, 0)),
+    (Monthly(15, 0, 0), datetime(2026, 10, 14, 23, 59), datetime(2026, 10, 15, 0, 0)),
+    (Every(60), datetime(2026, 10, 17, 12, 0), datetime(2026, 10, 17, 12, 1)),
+])
+def test_next_slot(schedule, moment, expected):
+    assert schedule.next_after(moment) == expected
+
+
+def test_monthly_day_is_bounded():
+    with pytest.raises(ValueError):
+        Monthly(31)
+
+
+def added_slot(state, schedule, **kwargs):
+    before = datetime.now()
+    job = Scheduler(state=state).add('report', schedule, lambda: None, **kwargs)
+    return before, job.slot
+
+
+def test_restart_runs_a_missed_slot_once():
+    schedule = Daily(3, 0)
+    # A slot between two days and one day ago was run; the one after it has passed since.
+    last = schedule.next_after(datetime.now() - timedelta(days=2))
+    before, slot = added_slot(FakeState({'last_run:report': last.isoformat(sep=' ')}), schedule)
+    assert before <= slot <= datetime.now()
+
+
+def test_restart_waits_when_the_latest_slot_ran():
+    schedule = Daily(3, 0)
+    last = schedule.next_after(datetime.now() - timedelta(days=1))
+    _, slot = added_slot(FakeState({'last_run:report': last.isoformat(sep=' ')}), schedule)
+    assert slot == schedule.next_after(last) > datetime.now()
+
+
+def test_first_deployment_runs_now_unless_told_to_wait():
+    schedule = Monthly(1)
+    before, slot = added_slot(FakeState(), schedule)
+    assert before <= slot <= datetime.now()
+    _, slot = added_slot(FakeState(), schedule, run_if_never_run=False)
+    assert slot.day == 1 and slot > datetime.now()
+
+
+def test_without_state_calendar_jobs_wait_for_their_slot():
+    _, slot = added_slot(None, Weekly(0))
+    assert slot.weekday() == 0 and slot > datetime.now()
+    assert Scheduler().add('sample', Every(30), lambda: None).slot <= datetime.now()
+
+
+def test_only_successful_runs_are_persisted(capsys):
+    state = FakeState()
+    scheduler = Scheduler(state=state)
+    slot = datetime(2026, 11, 1, 0, 45)
+
+    def fail():
+        raise RuntimeError('sreport unavailable')
+
+    failing = scheduler.add('monthly', Monthly(1, 0, 45), fail)
+    scheduler._run_job(failing, slot)
+    assert (failing.runs, failing.failures, failing.running) == (1, 1, False)
+    assert 'last_run:monthly' not in state.values
+    assert '[ERROR] Scheduled job monthly failed: sreport unavailable' in capsys.readouterr().out
+
+    working = scheduler.add('weekly', Weekly(0), lambda: None)
+    scheduler._run_job(working, slot)
+    assert state.values['last_run:weekly'] == '2026-11-01 00:45:00'
+
+
+def test_a_job_still_running_skips_its_slot(capsys):
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    scheduler = Scheduler()
+    job = scheduler.add('slow', Every(60), slow)
+    scheduler._dispatch(job)
+    assert started.wait(5)
+    scheduler._dispatch(job)
+    assert job.skipped == 1
+    assert '[WARN] Skipping slow: previous run still in progress.' in capsys.readouterr().out
+    release.set()
+    deadline = time.monotonic() + 5
+    while job.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert (job.runs, job.skipped) == (1, 1)
+
+
+def test_dispatch_jumps_over_missed_slots():
+    scheduler = Scheduler()
+    job = scheduler.add('hourly', Every(3600), lambda: None)
+    job.slot = datetime.now() - timedelta(hours=5)  # e.g. the host was suspended
+    scheduler._dispatch(job)
+    assert datetime.now() < job.slot <= datetime.now() + timedelta(hours=1)
+    assert len(scheduler._heap) == 2  # the one pushed by add() and the next slot; no backlog
+
+
+def test_dispatcher_runs_due_jobs():
+    runs = []
+    scheduler = Scheduler()
+    scheduler.add('tick', Every(0.02), lambda: runs.append(time.monotonic()))
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while len(runs) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    assert len(runs) >= 3
@@ -0,0 +1,66 @@
+from poc_exporters.scrape import prometheus_family
+from poc_exporters.series import OVERFLOW, SeriesLimiter
+from poc_exporters.textfile import MetricFamily
+
+
+def builder(values, type='gauge'):
+    def build(family):
+        name = 'job_bytes_total' if type == 'counter' else 'job_bytes'
+        metric = family(name, 'Bytes per job', ['job_id'], type)
+        for job, value in values.items():
+            metric.add_metric([job], value)
+        return [metric]
+    return build
+
+
+def samples(limiter, values, type='gauge'):
+    return dict(limiter.build(builder(values, type), MetricFamily)[0].samples)
+
+
+def own(limiter):
+    return {family.name: dict(family.samples) for family in limiter.families(MetricFamily)}
+
+
+def test_gauges_over_the_limit_are_folded():
+    limiter = SeriesLimiter('test', max_series=2)
+    assert samples(limiter, {'1': 1.0, '2': 2.0, '3': 3.0, '4': 4.0}) == \
+        {('1',): 1.0, ('2',): 2.0, (OVERFLOW,): 7.0}
+    counts = own(limiter)
+    assert counts['test_series'] == {('job_bytes',): 2}
+    assert counts['test_series_dropped_total'] == {('job_bytes',): 2}
+
+
+def test_counters_over_the_limit_are_dropped():
+    limiter = SeriesLimiter('test', max_series=2, expire_after=1)
+    assert samples(limiter, {'1': 10, '2': 20, '3': 30}, 'counter') == {('1',): 10, ('2',): 20}
+    assert samples(limiter, {'2': 25, '3': 35, '4': 40}, 'counter') == {('2',): 25}
+    # Job 1 expired and job 3 took its slot; no overflow series went up and down meanwhile.
+    assert samples(limiter, {'2': 25, '3': 35, '4': 40}, 'counter') == {('2',): 25, ('3',): 35}
+    assert own(limiter)['test_series_dropped_total'] == {('job_bytes_total',): 4}
+
+
+def test_label_sets_expire_after_missing_builds():
+    limiter = SeriesLimiter('test', max_series=1, expire_after=2)
+    samples(limiter, {'1': 1.0})
+    assert samples(limiter, {'2': 2.0}) == {(OVERFLOW,): 2.0}
+    assert samples(limiter, {'2': 2.0}) == {(OVERFLOW,): 2.0}
+    # Job 1 was missing from two builds, so its slot is free.
+    assert samples(limiter, {'2': 2.0}) == {('2',): 2.0}
+    counts = own(limiter)
+    assert counts['test_series_expired_total'] == {('job_bytes',): 1}
+    assert counts['test_series'] == {('job_bytes',): 1}
+
+
+def test_no_limit():
+    limiter = SeriesLimiter('test', max_series=0)
+    values = {str(job): float(job) for job in range(5000)}
+    assert len(samples(limiter, values)) == 5000
+
+
+def test_prometheus_counter_tracked_by_factory_name():
+    limiter = SeriesLimiter('test', max_series=1)
+    families = limiter.build(builder({'1': 1, '2': 2}, 'counter'), prometheus_family)
+    assert families[0].name == 'job_bytes'
+    assert [sample.labels for sample in families[0].samples if sample.name == 'job_bytes_total'] == \
+        [{'job_id': '1'}]
+    assert own(limiter)['test_series_dropped_total'] == {('job_bytes_total',): 1}
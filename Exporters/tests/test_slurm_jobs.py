@@ -0,0 +1,72 @@
+import pytest
+
+from poc_exporters.slurm_jobs import (JobResolver, find_job_cgroups, parse_cgroup_job_id, read_start_time,
+                                      slurm_cgroup_present)
+
+V2_STEP = '0::/system.slice/slurmstepd.scope/job_4242/step_0/user/task_0'
+
+
+@pytest.mark.parametrize('text, expected', [
+    (V2_STEP, 4242),
+    ('0::/slurm/uid_1001/job_77/step_batch/task_0', 77),
+    ('12:cpuacct,cpu:/slurm/uid_1001/job_31/step_0\n11:memory:/slurm/uid_1001/job_31/step_0', 31),
+    ('4:memory:/user.slice\n3:cpuacct:/slurm/uid_0/job_9', 9),
+    ('0::/user.slice/user-1001.slice/session-3.scope', None),
+    ('0::/system.slice/slurmstepd.scope/system', None),
+    ('0::/slurm/uid_1001/job_12x', None),
+    ('', None),
+])
+def test_parse_cgroup_job_id(text, expected):
+    assert parse_cgroup_job_id(text) == expected
+
+
+def test_read_start_time_with_spaces_in_the_command(fake_node):
+    fake_node.process(10, 123456)
+    assert read_start_time(10, fake_node.proc_root) == 123456
+    assert read_start_time(11, fake_node.proc_root) is None
+
+
+def test_proc_mode_caches_by_start_time(fake_node):
+    fake_node.process(10, 100, V2_STEP)
+    fake_node.process(11, 100)
+    resolver = JobResolver(fake_node.proc_root, fake_node.cgroup_root, mode='proc')
+    assert resolver.resolve_all() == {10: 4242}
+    assert resolver.job_cgroups is None
+    # Same PID and start time: the cached answer is kept without reading the cgroup file again.
+    fake_node.write(f'{fake_node.proc_root}/10/cgroup', '0::/slurm/uid_1/job_1\n')
+    assert resolver.job_id(10) == 4242
+    # A recycled PID has another start time and is looked up again.
+    fake_node.process(10, 200, '0::/slurm/uid_1/job_5')
+    assert resolver.job_id(10) == 5
+    fake_node.exit(10)
+    assert resolver.resolve_all() == {}
+    assert resolver.job_id(10) is None
+
+
+@pytest.mark.parametrize('layout', [
+    'system.slice/slurmstepd.scope/job_{job}',
+    'slurm/uid_1001/job_{job}',
+    'cpuacct/slurm/uid_1001/job_{job}',
+])
+def test_cgroup_mode_walks_job_cgroups(fake_node, layout):
+    job_42 = layout.format(job=42)
+    fake_node.cgroup(job_42)
+    fake_node.cgroup(f'{job_42}/step_0/user/task_0', pids=[10, 11])
+    fake_node.cgroup(f'{job_42}/step_batch', pids=[12])
+    fake_node.cgroup(layout.format(job=43), pids=[20])
+    for pid in (10, 11, 12, 20):
+        fake_node.process(pid, 100)
+    assert slurm_cgroup_present(fake_node.cgroup_root)
+    resolver = JobResolver(fake_node.proc_root, fake_node.cgroup_root)
+    assert resolver.resolve_all() == {10: 42, 11: 42, 12: 42, 20: 43}
+    assert sorted(resolver.job_cgroups) == [42, 43]
+    assert resolver.job_cgroups[42] == f'{fake_node.cgroup_root}/{job_42}'
+    assert resolver.job_id(20) == 43
+
+
+def test_no_slurm_hierarchy(fake_node):
+    fake_node.cgroup('user.slice', pids=[1])
+    assert not slurm_cgroup_present(fake_node.cgroup_root)
+    assert find_job_cgroups(fake_node.cgroup_root) == {}
+    with pytest.raises(ValueError):
+        JobResolver(mode='squeue')
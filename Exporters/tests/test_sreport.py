@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from poc_exporters.sreport import SreportClient, SreportError, parse_parsable
+
+OUTPUT = """--------------------------------------------------------------------------------
+Cluster/Account/User Utilization 2024-01-01T00:00:00 - 2024-01-07T23:59:59 (604800 secs)
+Usage reported in CPU Minutes
+--------------------------------------------------------------------------------
+Account|CPU_Hours|GPU_Hours
+physics|120|8
+chemistry|40|0
+"""
+
+
+@pytest.fixture
+def stub(tmp_path):
+    """A stub sreport that logs each call and fails while ``fail`` exists."""
+    directory = tmp_path / 'bin'
+    directory.mkdir()
+    (directory / 'output').write_text(OUTPUT)
+    script = directory / 'sreport'
+    script.write_text(f"""#!/bin/sh
+echo "$*" >> {directory}/calls
+sleep "${{SREPORT_STUB_DELAY:-0}}"
+[ -e {directory}/fail ] && {{ echo "slurmdbd unreachable" >&2; exit 1; }}
+cat {directory}/output
+""")
+    script.chmod(0o755)
+    return directory
+
+
+def calls(stub):
+    path = stub / 'calls'
+    return path.read_text().splitlines() if path.exists() else []
+
+
+def client(stub, tmp_path, **kwargs):
+    return SreportClient(cache_dir=str(tmp_path / 'cache'), binary=str(stub / 'sreport'), **kwargs)
+
+
+def query(sreport):
+    return sreport.query(('cluster', 'AccountUtilizationByUser'), start='-7days', extra=('format=Account,CPU_Hours,GPU_Hours',))
+
+
+def test_parse_parsable_skips_titles():
+    assert parse_parsable(OUTPUT) == [{'Account': 'physics', 'CPU_Hours': '120', 'GPU_Hours': '8'},
+                                      {'Account': 'chemistry', 'CPU_Hours': '40', 'GPU_Hours': '0'}]
+
+
+def test_nodes_share_the_cache(stub, tmp_path):
+    rows = query(client(stub, tmp_path))
+    assert rows[0]['Account'] == 'physics'
+    assert calls(stub) == ['--parsable2 cluster AccountUtilizationByUser start=-7days format=Account,CPU_Hours,GPU_Hours']
+    # Another node with the same cache directory reads the entry instead of running sreport.
+    assert query(client(stub, tmp_path)) == rows
+    assert len(calls(stub)) == 1
+
+
+def test_expired_entry_is_refreshed(stub, tmp_path):
+    sreport = client(stub, tmp_path, ttl=0.2)
+    query(sreport)
+    time.sleep(0.3)
+    query(sreport)
+    assert len(calls(stub)) == 2
+
+
+def test_failed_leader_falls_back_to_last_result(stub, tmp_path):
+    rows = query(client(stub, tmp_path, ttl=0.2))
+    time.sleep(0.3)
+    (stub / 'fail').touch()
+    assert query(client(stub, tmp_path, ttl=0.2)) == rows
+    # Followers use the last result as well, without running sreport again until the retry interval.
+    assert query(client(stub, tmp_path, ttl=0.2)) == rows
+    assert len(calls(stub)) == 2
+    (stub / 'fail').unlink()
+    query(client(stub, tmp_path, ttl=0.2, retry_interval=0))
+    assert len(calls(stub)) == 3
+
+
+def test_failure_without_result_is_raised_once(stub, tmp_path):
+    (stub / 'fail').touch()
+    with pytest.raises(SreportError, match='slurmdbd unreachable'):
+        query(client(stub, tmp_path))
+    with pytest.raises(SreportError, match='slurmdbd unreachable'):
+        query(client(stub, tmp_path))
+    assert len(calls(stub)) == 1
+
+
+def _node(stub, tmp_path, results):
+    results.put(query(client(stub, tmp_path))[0]['Account'])
+
+
+def test_one_leader_among_concurrent_nodes(stub, tmp_path, monkeypatch):
+    # lockf locks are per process, so each node is a process.
+    monkeypatch.setenv('SREPORT_STUB_DELAY', '0.5')
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    nodes = [context.Process(target=_node, args=(stub, tmp_path, results)) for _ in range(4)]
+    for node in nodes:
+        node.start()
+    for node in nodes:
+        node.join(30)
+    assert [results.get(timeout=1) for _ in nodes] == ['physics'] * 4
+    assert len(calls(stub)) == 1
+
+
+def test_cache_directory_is_created_on_first_query(stub, tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv('SREPORT_CACHE_DIR', raising=False)
+    sreport = SreportClient(binary=str(stub / 'sreport'))
+    assert not sreport.shared
+    monkeypatch.setenv('SREPORT_CACHE_DIR', str(tmp_path / 'shared'))
+    sreport = SreportClient(binary=str(stub / 'sreport'))
+    assert sreport.shared and not os.path.exists(tmp_path / 'shared')
+    query(sreport)
+    assert os.path.isdir(tmp_path / 'shared')
+    assert 'SREPORT_CACHE_DIR is not set' not in capsys.readouterr().out
+
+
+def test_node_local_cache_warns(stub, tmp_path, capsys):
+    sreport = client(stub, tmp_path)
+    sreport.shared = False
+    query(sreport)
+    assert 'SREPORT_CACHE_DIR is not set' in capsys.readouterr().out
@@ -0,0 +1,97 @@
+import os
+import threading
+
+import pytest
+
+from poc_exporters import cli
+from poc_exporters.storage import (FileQuotaSource, FilesystemProbe, LfsQuotaSource, QuotaUsage, StorageTimeout,
+                                   open_quota_source, parse_lfs_quota, parse_repquota)
+
+LFS_OUTPUT = """Disk quotas for usr alice (uid 1001):
+     Filesystem  kbytes   quota   limit   grace   files   quota   limit   grace
+/lustre/scratch 2048* 1000 4096 6d23h 1.5k 0 2m -
+"""
+
+LFS_LONG_NAME = """/lustre/a-very-long-filesystem-name
+                   100       0       0       -       3       0       0       -
+"""
+
+REPQUOTA_OUTPUT = """*** Report for user quotas on device /dev/sdb1
+Block grace time: 7days; Inode grace time: 7days
+                        Block limits                File limits
+User            used    soft    hard  grace    used  soft  hard  grace
+----------------------------------------------------------------------
+root      --      20       0       0      0       2     0     0      0
+alice     +-    2048    1000    4096 604800      15     0     0      0
+#1002     --       4       0       0      0       1     0     0      0
+
+"""
+
+
+def test_parse_lfs_quota():
+    assert parse_lfs_quota(LFS_OUTPUT, '/lustre/scratch/', 'user', 'alice') == \
+        QuotaUsage('/lustre/scratch/', 'user', 'alice', 2048 * 1024, 4096 * 1024, 1500, 2000000)
+    assert parse_lfs_quota(LFS_LONG_NAME, '/lustre/a-very-long-filesystem-name', 'project', '7') == \
+        QuotaUsage('/lustre/a-very-long-filesystem-name', 'project', '7', 100 * 1024, 0, 3, 0)
+    assert parse_lfs_quota('lfs: quotactl failed', '/lustre/scratch', 'user', 'bob') is None
+
+
+def test_parse_repquota():
+    quotas = parse_repquota(REPQUOTA_OUTPUT, '/home', 'user')
+    assert [quota.name for quota in quotas] == ['root', 'alice', '1002']
+    assert quotas[1] == QuotaUsage('/home', 'user', 'alice', 2048 * 1024, 4096 * 1024, 15, 0)
+
+
+def test_file_quota_source(tmp_path):
+    path = tmp_path / 'quotas.csv'
+    path.write_text('mount,kind,name,used_bytes,limit_bytes,used_inodes,limit_inodes\n'
+                    '/rs01,project,42,100,200,3,4\n')
+    assert open_quota_source(f'file:{path}', '/rs01').collect() == [QuotaUsage('/rs01', 'project', '42', 100, 200, 3, 4)]
+    assert isinstance(open_quota_source(f'file:{path}', ''), FileQuotaSource)
+    assert open_quota_source('', '/rs01') is None
+    with pytest.raises(ValueError):
+        open_quota_source('nfs', '/rs01')
+
+
+def test_lfs_source_targets(capsys):
+    source = open_quota_source('lfs', '/lustre', users=['alice'], groups=['physics'], projects=[7])
+    assert isinstance(source, LfsQuotaSource)
+    assert source.targets == [('user', 'alice'), ('group', 'physics'), ('project', '7')]
+    assert capsys.readouterr().out == ''
+    assert open_quota_source('lfs', '/lustre').targets == []
+    assert 'no users, groups or projects' in capsys.readouterr().out
+
+
+def test_probe_reports_hung_mounts():
+    release = threading.Event()
+
+    def statvfs(mount):
+        if mount == '/hung':
+            release.wait(5)
+        return os.statvfs('/')
+
+    probe = FilesystemProbe(timeout=0.2, statvfs=statvfs)
+    results = probe.usage_many(['/', '/hung'])
+    assert results['/'].total_bytes > 0
+    assert isinstance(results['/hung'], StorageTimeout)
+    # The stuck call is not started again while it hangs.
+    assert 'still hung' in str(probe.usage_many(['/hung'])['/hung'])
+    release.set()
+
+
+def test_cli_passes_lfs_targets(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    lfs = bin_dir / 'lfs'
+    # lfs quota -q -u <name> <mount>
+    lfs.write_text('#!/bin/sh\necho "$5 1024 0 2048 - 10 0 20 -"\n')
+    lfs.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    textfile = tmp_path / 'storage.prom'
+    assert cli.main(['--collectors', 'storage', '--output', 'textfile', '--once', '--textfile', str(textfile),
+                     '--storage-mounts', str(tmp_path), '--storage-quota-source', 'lfs',
+                     '--storage-quota-users', 'alice,bob', '--storage-quota-projects', '7']) == 0
+    lines = [line for line in textfile.read_text().splitlines() if line.startswith('storage_quota_used_bytes{')]
+    assert sorted(lines) == [
+        f'storage_quota_used_bytes{{mount="{tmp_path}",kind="{kind}",name="{name}"}} 1048576'
+        for kind, name in [('project', '7'), ('user', 'alice'), ('user', 'bob')]]
@@ -0,0 +1,134 @@
+import sqlite3
+import time
+
+import pytest
+
+from poc_exporters.store import INSERTS, UtilizationStore
+
+RAW = ('2026-10-17 10:00:00', 'physics', 50.0, 1)
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    stores = []
+
+    def open_store(**kwargs):
+        store = UtilizationStore(str(tmp_path / 'utilization.db'), **kwargs)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+
+def raw_count(store):
+    return store.query("SELECT COUNT(*) FROM gpu_utilization_raw")[0][0]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_store_uses_wal(open_store):
+    store = open_store()
+    assert store.query("PRAGMA journal_mode")[0][0] == 'wal'
+
+
+def test_rows_wait_for_a_full_batch(open_store):
+    store = open_store(batch_size=3, flush_interval=3600)
+    store.put_many('gpu_utilization_raw', [RAW, RAW])
+    time.sleep(0.1)
+    assert (raw_count(store), store.queue_depth()) == (0, 0)  # taken off the queue, held by the writer
+    store.put('gpu_utilization_raw', RAW)
+    wait_for(lambda: store.rows_written == 3)
+    assert raw_count(store) == 3
+    assert store.write_latency.count == 1  # one transaction for the whole batch
+
+
+def test_rows_are_written_after_the_flush_interval(open_store):
+    store = open_store(batch_size=1000, flush_interval=0.05)
+    store.put('gpu_utilization_raw', RAW)
+    wait_for(lambda: raw_count(store) == 1)
+
+
+def test_flush_writes_queued_rows(open_store):
+    store = open_store(batch_size=1000, flush_interval=3600)
+    store.put_many('gpu_utilization_raw', [RAW] * 10)
+    assert store.flush(timeout=5)
+    assert raw_count(store) == 10
+
+
+def test_close_writes_queued_rows(open_store):
+    store = open_store(batch_size=1000, flush_interval=3600)
+    store.put_many('gpu_utilization_raw', [RAW] * 10)
+    store.close()
+    assert raw_count(open_store()) == 10
+
+
+def test_unknown_table_is_rejected(open_store):
+    with pytest.raises(KeyError):
+        open_store().put('jobs', RAW)
+
+
+def test_failing_table_does_not_drop_the_others(open_store, capsys):
+    inserts = dict(INSERTS, broken="INSERT INTO missing_table (a) VALUES (?)")
+    store = open_store(batch_size=1000, flush_interval=3600, inserts=inserts)
+    store.put_many('gpu_utilization_raw', [RAW, RAW])
+    store.put('broken', (1,))
+    store.flush()
+    assert raw_count(store) == 2
+    assert (store.rows_written, store.rows_dropped) == (2, 1)
+    assert '[ERROR] Dropped 1 rows for broken' in capsys.readouterr().out
+
+
+def test_transaction_rolls_back_on_error(open_store):
+    store = open_store()
+    with pytest.raises(RuntimeError):
+        with store.transaction() as conn:
+            conn.execute(INSERTS['gpu_utilization_raw'], RAW)
+            raise RuntimeError('aggregation failed')
+    assert raw_count(store) == 0
+    with store.transaction() as conn:
+        conn.execute(INSERTS['gpu_utilization_raw'], RAW)
+    assert raw_count(store) == 1
+
+
+def test_execute_sees_queued_rows(open_store):
+    store = open_store(batch_size=1000, flush_interval=3600)
+    store.put_many('gpu_utilization_raw', [RAW] * 3)
+    assert store.execute("DELETE FROM gpu_utilization_raw WHERE account = ?", ('physics',)) == 3
+
+
+def test_state_round_trip(open_store):
+    store = open_store()
+    assert store.get_state('last_run:monthly') is None
+    store.set_state('last_run:monthly', '2026-10-01T00:00:00')
+    store.set_state('last_run:monthly', '2026-11-01T00:00:00')
+    assert store.get_state('last_run:monthly') == '2026-11-01T00:00:00'
+    store.close()
+    assert open_store().get_state('last_run:monthly') == '2026-11-01T00:00:00'
+
+
+def test_old_databases_gain_the_added_columns(open_store, tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'utilization.db'))
+    # The original table: the missing comma made "usage_percent" part of usage_gb's type.
+    conn.execute("CREATE TABLE storage_usage (id INTEGER PRIMARY KEY AUTOINCREMENT, date DATE DEFAULT CURRENT_DATE, "
+                 "usage_gb REAL usage_percent REAL)")
+    conn.execute("INSERT INTO storage_usage (usage_gb) VALUES (1.5)")
+    conn.execute("CREATE TABLE gpu_utilization_raw (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                 "timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, account TEXT, utilization_percent REAL)")
+    conn.execute("INSERT INTO gpu_utilization_raw (account, utilization_percent) VALUES ('physics', 50.0)")
+    conn.commit()
+    conn.close()
+    store = open_store()
+    columns = {row[1] for row in store.query("PRAGMA table_info(storage_usage)")}
+    assert {'usage_percent', 'mount', 'used_bytes', 'used_inodes'} <= columns
+    store.put('storage_usage', ('2026-10-17 10:00:00', '2026-10-17 10:00:00', '/', 1.0, 10.0, 10, 1, 9, 10, 1))
+    store.flush()
+    assert store.query("SELECT usage_gb, mount FROM storage_usage ORDER BY id") == [(1.5, None), (1.0, '/')]
+    # Rows written before the samples column existed are single samples.
+    assert store.query("SELECT utilization_percent, samples FROM gpu_utilization_raw") == [(50.0, 1)]
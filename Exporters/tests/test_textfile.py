@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from poc_exporters.textfile import MetricFamily, TextfileWriter, format_value, render
+
+
+def families(value=1.5):
+    used = MetricFamily('gpu_account_used_hours_total', 'GPU hours\nused', ['account'], 'counter')
+    used.add_metric(['phy"sics\\'], value)
+    nodes = MetricFamily('gpu_nodes', 'Nodes')
+    nodes.add_metric([], 3)
+    return [used, nodes]
+
+
+def test_render_escapes_labels_and_help():
+    assert render(families()) == (
+        '# HELP gpu_account_used_hours_total GPU hours\\nused\n'
+        '# TYPE gpu_account_used_hours_total counter\n'
+        'gpu_account_used_hours_total{account="phy\\"sics\\\\"} 1.5\n'
+        '# HELP gpu_nodes Nodes\n'
+        '# TYPE gpu_nodes gauge\n'
+        'gpu_nodes 3\n')
+    assert [format_value(v) for v in (float('nan'), float('-inf'), True, '7', '0.5')] == \
+        ['NaN', '-Inf', '1', '7', '0.5']
+    with pytest.raises(ValueError):
+        MetricFamily('gpu_nodes', 'Nodes', ['node']).add_metric([], 1)
+
+
+def test_writes_only_changed_content(tmp_path):
+    path = tmp_path / 'gpu.prom'
+    writer = TextfileWriter(str(path), mode=0o640)
+    assert writer.write(families())
+    assert path.read_text() == render(families())
+    assert oct(os.stat(path).st_mode & 0o777) == '0o640'
+    inode = os.stat(path).st_ino
+    assert not writer.write(families())
+    assert os.stat(path).st_ino == inode
+    # A new writer (e.g. after a restart) compares with the file on disk.
+    assert not TextfileWriter(str(path)).write(families())
+    assert writer.write(families(2.5))
+    assert os.listdir(tmp_path) == ['gpu.prom']  # the temporary file was renamed over it
+
+
+def test_failed_write_keeps_the_previous_file(tmp_path, monkeypatch):
+    path = tmp_path / 'gpu.prom'
+    writer = TextfileWriter(str(path))
+    writer.write(families())
+
+    def fail(src, dst):
+        raise OSError('read-only file system')
+
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        writer.write(families(2.5))
+    assert path.read_text() == render(families())
+    assert os.listdir(tmp_path) == ['gpu.prom']  # no temporary file left behind
+    monkeypatch.undo()
+    assert writer.write(families(2.5))  # the failed content was not recorded as written